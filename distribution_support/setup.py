@@ -22,7 +22,7 @@ setup(
         "python3-logstash >= 0.4.80",
         "boto3 >= 1.9.0",
         "pyzmq >= 17.1.2",
-        "msgpack >= 0.6.0",
+        "msgpack >= 1.0",
         "python-magic >= 0.4.3",
     ],
 )
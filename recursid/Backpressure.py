@@ -0,0 +1,209 @@
+from collections import deque
+import itertools as it
+import multiprocessing as mp
+from typing import Any, List, Optional, Tuple
+
+from .BaseObject import BaseObject
+
+POLICY_BLOCK = "block"
+POLICY_DROP_NEWEST = "drop_newest"
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DROP_LOWEST_TTL = "drop_lowest_ttl"
+QUEUE_POLICIES = (POLICY_BLOCK, POLICY_DROP_NEWEST, POLICY_DROP_OLDEST,
+        POLICY_DROP_LOWEST_TTL)
+
+# Rough bytes an object takes up in a queue, besides its payload
+QUEUE_OBJECT_OVERHEAD = 512
+
+def queued_size(obj: BaseObject) -> int:
+    """
+    The approximate bytes obj takes up waiting in a queue
+    """
+    return obj.payload_size() + QUEUE_OBJECT_OVERHEAD
+
+class InputGauge:
+    """
+    Counts, in shared memory, the objects and bytes the router puts on a
+    module's input queue, and the module's workers take off it, so the
+    router knows how much is in flight
+
+    waker:
+        If given, its set method is called when workers take objects and
+        leave no more in flight than the router asked, with wake_at, so it
+        can send more without waiting to poll
+    """
+    def __init__(self, waker: Optional[Any] = None):
+        # Objects sent, bytes sent, objects taken, bytes taken, and the
+        # objects in flight at or below which to wake the router
+        self.counts = mp.Array("q", [0, 0, 0, 0, -1])
+        self.waker = waker
+
+    def sent(self, objs: int, size: int) -> None:
+        with self.counts.get_lock():
+            self.counts[0] += objs
+            self.counts[1] += size
+
+    def taken(self, objs: int, size: int) -> None:
+        with self.counts.get_lock():
+            self.counts[2] += objs
+            self.counts[3] += size
+            wake = self.counts[0] - self.counts[2] <= self.counts[4]
+        if wake and self.waker is not None:
+            self.waker.set()
+
+    def wake_at(self, objs: int) -> None:
+        """
+        Wake the router once no more than objs objects are in flight, or
+        never, if objs is negative
+        """
+        self.counts[4] = objs
+
+    def in_flight(self) -> Tuple[int, int]:
+        """
+        Objects and bytes sent but not yet taken
+        """
+        with self.counts.get_lock():
+            objs = self.counts[0] - self.counts[2]
+            size = self.counts[1] - self.counts[3]
+        # Payloads evicted from a BlobStore on the way measure smaller when
+        # taken, so bytes can drift - but not while nothing's in flight
+        if objs <= 0:
+            return 0, 0
+        return objs, max(size, 0)
+
+class Backlog:
+    """
+    The objects the router holds for a module with a limited queue, which
+    it sends on as the module's workers take what's in flight.  Whatever's
+    in flight and in the backlog together is held to limit objects and
+    bytes_limit bytes, by policy:
+
+    block:
+        Keep every object, and report the backlog full, so the framework
+        pauses InputEndpointModules until it isn't
+    drop_newest:
+        Drop objects that arrive while full
+    drop_oldest:
+        Drop the oldest waiting objects to make room
+    drop_lowest_ttl:
+        Drop the waiting objects with the lowest TTL to make room, the
+        oldest of them first
+
+    Objects in flight can't be dropped, so at most half the limits are put
+    in flight, leaving the policy the rest to choose from.  Objects are
+    sent on in the order they arrived.
+
+    policy:
+        One of QUEUE_POLICIES
+    limit, bytes_limit:
+        The most objects, and approximate bytes, to hold, or None for no
+        limit
+    """
+    def __init__(self, policy: str, limit: Optional[int],
+            bytes_limit: Optional[int]):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError("Unknown queue policy: {}".format(policy))
+        self.policy = policy
+        self.limit = limit
+        self.bytes_limit = bytes_limit
+        self.window = max(limit // 2, 1) if limit is not None else None
+        self.window_bytes = bytes_limit // 2 \
+                if bytes_limit is not None else None
+        # Objects waiting, in deques by TTL for drop_lowest_ttl, or all in
+        # one deque, of (arrival number, object, size)
+        self.buckets = {}
+        self.arrivals = it.count()
+        self.count = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def over(self, in_flight: Tuple[int, int], objs: int = 0,
+            size: int = 0) -> bool:
+        """
+        Whether holding objs more objects of size more bytes would go over
+        the limits
+        """
+        return (self.limit is not None and
+                    in_flight[0] + self.count + objs > self.limit) or \
+                (self.bytes_limit is not None and
+                    in_flight[1] + self.size + size > self.bytes_limit)
+
+    def full(self, in_flight: Tuple[int, int]) -> bool:
+        """
+        Whether the limits are reached
+        """
+        return (self.limit is not None and
+                    in_flight[0] + self.count >= self.limit) or \
+                (self.bytes_limit is not None and
+                    in_flight[1] + self.size >= self.bytes_limit)
+
+    def append(self, obj: BaseObject, size: int) -> None:
+        key = obj.ttl if self.policy == POLICY_DROP_LOWEST_TTL else 0
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = deque()
+        bucket.append((next(self.arrivals), obj, size))
+        self.count += 1
+        self.size += size
+
+    def popleft(self, key: int) -> Tuple[BaseObject, int]:
+        bucket = self.buckets[key]
+        _, obj, size = bucket.popleft()
+        if not bucket:
+            del self.buckets[key]
+        self.count -= 1
+        self.size -= size
+        return obj, size
+
+    def oldest_key(self) -> int:
+        return min(self.buckets, key=lambda key: self.buckets[key][0][0])
+
+    def add(self, obj: BaseObject, in_flight: Tuple[int, int]) \
+            -> List[BaseObject]:
+        """
+        Hold obj for the module, given what's in flight.  Return the
+        objects dropped to stay in the limits, which may include obj.
+        """
+        size = queued_size(obj)
+        if self.policy == POLICY_BLOCK or not self.over(in_flight, 1, size):
+            self.append(obj, size)
+            return []
+        if self.policy == POLICY_DROP_NEWEST:
+            return [obj]
+
+        self.append(obj, size)
+        dropped = []
+        while self.count and self.over(in_flight):
+            if self.policy == POLICY_DROP_OLDEST:
+                key = self.oldest_key()
+            else:
+                key = min(self.buckets)
+            dropped.append(self.popleft(key)[0])
+        return dropped
+
+    def take(self, in_flight: Tuple[int, int]) -> Tuple[List[BaseObject],
+            int]:
+        """
+        Take the objects that can go in flight now, given what already is,
+        and their total size
+        """
+        objs = []
+        total_size = 0
+        in_flight_objs, in_flight_size = in_flight
+        while self.count and (self.window is None or
+                in_flight_objs < self.window):
+            key = self.oldest_key()
+            size = self.buckets[key][0][2]
+            # Anything fits when nothing's in flight, or a payload bigger
+            # than the window could never go
+            if self.window_bytes is not None and in_flight_objs > 0 and \
+                    in_flight_size + size > self.window_bytes:
+                break
+            obj, size = self.popleft(key)
+            objs.append(obj)
+            total_size += size
+            in_flight_objs += 1
+            in_flight_size += size
+        return objs, total_size
@@ -1,20 +1,69 @@
 import itertools as it
 import logging
+import os
+import os.path
 import time
 import multiprocessing as mp
 import threading as thr
-from queue import Queue
+from queue import Queue, Empty
 from typing import List, Tuple, Dict, Any, Optional, Union
 
-from .CommandQueueCommands import CQC_DIE, CQC_RES
-from .BuiltinObjects import DeathLog
+from .CommandQueueCommands import CQC_DIE, CQC_RES, CQC_METRICS, \
+        CQC_PROFILE_START, CQC_PROFILE_STOP
+from .BaseObject import BaseObject
+from .BlobStore import BlobStore, activate_store
+from .BuiltinObjects import DeathLog, SpillAck
+from .Metrics import MetricsExporter, render_prometheus, process_snapshot
+from .Tracing import TraceExporter, make_span
+from .Profiling import ProfileControl
+from .Backpressure import Backlog, InputGauge, QUEUE_POLICIES, \
+        POLICY_BLOCK
+from .SpillLog import SpillLog
+from .InFlight import InFlightCounts
 from .modules.BuiltinInputEndpointModules import ReemitInputEndpointModule
 from .modules import all_iems, all_rems, all_oems
 from .modules.BaseModules import BaseModule
+from .RoutingTable import RoutingTable, DirectRouter
+from .ObjectBatcher import ObjectBatcher, unbatch, DEFAULT_BATCH_SIZE, \
+        DEFAULT_BATCH_LINGER
 
 DEFAULT_START_TTL = 5
 DEFAULT_RESOURCE_LOG_PERIOD = 60 # seconds
-PROCESSING_LOOP_SLEEP = .1
+# The longest the router blocks waiting for objects before checking module
+# health and periodic tasks
+ROUTER_MAX_WAIT = 1 # seconds
+# The longest the router waits for objects while shutting down, before
+# checking whether the pipeline has drained - it's woken as modules finish
+# what they were sent, so this only bounds missed wakeups
+SHUTDOWN_MAX_WAIT = .1 # seconds
+# How often the router checks whether modules with objects held back have
+# taken enough of what's in flight for it to send more, in case it isn't
+# woken when they have
+BACKLOG_MAX_WAIT = .01 # seconds
+# The most objects taken from one module per processing iteration, so one
+# busy module can't starve the rest
+ROUTER_MAX_DRAIN = 256
+# Batches of objects a module's workers are sent ahead of what they've
+# taken, each, when the rest wait in a SpillLog - as many as its memory
+# allows
+SPILL_IN_FLIGHT_BATCHES = 64
+
+# Config keys the framework takes from each module's config entry, rather
+# than passing on to the module, and their defaults
+MODULE_OPTION_DEFAULTS = {
+        "batch_size": DEFAULT_BATCH_SIZE,
+        "batch_linger": DEFAULT_BATCH_LINGER,
+        "workers": 1,
+        "queue_limit": None,
+        "queue_bytes": None,
+        "queue_policy": POLICY_BLOCK,
+        "queue_deathlogs": False,
+        }
+
+# Top level config keys passed to the framework as keyword arguments
+FRAMEWORK_OPTION_KEYS = ["direct_reemit", "blob_store", "metrics",
+        "tracing", "profiling", "spill", "shutdown_timeout"]
+BLOB_EVICT_PERIOD = 60 # seconds
 
 class BaseFramework:
     """
@@ -24,33 +73,40 @@ class BaseFramework:
     Properties that get defined on this instance are:
     self.iems: List[
                 Dict[str,
-                  Union[InputEndpointModule, mp.Process, thr.Thread, Queue,
-                            Queue, Queue]
+                  Union[InputEndpointModule, List[Dict], Queue, Queue, Dict]
                     ]
                 ]
     self.rems: List[
                 Dict[str,
-                  Union[ReemitterModule, mp.Process, thr.Thread, Queue,
-                            Queue, Queue]
+                  Union[ReemitterModule, List[Dict], Queue, Queue, Dict]
                     ]
                 ]
     self.oems: List[
                 Dict[str,
-                  Union[OutputEndpointModule, mp.Process, thr.Thread, Queue,
-                            Queue, Queue]
+                  Union[OutputEndpointModule, List[Dict], Queue, Queue, Dict]
                     ]
                 ]
     self.reemitter: 
                 Dict[str,
-                  Union[OutputEndpointModule, mp.Process, thr.Thread, Queue,
-                            Queue, Queue]
+                  Union[OutputEndpointModule, List[Dict], Queue, Queue, Dict]
                     ]
+
+    Each module runs as one or more workers, which share the module's
+    send_queue and recv_queue.  Each worker is a dictionary holding its
+    process, cmd_queue, and proc_lock.
     """
     def __init__(self,
             iems: List[Tuple[str, Dict[str, Any]]],
             rems: List[Tuple[str, Dict[str, Any]]],
             oems: List[Tuple[str, Dict[str, Any]]],
             start_ttl: Optional[int] = None,
+            direct_reemit: bool = False,
+            blob_store: Optional[Dict[str, Any]] = None,
+            metrics: Optional[Dict[str, Any]] = None,
+            tracing: Optional[Dict[str, Any]] = None,
+            profiling: Optional[Dict[str, Any]] = None,
+            spill: Optional[Dict[str, Any]] = None,
+            shutdown_timeout: Optional[float] = None,
             ):
         """
         iems, rems, and oems:
@@ -60,24 +116,130 @@ class BaseFramework:
             ReemitterModules, and OutputEndpointModules respectively
         start_ttl:
             The maximum times an object may be reemitted after initial ingest
+        direct_reemit:
+            If True, ReemitterModules put the objects they reemit straight
+            on the input queues of the modules that handle them, skipping
+            the trip through the framework and ReemitInputEndpointModule
+        blob_store:
+            If given, large binary payloads are stored once in a BlobStore
+            shared by all modules, rather than copied through every queue.
+            A dictionary of keyword arguments for BlobStore - path,
+            threshold, and ttl - all optional.
+        metrics:
+            If given, every module's counters, handle_object latencies, CPU
+            time and memory are collected each period, and published in
+            the Prometheus text format.  A dictionary of keyword arguments
+            for MetricsExporter - port to serve them on, host, file to
+            write them to, and period - all optional.
+        tracing:
+            If given, a sample of the objects InputEndpointModules emit, and
+            everything made from them, are traced.  Spans for each one's
+            emission, routing, wait in each module's queue, and handling
+            by each module are written to a JSON lines file.  A dictionary
+            of keyword arguments for TraceExporter - file, and optionally
+            sample_rate.
+        profiling:
+            If given, modules can be told to profile themselves, with
+            cProfile and tracemalloc, for a while, and write the stats to
+            a directory.  Requests come from a local control socket, or
+            PROFILE_SIGNAL, which profiles every module.  A dictionary of
+            keyword arguments for ProfileControl - directory, and
+            optionally socket and duration.
+        spill:
+            If given, the objects bound for each ReemitterModule and
+            OutputEndpointModule are kept in a SpillLog on disk, until
+            the module has handled them, and any a crash interrupts are
+            replayed by the next run.  Objects past what fits in the
+            logs' memory wait only on disk.  A dictionary with directory,
+            which gets a log for each module, and optionally the other
+            keyword arguments for SpillLog - memory, segment_size, and
+            fsync.
+        shutdown_timeout:
+            If given, the most seconds to wait at shutdown for the objects
+            in the pipeline to be handled, after which modules are told to
+            die anyway, and what's left is counted in the log - or kept in
+            the SpillLogs, to be replayed, with spill.  By default, shutdown
+            waits for every object.
         """
         self.logger = logging.getLogger(self.__class__.__name__)
         self.start_ttl = start_ttl if start_ttl is not None else \
                 DEFAULT_START_TTL
+        if shutdown_timeout is not None and (
+                not isinstance(shutdown_timeout, (int, float)) or
+                shutdown_timeout <= 0):
+            self.logger.critical("shutdown_timeout must be a positive "
+                    "number of seconds: {}".format(shutdown_timeout))
+            exit(1)
+        self.shutdown_timeout = shutdown_timeout
         self.last_res_log_time = time.time()
 
+        # The store must be active before workers start, so they share it
+        self.blob_store = None
+        self.last_blob_evict_time = time.time()
+        if blob_store is not None:
+            self.blob_store = BlobStore(**blob_store)
+            activate_store(self.blob_store)
+
+        # Modules are given the metrics queue as they're created
+        self.metrics_exporter = None
+        self.metrics_queue = None
+        self.module_snapshots = {}
+        self.last_metrics_time = time.time()
+        if metrics is not None:
+            self.metrics_queue = self.make_queue()
+        self.trace_exporter = None
+        self.trace_queue = None
+        if tracing is not None:
+            self.trace_exporter = TraceExporter(**tracing)
+            self.trace_queue = self.make_queue()
+        self.profile_control = None
+        # id of worker -> (worker, when to stop profiling it)
+        self.profiling_workers = {}
+        self.profile_dir = None
+        if profiling is not None:
+            if "directory" not in profiling:
+                self.logger.critical("profiling needs a directory to write "
+                        "stats to")
+                exit(1)
+            self.profile_dir = profiling["directory"]
+
+        if spill is not None:
+            # The logs must hold whole objects, to replay them, and see
+            # every object bound for a module
+            if blob_store is not None or direct_reemit:
+                self.logger.critical("spill can't be used with blob_store "
+                        "or direct_reemit")
+                exit(1)
+        self.spill_logs = {}
+        # Acknowledgements wait until the objects routed before them are
+        # in the logs of the modules they're bound for
+        self.spill_acks = []
+
         # Recover the actual module classes from each module name
         # Errors will be raised here if a module doesn't exist/isn't registed
         try:
-            iem_mods = [(all_iems[mod_name], kwargs)
+            iem_mods = [(all_iems[mod_name],
+                        *self.parse_module_options(kwargs))
                     for mod_name, kwargs in iems]
         except KeyError as e:
             self.logger.critical("Input endpoint module not found: {}"
                     "".format(e))
             exit(1)
 
+        for mod, options, kwargs in iem_mods:
+            if options["workers"] != 1:
+                self.logger.critical("Input endpoint modules only run as one "
+                        "worker: {}".format(mod.__name__))
+                exit(1)
+            if options["queue_limit"] is not None or \
+                    options["queue_bytes"] is not None:
+                self.logger.critical("Input endpoint modules have no input "
+                        "queue to limit: {}".format(mod.__name__))
+                exit(1)
+
         try:
-            rem_mods = [(all_rems[mod_name], kwargs)
+            rem_mods = [(all_rems[mod_name],
+                        *self.parse_module_options(kwargs))
                     for mod_name, kwargs in rems]
         except KeyError as e:
             self.logger.critical("Reemiter module not found: {}"
@@ -85,65 +247,333 @@ class BaseFramework:
             exit(1)
 
         try:
-            oem_mods = [(all_oems[mod_name], kwargs)
+            oem_mods = [(all_oems[mod_name],
+                        *self.parse_module_options(kwargs))
                     for mod_name, kwargs in oems]
         except KeyError as e:
             self.logger.critical("Output endpoint module not found: {}"
                     "".format(e))
             exit(1)
 
+        # Reemitted objects would go straight to limited queues, past
+        # their backlogs
+        if direct_reemit:
+            for mod, options, kwargs in it.chain(rem_mods, oem_mods):
+                if options["queue_limit"] is not None or \
+                        options["queue_bytes"] is not None:
+                    self.logger.critical("Modules can't have queue limits "
+                            "with direct_reemit: {}".format(mod.__name__))
+                    exit(1)
+
+        if spill is not None:
+            for mod, options, kwargs in it.chain(rem_mods, oem_mods):
+                if options["queue_limit"] is not None or \
+                        options["queue_bytes"] is not None:
+                    self.logger.critical("Modules can't have queue limits "
+                            "when objects spill to disk: {}".format(
+                                mod.__name__))
+                    exit(1)
+
         # Now that config is parsed a bit, start up the modules
         self.iems = []
         self.rems = []
         self.oems = []
         self.reemitter = None
+        # The reemitter passes on everything the rems send, so batch its
+        # output as much as any of theirs
+        reemitter_options = dict(MODULE_OPTION_DEFAULTS)
+        reemitter_options["batch_size"] = max(
+                [options["batch_size"] for mod, options, kwargs in rem_mods],
+                default=DEFAULT_BATCH_SIZE)
         try:
-            self.reemitter = self.start_module(ReemitInputEndpointModule)
-
-            # Start each module with its args, and setup the structures needed
-            self.iems = [self.start_module(mod, **kwargs)
-                    for mod, kwargs in iem_mods]
-            self.rems = [self.start_module(mod, **kwargs)
-                    for mod, kwargs in rem_mods]
-            self.oems = [self.start_module(mod, **kwargs)
-                    for mod, kwargs in oem_mods]
+            self.reemitter = self.create_module(ReemitInputEndpointModule,
+                    reemitter_options)
+
+            # Create each module with its args, and setup the structures
+            # needed.  Every module's queues must exist before any start,
+            # so reemitters can be given the queues of their targets.
+            self.iems = [self.create_module(mod, options, **kwargs)
+                    for mod, options, kwargs in iem_mods]
+            self.rems = [self.create_module(mod, options, **kwargs)
+                    for mod, options, kwargs in rem_mods]
+            self.oems = [self.create_module(mod, options, **kwargs)
+                    for mod, options, kwargs in oem_mods]
+
+            self.name_modules()
+            # Before direct reemit, whose routers count what they send to
+            # every module
+            self.setup_in_flight()
+            self.setup_backpressure()
+            if spill is not None:
+                self.setup_spill(**spill)
+            if direct_reemit:
+                self.setup_direct_reemit()
+
+            for em in self.all_modules():
+                for worker in em["workers"]:
+                    worker["process"].start()
         except:
             # If modules errored out, kill them all and die
             for em in it.chain(self.iems, self.rems, self.oems,
                     [self.reemitter]):
                 try:
-                    em["process"].kill()
+                    [worker["process"].kill() for worker in em["workers"]]
                 except BaseException as e:
                     self.logger.error("Exception when killing all modules "
                             "after startup error:")
                     self.logger.exception(e)
             raise
 
+        # Objects bound for each module collect here during a processing
+        # iteration, then get sent in batches
+        for em in it.chain(self.rems, self.oems, [self.reemitter]):
+            em["outbox"] = []
+
+        self.routing_table = RoutingTable(self.rems + self.oems)
         self.time_to_die = False
 
-    def start_module(self, mod: BaseModule, *args, **kwargs) -> \
-            Dict[str, Union[BaseModule, mp.Process, thr.Thread,
-                mp.Queue, Queue, mp.Lock, thr.Lock]]:
-        raise RuntimeError("Tried to run start_module on framework base")
+        # Only once the workers are started, so module processes don't
+        # inherit the sockets, threads or signal handler
+        if metrics is not None:
+            self.metrics_exporter = MetricsExporter(**metrics)
+        if profiling is not None:
+            self.profile_control = ProfileControl(**profiling,
+                    describe=self.describe_workers)
+
+    def parse_module_options(self, kwargs: Dict[str, Any]) -> \
+            Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Split a module's config entry into the options the framework handles
+        and the keyword arguments for the module itself
+        """
+        kwargs = dict(kwargs)
+        options = {key: kwargs.pop(key, default)
+                for key, default in MODULE_OPTION_DEFAULTS.items()}
+
+        if not isinstance(options["batch_size"], int) or \
+                options["batch_size"] < 1:
+            self.logger.critical("batch_size must be an integer of at "
+                    "least 1: {}".format(options["batch_size"]))
+            exit(1)
+        if not isinstance(options["batch_linger"], (int, float)) or \
+                options["batch_linger"] < 0:
+            self.logger.critical("batch_linger must be a non-negative "
+                    "number of seconds: {}".format(options["batch_linger"]))
+            exit(1)
+        if not isinstance(options["workers"], int) or \
+                options["workers"] < 1:
+            self.logger.critical("workers must be an integer of at "
+                    "least 1: {}".format(options["workers"]))
+            exit(1)
+        for key in ("queue_limit", "queue_bytes"):
+            if options[key] is not None and (
+                    not isinstance(options[key], int) or options[key] < 1):
+                self.logger.critical("{} must be an integer of at least 1: "
+                        "{}".format(key, options[key]))
+                exit(1)
+        if options["queue_policy"] not in QUEUE_POLICIES:
+            self.logger.critical("queue_policy must be one of {}: {}".format(
+                    ", ".join(QUEUE_POLICIES), options["queue_policy"]))
+            exit(1)
+
+        return options, kwargs
+
+    def module_init_options(self, module_options: Dict[str, Any],
+            worker_id: int) -> Dict[str, Any]:
+        """
+        Return the keyword arguments for instantiating one worker of a
+        module, based on its options
+        """
+        return {
+                "batch_size": module_options["batch_size"],
+                "batch_linger": module_options["batch_linger"],
+                "worker_id": worker_id,
+                "worker_count": module_options["workers"],
+                "metrics_queue": self.metrics_queue,
+                "trace_queue": self.trace_queue,
+                "trace_sample_rate": self.trace_exporter.sample_rate
+                    if self.trace_exporter is not None else 0,
+                "profile_dir": self.profile_dir,
+                }
+
+    def create_module(self, mod: BaseModule, module_options: Dict[str, Any],
+            *args, **kwargs) -> \
+            Dict[str, Union[BaseModule, List[Dict], Queue, Dict]]:
+        """
+        Create the queues and workers for a module, without starting the
+        workers' processes or threads
+        """
+        raise RuntimeError("Tried to run create_module on framework base")
 
-    def __command_death(self, modules):
+    def name_modules(self) -> None:
+        """
+        Name every module for its class, numbered in config order, so a
+        class configured more than once gets the same names from run to
+        run, and tell its workers their module's name
+        """
+        counts = {}
+        for em in self.all_modules():
+            cls_name = em["module"].__name__
+            em["name"] = "{}-{}".format(cls_name, counts.get(cls_name, 0))
+            counts[cls_name] = counts.get(cls_name, 0) + 1
+            for worker in em["workers"]:
+                worker["instance"].instance_name = em["name"]
+
+    def setup_in_flight(self) -> None:
+        """
+        Give every module a slot in one InFlightCounts, which its workers,
+        and whatever sends it objects, count the objects it's sent, handles,
+        and sends on with
+        """
+        modules = list(self.all_modules())
+        self.in_flight = InFlightCounts(len(modules),
+                self.make_router_waker())
+        for slot, em in enumerate(modules):
+            em["in_flight"] = self.in_flight.module(slot)
+            # Objects the router has taken from the module
+            em["received"] = 0
+            for worker in em["workers"]:
+                worker["instance"].in_flight = em["in_flight"]
+
+    def setup_backpressure(self) -> None:
+        """
+        Give each module with a limited queue a Backlog, where the router
+        holds the objects bound for it, and an InputGauge its workers
+        count the objects they take with.  If any module's policy is to
+        block, give the InputEndpointModules a gate, which the router
+        closes while any such module is full.
+        """
+        self.ingest_gate = None
+        for em in it.chain(self.rems, self.oems):
+            options = em["options"]
+            if options["queue_limit"] is None and \
+                    options["queue_bytes"] is None:
+                continue
+            em["backlog"] = Backlog(options["queue_policy"],
+                    options["queue_limit"], options["queue_bytes"])
+            em["input_gauge"] = InputGauge(self.make_router_waker())
+            em["dropped"] = 0
+            for worker in em["workers"]:
+                worker["instance"].input_gauge = em["input_gauge"]
+            if options["queue_policy"] == POLICY_BLOCK:
+                self.ingest_gate = mp.Event()
+
+        if self.ingest_gate is not None:
+            self.ingest_gate.set()
+            # Not the reemitter - only new objects are held back, so
+            # objects already in the pipeline can always make their way
+            # through it
+            for iem in self.iems:
+                for worker in iem["workers"]:
+                    worker["instance"].ingest_gate = self.ingest_gate
+
+    def setup_spill(self, directory: str, **kwargs) -> None:
+        """
+        Give each ReemitterModule and OutputEndpointModule a SpillLog, in
+        a directory named for the module, which the router keeps the
+        objects bound for it in, and an InputGauge its workers count the
+        objects they take with.  Objects left in the logs by an earlier
+        run are replayed.
+        """
+        names = set()
+        for em in it.chain(self.rems, self.oems):
+            # Named for modules configured more than once, so each has the
+            # same log from run to run
+            name = em["name"]
+            names.add(name)
+            em["spill"] = SpillLog(os.path.join(directory, name), **kwargs)
+            em["input_gauge"] = InputGauge(self.make_router_waker())
+            self.spill_logs[name] = em["spill"]
+            for worker in em["workers"]:
+                worker["instance"].spill_log = name
+                worker["instance"].input_gauge = em["input_gauge"]
+
+        for name in sorted(set(os.listdir(directory)) - names):
+            self.logger.warning("Not replaying {}, no such module is "
+                    "configured".format(os.path.join(directory, name)))
+
+    def make_queue(self) -> Any:
+        """
+        Return a queue module workers can send the framework metrics and
+        spans on, whose puts have all arrived once the workers are joined
+        """
+        return mp.Queue()
+
+    def make_router_waker(self) -> Optional[Any]:
+        """
+        Return an object whose set method, called from any module worker,
+        wakes the router from wait_for_objects, or None if there's no way
+        to
+        """
+        return None
+
+    def backlogged(self) -> bool:
+        """
+        Whether the router is holding objects back from any module
+        """
+        return any(em.get("backlog") or em.get("spill")
+                for em in it.chain(self.rems, self.oems))
+
+    def setup_direct_reemit(self) -> None:
+        """
+        Give every ReemitterModule worker a DirectRouter over the input
+        queues of all the ReemitterModules and OutputEndpointModules
+        """
+        for rem in self.rems:
+            for worker in rem["workers"]:
+                targets = [{
+                        "module": em["module"],
+                        "batcher": ObjectBatcher(em["send_queue"],
+                            em["options"]["batch_size"],
+                            em["options"]["batch_linger"],
+                            em["in_flight"].sent),
+                        } for em in it.chain(self.rems, self.oems)]
+                worker["instance"].direct_router = DirectRouter(targets)
+
+    def wait_for_objects(self, timeout: float) -> None:
+        """
+        Block until any module has sent the framework an object, an IEM
+        has exited, or timeout seconds have passed
+        """
+        raise RuntimeError("Tried to run wait_for_objects on framework base")
+
+    def __send_command(self, modules, cmd: str) -> None:
+        """
+        Send a command to every worker of the given modules
+        """
         for em in modules:
-            em["cmd_queue"].put(CQC_DIE)
+            for worker in em["workers"]:
+                worker["cmd_queue"].put(cmd)
+
+    def all_modules(self):
+        """
+        Iterate over every module, including the reemitter
+        """
+        return it.chain(self.iems, self.rems, self.oems, [self.reemitter])
 
     def command_die(self) -> None:
         """
         Tell all modules to die, and command this base to die
         """
         self.time_to_die = True
-        self.__command_death(
-                it.chain(self.iems, self.rems, self.oems, [self.reemitter])
-                )
+        self.__send_command(self.all_modules(), CQC_DIE)
 
     def command_iems_to_die(self) -> None:
         """
         Tell just the iems to die
         """
-        self.__command_death(self.iems)
+        self.__send_command(self.iems, CQC_DIE)
+
+    def evict_blobs(self, period_secs: int = BLOB_EVICT_PERIOD) -> None:
+        """
+        Periodically remove blobs past their ttl from the BlobStore
+        """
+        if self.blob_store is None:
+            return
+        if (time.time() - self.last_blob_evict_time) < period_secs:
+            return
+        self.last_blob_evict_time = time.time()
+        self.blob_store.evict_expired()
 
     def log_module_resource_usage(self,
             period_secs : int = DEFAULT_RESOURCE_LOG_PERIOD) -> None:
@@ -156,9 +586,129 @@ class BaseFramework:
         if (time.time() - self.last_res_log_time) < period_secs:
             return
         self.last_res_log_time = time.time()
-        for em in it.chain(self.iems, self.rems, self.oems, [self.reemitter]):
-            em["cmd_queue"].put(CQC_RES)
+        self.__send_command(self.all_modules(), CQC_RES)
+
+    def update_metrics(self) -> None:
+        """
+        Publish any module metrics that have arrived, and periodically ask
+        every module for its metrics again
+        """
+        if self.metrics_exporter is None:
+            return
+        self.receive_metrics()
+
+        if (time.time() - self.last_metrics_time) < \
+                self.metrics_exporter.period:
+            return
+        self.last_metrics_time = time.time()
+        self.__send_command(self.all_modules(), CQC_METRICS)
 
+    def receive_metrics(self) -> None:
+        """
+        Publish the module metrics that have arrived, if any have
+        """
+        received = False
+        while True:
+            try:
+                snapshot = self.metrics_queue.get(False)
+            except Empty:
+                break
+            self.module_snapshots[snapshot["instance"],
+                    snapshot["worker"]] = snapshot
+            received = True
+        if received:
+            self.publish_metrics()
+
+    def matching_workers(self, module: Optional[str],
+            worker_id: Optional[int]) -> List[Dict[str, Any]]:
+        """
+        The workers of the module with class name module, or of every
+        module if it's None - worker worker_id of each, or all of them if
+        it's None
+        """
+        return [worker for em in self.all_modules()
+                if module is None or em["module"].__name__ == module
+                for num, worker in enumerate(em["workers"])
+                if worker_id is None or num == worker_id]
+
+    def describe_workers(self, module: Optional[str],
+            worker_id: Optional[int]) -> Optional[str]:
+        count = len(self.matching_workers(module, worker_id))
+        if count == 0:
+            return None
+        return "{} worker{} of {}".format(count, "s" if count > 1 else "",
+                module if module is not None else "every module")
+
+    def update_profiling(self) -> None:
+        """
+        Start the profiling requested, and stop it when its time is up
+        """
+        if self.profile_control is None:
+            return
+        now = time.monotonic()
+        for module, worker_id, seconds in \
+                self.profile_control.pop_requests():
+            for worker in self.matching_workers(module, worker_id):
+                if id(worker) not in self.profiling_workers:
+                    worker["cmd_queue"].put(CQC_PROFILE_START)
+                self.profiling_workers[id(worker)] = (worker, now + seconds)
+        for key, (worker, stop_time) in list(self.profiling_workers.items()):
+            if now >= stop_time:
+                worker["cmd_queue"].put(CQC_PROFILE_STOP)
+                del self.profiling_workers[key]
+
+    def receive_spans(self) -> None:
+        """
+        Write out the spans modules have sent
+        """
+        if self.trace_exporter is None:
+            return
+        received = False
+        while True:
+            try:
+                spans = self.trace_queue.get(False)
+            except Empty:
+                break
+            self.trace_exporter.write(spans)
+            received = True
+        if received:
+            self.trace_exporter.flush()
+
+    def trace_route(self, obj: BaseObject) -> None:
+        """
+        Record the span of a traced object making its way from the module
+        that sent it through routing, which ends now, as it's placed in
+        the outboxes of the modules that handle it
+        """
+        now = time.time()
+        trace_id, parent_id, queued = obj.trace
+        self.trace_exporter.write([make_span("route", obj,
+                obj.obj_id + "/route", parent_id, self.__class__.__name__,
+                0, queued, now)])
+        obj.trace = (trace_id, parent_id, now)
+
+    def publish_metrics(self) -> None:
+        """
+        Render the latest metrics of every module, with this process's own
+        and each module's queue depths, and publish them
+        """
+        snapshots = list(self.module_snapshots.values())
+        snapshots.append(process_snapshot(self.__class__.__name__,
+                "{}-0".format(self.__class__.__name__)))
+        queue_depths = []
+        drops = []
+        for em in self.all_modules():
+            labels = (em["module"].__name__, em["name"])
+            queue_depths.append((*labels, "in", em["send_queue"].qsize()))
+            queue_depths.append((*labels, "out", em["recv_queue"].qsize()))
+            if "backlog" in em:
+                queue_depths.append((*labels, "backlog",
+                        len(em["backlog"])))
+                drops.append((*labels, em["dropped"]))
+            if "spill" in em:
+                queue_depths.append((*labels, "spill", len(em["spill"])))
+        self.metrics_exporter.publish(render_prometheus(snapshots,
+                queue_depths, drops))
 
     def main(self) -> None:
         """
@@ -170,10 +720,11 @@ class BaseFramework:
             objs_handled_last_time = True
             while objs_handled_last_time:
                 objs_handled_last_time = self.processing_iteration()
-            time.sleep(PROCESSING_LOOP_SLEEP)
+            self.wait_for_objects(BACKLOG_MAX_WAIT if self.backlogged()
+                    else ROUTER_MAX_WAIT)
 
             # If all the iems have exited, it's time to die
-            iems_live = (iem["process"].is_alive() for iem in self.iems)
+            iems_live = (self.any_worker_alive(iem) for iem in self.iems)
             if not any(iems_live):
                 self.logger.debug("All IEMs found dead")
                 iems_rems_oems_still_available = False
@@ -181,59 +732,295 @@ class BaseFramework:
             # If any rems or oems have died, allow the process to die too.
             # Rems and oems shouldn't die until commanded to at shutdown,
             # currently.
-            rems_live = (rem["process"].is_alive() for rem in self.rems)
-            oems_live = (oem["process"].is_alive() for oem in self.oems)
+            rems_live = (self.all_workers_alive(rem) for rem in self.rems)
+            oems_live = (self.all_workers_alive(oem) for oem in self.oems)
             if not (all(rems_live) and all(oems_live)):
                 self.logger.debug("Some REM or OEM found dead - dying")
                 iems_rems_oems_still_available = False
 
+            self.evict_blobs()
+
         # Tell any remaining iems to die - for instance, if we initiated
         # shutdown for any reason other than all the iems dying
         self.logger.debug("Commanding IEMs to die")
         self.command_iems_to_die()
 
-        # Before dying, we need to have no modules processing data and
-        # all queues empty, or data will die in the pipeline prematurely
-        queues_empty = False
-        while not queues_empty:
-            # Hold the lock on all modules - modules only release the
-            # lock when they're not processing, so this essentially
-            # waits until all processing is stopped
-            rem_oem_reem_locks = [em["proc_lock"]
-                    for em in it.chain(self.rems, self.oems, [self.reemitter])]
-            self.logger.debug(
-                    "Attempting to hold REM OEM REEM locks for shutdown")
-            [lock.acquire() for lock in rem_oem_reem_locks]
-
-            # Then, see if all the queues are empty
-            # Only check queues for alive modules, because dead modules, 
-            # like those that crashed, can never empty their queues
-            self.logger.debug("Looking for any data in queues")
-            queues = ((em["send_queue"], em["recv_queue"])
-                    for em in it.chain(self.rems, self.oems, [self.reemitter])
-                    if em["process"].is_alive())
-            if all(queue.empty() for queue in it.chain.from_iterable(queues)):
-                break
+        # Before dying, every object in the pipeline needs handling, or
+        # data will die in the pipeline prematurely
+        if not self.drain_pipeline():
+            self.logger.warning("Shutdown deadline of {} seconds passed "
+                    "with objects still in the pipeline".format(
+                        self.shutdown_timeout))
+        self.command_die()
 
-            self.logger.debug("Releasing REM OEM REEM locks for another "
-                    "go-round")
-            [lock.release() for lock in rem_oem_reem_locks]
+        # Keep routing while modules exit, so none are stuck sending the
+        # last of their objects
+        while any(self.any_worker_alive(em) for em in self.all_modules()):
+            if not self.processing_iteration():
+                self.wait_for_objects(SHUTDOWN_MAX_WAIT)
+        while self.processing_iteration():
+            pass
 
-            # Do another processing iteration to hopefully wrap things up
-            objs_handled_last_time = self.processing_iteration()
-            # Let the locks try to get picked up...
-            time.sleep(.1)
+        # At the end of the program, join all the modules
+        for em in self.all_modules():
+            for worker in em["workers"]:
+                worker["process"].join()
+        self.drain_unhandled()
 
-        self.command_die()
-        self.logger.debug("Releasing REM OEM REEM locks for death")
-        [lock.release() for lock in rem_oem_reem_locks]
+        if self.blob_store is not None:
+            activate_store(None)
+            self.blob_store.remove_all()
 
-        # At the end of the program, join all the modules
-        for em in it.chain(self.iems, self.rems, self.oems, [self.reemitter]):
-            em["process"].join()
+        # Every module sent its final metrics as it exited
+        if self.metrics_exporter is not None:
+            self.receive_metrics()
+            self.metrics_exporter.close()
+        if self.trace_exporter is not None:
+            self.receive_spans()
+            self.trace_exporter.close()
+        # Modules write out any profile still running as they exit
+        if self.profile_control is not None:
+            self.profile_control.close()
+        for name, spill_log in self.spill_logs.items():
+            left = spill_log.unacknowledged()
+            spill_log.close()
+            if left:
+                self.logger.warning("{} objects for {} weren't handled, "
+                        "they'll be replayed next run".format(left, name))
 
         self.logger.debug("Framework has died gracefully")
 
+    def drain_pipeline(self) -> bool:
+        """
+        Keep routing objects until none are in flight anywhere in the
+        pipeline, or the shutdown deadline passes.  Return whether the
+        pipeline drained.
+        """
+        deadline = time.monotonic() + self.shutdown_timeout \
+                if self.shutdown_timeout is not None else None
+        self.in_flight.watch()
+        while not self.pipeline_empty():
+            wait = BACKLOG_MAX_WAIT if self.backlogged() \
+                    else SHUTDOWN_MAX_WAIT
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            if not self.processing_iteration():
+                self.wait_for_objects(wait)
+        return True
+
+    def pipeline_empty(self) -> bool:
+        """
+        Whether every InputEndpointModule has exited, and every object sent
+        to a live module has been handled, and every object sent to the
+        framework routed, with none held back.  Modules that died, like
+        those that crashed, can never handle what they were sent, so
+        aren't waited on.
+        """
+        if any(self.any_worker_alive(iem) for iem in self.iems):
+            return False
+        # Checked before the counts are read, so a module can't send more
+        # after they are, then exit
+        live_ems = [em
+                for em in it.chain(self.rems, self.oems, [self.reemitter])
+                if self.any_worker_alive(em)]
+        counts = self.in_flight.snapshot()
+        if any(counts[iem["in_flight"].slot][2] != iem["received"]
+                for iem in self.iems):
+            return False
+        for em in live_ems:
+            sent, handled, emitted = counts[em["in_flight"].slot]
+            if sent != handled or emitted != em["received"]:
+                return False
+            # A SpillLog knows exactly what its module has yet to
+            # acknowledge, acknowledgements themselves included
+            if em.get("backlog") or ("spill" in em and
+                    em["spill"].unacknowledged()):
+                return False
+        return True
+
+    def drain_unhandled(self) -> None:
+        """
+        Once every module has exited, take back the objects left in their
+        input queues, and log how many each module never handled.  With
+        SpillLogs, objects are still in them, to be replayed next run, or
+        were made from objects that are, and will be made again.
+        """
+        counts = self.in_flight.snapshot()
+        for em in it.chain(self.rems, self.oems, [self.reemitter]):
+            sent, handled, emitted = counts[em["in_flight"].slot]
+            left = []
+            while len(left) < sent - handled:
+                try:
+                    left.extend(unbatch(em["send_queue"].get(
+                            timeout=SHUTDOWN_MAX_WAIT)))
+                except Empty:
+                    break
+            unhandled = sent - handled + len(em.get("backlog", ()))
+            if not unhandled or self.spill_logs:
+                continue
+            name = em["module"].__name__
+            self.logger.warning("{} objects sent to {} were never "
+                    "handled".format(unhandled, name))
+            # Rendering the objects is costly, only do it if it'll show
+            if self.logger.isEnabledFor(logging.DEBUG):
+                for obj in left:
+                    self.logger.debug("Object not handled by {}: {}".format(
+                            name, obj))
+
+    @staticmethod
+    def any_worker_alive(em: Dict[str, Any]) -> bool:
+        return any(worker["process"].is_alive() for worker in em["workers"])
+
+    @staticmethod
+    def all_workers_alive(em: Dict[str, Any]) -> bool:
+        return all(worker["process"].is_alive() for worker in em["workers"])
+
+    def receive_objects(self, em: Dict[str, Any]) -> List[BaseObject]:
+        """
+        Take the objects a module has sent the framework, unbatched, up to
+        around ROUTER_MAX_DRAIN of them
+        """
+        queue = em["recv_queue"]
+        objs = []
+        while len(objs) < ROUTER_MAX_DRAIN and not queue.empty():
+            objs.extend(unbatch(queue.get()))
+        em["received"] += len(objs)
+        return objs
+
+    def route_object(self, obj: BaseObject) -> None:
+        """
+        Place an object in the outbox of every module that can handle it,
+        or a DeathLog for it in the reemitter's outbox if it's out of TTL
+        or nothing can handle it.  Acknowledgements from modules are kept
+        for their SpillLogs.
+        """
+        if self.spill_logs and isinstance(obj, SpillAck):
+            self.spill_acks.append(obj)
+            return
+
+        if obj.ttl < 0:
+            """
+            self.logger.debug("Object died from low TTL: {}".format(obj))
+            """
+            self.reemitter["outbox"].append(DeathLog(obj))
+            return
+
+        handlers = self.routing_table.lookup(obj.__class__)
+        if obj.trace is not None and handlers and \
+                self.trace_exporter is not None:
+            self.trace_route(obj)
+        for em in handlers:
+            em["outbox"].append(obj)
+
+        # Handle the case where no module could handle an object
+        if not handlers:
+            # Nothing handles DeathLogs, so wrapping this in another
+            # would loop forever
+            if isinstance(obj, DeathLog):
+                return
+            # Rendering the object is costly, only do it if it'll show
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Object had no handler: {}".format(obj))
+            self.reemitter["outbox"].append(DeathLog(obj))
+
+    def drop_object(self, em: Dict[str, Any], obj: BaseObject) -> None:
+        """
+        Count an object dropped from a full module queue, and put a DeathLog
+        for it in the reemitter's outbox, if the module is configured to
+        """
+        em["dropped"] += 1
+        if em["options"]["queue_deathlogs"] and \
+                not isinstance(obj, DeathLog):
+            self.reemitter["outbox"].append(DeathLog(obj))
+
+    def hold_objects(self, em: Dict[str, Any], objs: List[BaseObject]) \
+            -> List[BaseObject]:
+        """
+        Add objects bound for a module with a limited queue to its backlog,
+        dropping whatever its policy says to, and return the objects that
+        can be sent to it now
+        """
+        backlog = em["backlog"]
+        gauge = em["input_gauge"]
+        in_flight = gauge.in_flight()
+        for obj in objs:
+            for dropped in backlog.add(obj, in_flight):
+                self.drop_object(em, dropped)
+        objs, size = backlog.take(in_flight)
+        # Counted before they're sent, so workers can't count them taken
+        # first
+        gauge.sent(len(objs), size)
+        # Woken to send more once workers are through half of what's in
+        # flight, if there's more to send
+        gauge.wake_at((in_flight[0] + len(objs)) // 2 if backlog else -1)
+        return objs
+
+    def spill_objects(self, em: Dict[str, Any], objs: List[BaseObject]) \
+            -> List[BaseObject]:
+        """
+        Add objects bound for a module to its SpillLog, and return the
+        objects from the log that can be sent to it now
+        """
+        spill_log = em["spill"]
+        if not objs and not spill_log:
+            return objs
+        gauge = em["input_gauge"]
+        spill_log.add(objs)
+        options = em["options"]
+        window = SPILL_IN_FLIGHT_BATCHES * options["workers"] * max(
+                options["batch_size"],
+                getattr(em["module"], "gather_objects", 0), 1)
+        in_flight = gauge.in_flight()
+        objs, size = spill_log.take(window - in_flight[0],
+                spill_log.memory - in_flight[1])
+        gauge.sent(len(objs), size)
+        gauge.wake_at((in_flight[0] + len(objs)) // 2 if spill_log else -1)
+        return objs
+
+    def update_ingest_gate(self) -> None:
+        """
+        Close the InputEndpointModules' gate while any module whose policy
+        is to block is full, and open it once none are
+        """
+        if self.ingest_gate is None:
+            return
+        full = any(em["backlog"].full(em["input_gauge"].in_flight())
+                for em in it.chain(self.rems, self.oems)
+                if "backlog" in em and
+                    em["options"]["queue_policy"] == POLICY_BLOCK)
+        if full and self.ingest_gate.is_set():
+            self.ingest_gate.clear()
+        elif not full and not self.ingest_gate.is_set():
+            self.ingest_gate.set()
+
+    def send_outboxes(self) -> None:
+        """
+        Send every module the objects in its outbox, batched as that module
+        is configured.  Modules with limited queues are sent only what their
+        backlogs let through.
+        """
+        for em in it.chain(self.rems, self.oems, [self.reemitter]):
+            outbox = em["outbox"]
+            if "backlog" in em:
+                outbox = self.hold_objects(em, outbox)
+            elif "spill" in em:
+                outbox = self.spill_objects(em, outbox)
+            if not outbox:
+                em["outbox"] = []
+                continue
+            em["in_flight"].sent(len(outbox))
+            batch_size = em["options"]["batch_size"]
+            if batch_size <= 1:
+                for obj in outbox:
+                    em["send_queue"].put(obj)
+            else:
+                for start in range(0, len(outbox), batch_size):
+                    em["send_queue"].put(outbox[start:start + batch_size])
+            em["outbox"] = []
+
     def processing_iteration(self) -> bool:
         """
         Run one round of reading from the sources and sending to the sinks
@@ -242,54 +1029,33 @@ class BaseFramework:
         some_object_handled = False
 
         self.log_module_resource_usage()
+        self.update_metrics()
+        self.receive_spans()
+        self.update_profiling()
 
-        # Check each InputEndpointModules for one input object
-        iem_recv = (iem["recv_queue"]
-                for iem in (self.iems + [self.reemitter])
-                )
-        iem_inputs = (queue.get()
-                for queue in iem_recv if not queue.empty()
-                )
-        # Send any input objects to all supporting Reemitter & OutputEndpoints
-        for obj in iem_inputs:
-            some_object_handled = True
-            this_object_handled = False
-            if obj.ttl < 0:
-                """
-                self.logger.debug("Object died from low TTL: {}".format(obj))
-                """
-                obj = DeathLog(obj)
-                self.reemitter["send_queue"].put(obj)
-                continue
+        # Send input objects to all supporting Reemitter & OutputEndpoints
+        for iem in self.iems + [self.reemitter]:
+            for obj in self.receive_objects(iem):
+                some_object_handled = True
+                self.route_object(obj)
 
-            for em in it.chain(self.rems, self.oems):
-                if em["module"].can_handle_object(obj):
-                    """
-                    self.logger.debug(
-                            "Object had handler {}: {}".format(
-                                em["module"].__name__,
-                                obj)
-                            )
-                    """
-                    this_object_handled = True
-                    em["send_queue"].put(obj)
+        # Send everything the reemitters made to the ReemitInputEndpointModule
+        for rem in self.rems:
+            rem_objs = self.receive_objects(rem)
+            if rem_objs:
+                some_object_handled = True
+                self.reemitter["outbox"].extend(rem_objs)
 
-            # Handle the case where no module could handle an object
-            if not this_object_handled:
-                self.logger.debug("Object had no handler: {}".format(obj))
-                obj_death = DeathLog(obj)
-                self.reemitter["send_queue"].put(obj_death)
-
-
-        # Check each reemitter for an input object
-        rem_recv_and_empty = ((rem["recv_queue"], rem["recv_queue"].empty())
-                for rem in self.rems)
-        rem_inputs = (queue.get()
-                for (queue, empty) in rem_recv_and_empty if not empty
-                )
-        # Send all inputs to the ReemitInputEndpointModule
-        for obj in rem_inputs:
-            some_object_handled = True
-            self.reemitter["send_queue"].put(obj)
+        # OutputEndpointModules only send acknowledgements for SpillLogs
+        if self.spill_logs:
+            for oem in self.oems:
+                for obj in self.receive_objects(oem):
+                    self.route_object(obj)
+
+        self.send_outboxes()
+        self.update_ingest_gate()
+        for ack in self.spill_acks:
+            self.spill_logs[ack.log].acknowledge(ack.obj_ids)
+        self.spill_acks = []
 
         return some_object_handled
@@ -1,11 +1,105 @@
+import functools
+import itertools as it
+import os
 from textwrap import indent
+from typing import Any, Dict, Optional, Tuple
 
 ANCESTOR_INDENT = 2
 
+_object_counter = it.count()
+
+def new_object_id() -> str:
+    """
+    Return an ID unique among the objects of this run.  The process ID
+    keeps forked module processes from handing out the same IDs.
+    """
+    return "{:x}.{:x}".format(os.getpid(), next(_object_counter))
+
+def render_object(type_name: str, ttl: int, content: str,
+        lineage: Optional["Lineage"]) -> str:
+    ancestors = str(lineage) if lineage is not None else ""
+    return """Object Type: {}\nTTL: {}\nContent:\n{}\nAncestors:\n{}""".format(
+              type_name,
+              ttl,
+              content,
+              indent(ancestors, " " * ANCESTOR_INDENT),
+              )
+
+class Lineage:
+    """
+    One generation of an object's ancestry - the ID and a summary of the
+    parent as it was when the object was made, and the parent's own lineage.
+
+    Children share their parent's chain, so recording lineage costs the
+    same at any depth.  The text form, identical to what str gave for the
+    parent, is only rendered when something formats it.
+    """
+    __slots__ = ("obj_id", "type_name", "ttl", "content", "parent",
+            "rendered")
+
+    def __init__(self, obj_id: Optional[str], type_name: str, ttl: int,
+            content: str, parent: Optional["Lineage"]):
+        self.obj_id = obj_id
+        self.type_name = type_name
+        self.ttl = ttl
+        self.content = content
+        self.parent = parent
+        self.rendered = None
+
+    def __getstate__(self):
+        return (self.obj_id, self.type_name, self.ttl, self.content,
+                self.parent)
+
+    def __setstate__(self, state):
+        self.obj_id, self.type_name, self.ttl, self.content, self.parent = \
+                state
+        self.rendered = None
+
+    def __str__(self):
+        if self.rendered is None:
+            self.rendered = render_object(self.type_name, self.ttl,
+                    self.content, self.parent)
+        return self.rendered
+
+@functools.lru_cache(maxsize=None)
+def slot_names(cls: type) -> Tuple[str, ...]:
+    """
+    Return the names of every slot instances of cls have, base classes'
+    first
+    """
+    names = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get("__slots__", ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        names.extend(name for name in slots
+                if name not in ("__dict__", "__weakref__"))
+    return tuple(names)
+
 class BaseObject:
     """
+    ttl: int - Generations the object may still be reemitted
+    obj_id: str - An ID for the object, assigned when it's emitted
+    lineage: Lineage - The object's ancestry, None if it has no parent
+    trace: tuple - For objects sampled for tracing, the trace's ID, the ID
+        of the span that made the object, and when the object last
+        entered a queue.  None for the rest.
     ancestors: str - A string representation of the ancestors
+
+    Objects declare their fields in __slots__.  Subclasses that don't still
+    work, they just carry a __dict__ too.
     """
+    __slots__ = ("ttl", "obj_id", "lineage", "trace", "_lineage_node")
+
+    # Fields every object carries, which the ObjectCodec encodes separately
+    # from the ones subclasses declare
+    header_fields = ("ttl", "obj_id", "lineage", "trace")
+
+    def __init__(self):
+        self.obj_id = None
+        self.lineage = None
+        self.trace = None
+
     def str_content(self):
         """
         Override this function to specify the a representation of the object
@@ -15,10 +109,51 @@ class BaseObject:
         """
         raise RuntimeError("Ran str_content on BaseObject")
 
+    def payload_size(self) -> int:
+        """
+        Bytes of binary payload the object carries, counted in module
+        metrics.  Objects without one have 0.
+        """
+        return 0
+
+    @property
+    def ancestors(self) -> str:
+        lineage = getattr(self, "lineage", None)
+        return str(lineage) if lineage is not None else ""
+
+    def lineage_node(self) -> Lineage:
+        """
+        Return the Lineage describing this object to its children.
+        It's made once, however many children the object has.
+        """
+        node = getattr(self, "_lineage_node", None)
+        if node is None:
+            node = Lineage(getattr(self, "obj_id", None),
+                    self.__class__.__name__, self.ttl, self.str_content(),
+                    getattr(self, "lineage", None))
+            self._lineage_node = node
+        return node
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Return the object's fields by name.  Pickle and the ObjectCodec
+        both use this, so a class that adjusts it adjusts both.
+        """
+        state = {}
+        for name in slot_names(type(self)):
+            try:
+                state[name] = getattr(self, name)
+            except AttributeError:
+                pass
+        # Children carry this, the object needn't
+        state.pop("_lineage_node", None)
+        state.update(getattr(self, "__dict__", {}))
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __str__(self):
-        return """Object Type: {}\nTTL: {}\nContent:\n{}\nAncestors:\n{}""".format(
-                  self.__class__.__name__,
-                  self.ttl,
-                  self.str_content(),
-                  indent(self.ancestors, " " * ANCESTOR_INDENT),
-                  )
+        return render_object(self.__class__.__name__, self.ttl,
+                self.str_content(), getattr(self, "lineage", None))
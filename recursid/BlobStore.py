@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import mmap
+import os
+import os.path
+import tempfile
+import time
+from typing import Optional, Union
+
+DEFAULT_BLOB_THRESHOLD = 64 * 1024 # bytes
+DEFAULT_BLOB_TTL = 60 * 60 # seconds
+# tmpfs, where available, keeps blobs in memory
+DEFAULT_BLOB_BASE_DIR = "/dev/shm"
+
+# The store large payloads get placed in when objects are pickled, if any
+active_store = None
+
+def activate_store(store: Optional["BlobStore"]) -> None:
+    """
+    Make store the one objects in this process, and processes forked from
+    it, place their large payloads in when pickled
+    """
+    global active_store
+    active_store = store
+
+def get_active_store() -> Optional["BlobStore"]:
+    return active_store
+
+class BlobHandle:
+    """
+    Refers to a payload held in a BlobStore.  It's all that gets pickled in
+    place of the payload.
+    """
+    __slots__ = ("path",)
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, state):
+        self.path = state
+
+    def size(self) -> int:
+        """
+        The payload's length, or 0 if it's been evicted
+        """
+        try:
+            return os.stat(self.path).st_size
+        except OSError:
+            return 0
+
+    def read(self) -> memoryview:
+        """
+        Map the payload and return a read-only, zero-copy view of it
+        """
+        with open(self.path, "rb") as blob_file:
+            mapped = mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped)
+
+class BlobStore:
+    """
+    Holds large byte payloads once each, as files named by their SHA-256
+    hash in a directory created for this store.  Readers memory map the
+    files, so any number of processes share one copy of each payload.
+
+    Blobs are evicted ttl seconds after they were last stored.  Storing the
+    same payload again renews it.  Anything that already mapped a blob
+    keeps it after eviction, but the ttl must be longer than objects wait
+    in queues, or late readers won't find their payloads.
+
+    path:
+        The directory to create the store's directory in
+    threshold:
+        Payloads smaller than this many bytes aren't worth storing, and get
+        pickled as usual
+    ttl:
+        Seconds a blob lives after it was last stored
+    """
+    def __init__(self, path: Optional[str] = None,
+            threshold: int = DEFAULT_BLOB_THRESHOLD,
+            ttl: float = DEFAULT_BLOB_TTL):
+        if path is None:
+            path = DEFAULT_BLOB_BASE_DIR if os.path.isdir(
+                    DEFAULT_BLOB_BASE_DIR) else tempfile.gettempdir()
+        self.directory = tempfile.mkdtemp(prefix="recursid-blobs-", dir=path)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def should_store(self, content: Union[bytes, memoryview]) -> bool:
+        return len(content) >= self.threshold
+
+    def put(self, content: Union[bytes, memoryview],
+            hashdig: Optional[str] = None) -> BlobHandle:
+        """
+        Store content, if it isn't already, and return a handle to it.
+        hashdig may be passed if the SHA-256 hex digest is already known.
+        """
+        if hashdig is None:
+            hashdig = hashlib.sha256(content).hexdigest()
+        path = os.path.join(self.directory, hashdig)
+
+        try:
+            # Renew the blob if it's already here
+            os.utime(path)
+        except FileNotFoundError:
+            # Write somewhere private and rename, so a reader never sees a
+            # partially written blob
+            fd, temp_path = tempfile.mkstemp(dir=self.directory,
+                    prefix=".tmp-")
+            with os.fdopen(fd, "wb") as blob_file:
+                blob_file.write(content)
+            os.replace(temp_path, path)
+
+        return BlobHandle(path)
+
+    def evict_expired(self) -> int:
+        """
+        Remove blobs that haven't been stored for ttl seconds
+        Returns the number of blobs removed
+        """
+        oldest_allowed = time.time() - self.ttl
+        removed = 0
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < oldest_allowed:
+                    os.unlink(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            self.logger.debug("Evicted {} blobs".format(removed))
+        return removed
+
+    def remove_all(self) -> None:
+        """
+        Remove every blob, and the store's directory
+        """
+        for entry in os.scandir(self.directory):
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+        os.rmdir(self.directory)
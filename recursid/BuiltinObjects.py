@@ -1,57 +1,194 @@
 import hashlib
 import json
-from typing import Iterable, Any, Union
+from typing import Iterable, Any, Mapping, Optional, Union
 
-import magic
-
-from .BaseObject import BaseObject
+from .BaseObject import BaseObject, new_object_id
+from .BlobStore import get_active_store
+from .FileSniffer import filetype_of
+from .ObjectCodec import register_object
 from .utilities import convert_bytes_to_str
 
+@register_object(1)
 class LogEntry(BaseObject):
+    __slots__ = ("log_data",)
+
     def __init__(self, log_data: str):
+        super().__init__()
         self.log_data = convert_bytes_to_str(log_data)
     def str_content(self):
         return self.log_data
 
+@register_object(2)
 class DeathLog(BaseObject):
+    __slots__ = ("log_data",)
+
     def __init__(self, obj: BaseObject):
+        super().__init__()
         self.log_data = "Object died!"
         self.ttl = 0
-        self.ancestors = str(obj)
+        self.obj_id = new_object_id()
+        self.lineage = obj.lineage_node()
     def str_content(self):
         return self.log_data
 
+@register_object(8)
+class SpillAck(BaseObject):
+    """
+    Sent back by a module whose input is a SpillLog, once it's handled the
+    objects with obj_ids, for the framework to acknowledge in the log named
+    log.  A ReemitterModule sends it after the objects it made from them,
+    so they're in the logs of the modules they're bound for first.
+    """
+    __slots__ = ("log", "obj_ids")
+
+    def __init__(self, log: str, obj_ids: Iterable[str]):
+        super().__init__()
+        self.log = log
+        self.obj_ids = list(obj_ids)
+        self.ttl = 0
+    def str_content(self):
+        return "Acknowledging {} objects".format(len(self.obj_ids))
+
+@register_object(3)
 class JSONObject(BaseObject):
-    def __init__(self, json_dat: str, json_indent: int = 2):
-        self.dat = json.loads(json_dat)
+    """
+    json_dat may be JSON text, or the already decoded data.  Text isn't
+    parsed until something reads dat, so a record that's only passed along
+    is never parsed, and invalid text raises there rather than here.
+    """
+    __slots__ = ("_dat", "_json_text", "json_indent")
+
+    def __init__(self, json_dat: Union[str, bytes, Mapping[str, Any]],
+            json_indent: int = 2):
+        super().__init__()
+        if isinstance(json_dat, (str, bytes, bytearray)):
+            self._dat = None
+            self._json_text = json_dat
+        else:
+            self._dat = json_dat
+            self._json_text = None
         self.json_indent = json_indent
 
+    @property
+    def dat(self) -> Any:
+        if self._json_text is not None:
+            self._dat = json.loads(self._json_text)
+            self._json_text = None
+        return self._dat
+
+    @dat.setter
+    def dat(self, dat: Any) -> None:
+        self._dat = dat
+        self._json_text = None
+
     def str_content(self):
         return json.dumps(self.dat, indent=self.json_indent)
 
+@register_object(4)
 class FluentdRecord(JSONObject):
-    pass
+    __slots__ = ()
 
+@register_object(5)
 class URLObject(BaseObject):
+    __slots__ = ("url",)
+
     def __init__(self, url: Union[bytes, str]):
+        super().__init__()
         self.url = convert_bytes_to_str(url)
     def str_content(self):
         return self.url
 
+@register_object(6)
 class BinaryBlobObject(BaseObject):
+    """
+    When a BlobStore is active, large content is placed in it as the object
+    is encoded, and only a handle to it travels.  The receiver reads content
+    back as a memoryview over the shared copy on first access.
+    """
+    __slots__ = ("_content", "_blob_handle")
+
     def __init__(self, content: bytes):
+        super().__init__()
         self.content = content
 
+    @property
+    def content(self) -> Union[bytes, memoryview]:
+        if self._content is None:
+            self._content = self._blob_handle.read()
+        return self._content
+
+    @content.setter
+    def content(self, content: Union[bytes, memoryview]) -> None:
+        self._content = content
+        self._blob_handle = None
+
+    def payload_size(self) -> int:
+        # Without mapping a stored payload just to measure it
+        if self._content is None:
+            return self._blob_handle.size()
+        return len(self._content)
+
+    def content_sha256(self) -> Optional[str]:
+        """
+        Return the SHA-256 hex digest of content if it's already known,
+        so the BlobStore needn't hash it again
+        """
+        return None
+
+    def __getstate__(self):
+        store = get_active_store()
+        if self._blob_handle is None and store is not None and \
+                store.should_store(self._content):
+            self._blob_handle = store.put(self._content,
+                    self.content_sha256())
+
+        state = super().__getstate__()
+        if self._blob_handle is not None:
+            state["_content"] = None
+        elif isinstance(self._content, memoryview):
+            state["_content"] = bytes(self._content)
+        return state
+
     def str_content(self):
-        return convert_bytes_to_str(self.content[:1024])
+        return convert_bytes_to_str(bytes(self.content[:1024]))
 
+@register_object(7)
 class DownloadedObject(BinaryBlobObject):
+    """
+    The hash and filetype of content are worked out when first used, as
+    many downloads are dropped as duplicates before their type matters.
+    """
+    __slots__ = ("url", "user_agent", "_hashdig", "_filetype")
+
     def __init__(self, url: str, user_agent: str, content: bytes):
         super().__init__(content = content)
         self.url = convert_bytes_to_str(url)
         self.user_agent = user_agent
-        self.hashdig = hashlib.sha256(content).hexdigest()
-        self.filetype = magic.from_buffer(content).lower()
+        self._hashdig = None
+        self._filetype = None
+
+    @property
+    def hashdig(self) -> str:
+        if self._hashdig is None:
+            self._hashdig = hashlib.sha256(self.content).hexdigest()
+        return self._hashdig
+
+    @hashdig.setter
+    def hashdig(self, hashdig: str) -> None:
+        self._hashdig = hashdig
+
+    @property
+    def filetype(self) -> str:
+        if self._filetype is None:
+            self._filetype = filetype_of(self.content, self.hashdig)
+        return self._filetype
+
+    @filetype.setter
+    def filetype(self, filetype: str) -> None:
+        self._filetype = filetype
+
+    def content_sha256(self) -> Optional[str]:
+        return self.hashdig
 
     def str_content(self):
         return "URL: {}\nUser-Agent: {}\nFiletype: {}"\
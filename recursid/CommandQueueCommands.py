@@ -1,2 +1,5 @@
 CQC_DIE = "DIE"
 CQC_RES = "LOG_RESOURCES"
+CQC_METRICS = "SEND_METRICS"
+CQC_PROFILE_START = "PROFILE_START"
+CQC_PROFILE_STOP = "PROFILE_STOP"
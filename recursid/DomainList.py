@@ -0,0 +1,119 @@
+import logging
+import os
+import threading as thr
+import time
+from typing import FrozenSet, Iterable, Optional, Tuple
+
+DEFAULT_DOMAIN_LIST_RELOAD_INTERVAL = 30 # seconds
+
+def normalize_domain(domain: str) -> str:
+    """
+    Lower case domain, without a trailing dot, or a leading "." or "*."
+    """
+    domain = domain.strip().lower().rstrip(".")
+    if domain.startswith("*."):
+        return domain[2:]
+    return domain.lstrip(".")
+
+def host_of(netloc: str) -> str:
+    """
+    The host in a URL's netloc, without any user info or port
+    """
+    host = netloc.rpartition("@")[2]
+    if host.startswith("["):
+        return host[1:host.find("]")] if "]" in host else host[1:]
+    return normalize_domain(host.partition(":")[0])
+
+class DomainList:
+    """
+    A set of domains, each of which matches itself and its subdomains -
+    "example.com" matches "www.example.com", but not "badexample.com".
+    Looking up a domain checks each of its label suffixes in a set, so
+    takes time in the number of labels, whatever the list's size.
+
+    Domains can be given directly, read from a file, or both.  A file
+    has one domain per line, with blank lines and anything after a "#"
+    ignored, and is read again when it changes, checked at most every
+    reload_interval seconds, as lookups happen.  If it can't be read the
+    previous domains stay in use.
+
+    domains:
+        Domains in the list
+    filename:
+        A file of more domains in the list
+    reload_interval:
+        Seconds between checks for a change to filename
+    """
+    def __init__(self, domains: Iterable[str] = (),
+            filename: Optional[str] = None,
+            reload_interval: float = DEFAULT_DOMAIN_LIST_RELOAD_INTERVAL):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.fixed_domains = frozenset(filter(None,
+                map(normalize_domain, domains)))
+        self.domains = self.fixed_domains
+        self.filename = filename
+        self.reload_interval = reload_interval
+        self.file_signature = None
+        self.next_check_time = 0
+        self.reload_lock = thr.Lock()
+        if filename is not None:
+            self.file_signature = self.stat_file()
+            self.domains = self.fixed_domains | self.load_file()
+            self.next_check_time = time.monotonic() + reload_interval
+
+    def stat_file(self) -> Tuple[int, int, int]:
+        stat = os.stat(self.filename)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def load_file(self) -> FrozenSet[str]:
+        with open(self.filename, "r", encoding="utf-8",
+                errors="replace") as f:
+            return frozenset(filter(None, (normalize_domain(
+                    line.partition("#")[0]) for line in f)))
+
+    def reload_if_changed(self) -> None:
+        """
+        Read the file again if it's changed since it was last read
+        """
+        if not self.reload_lock.acquire(blocking=False):
+            # Another thread is checking
+            return
+        try:
+            self.next_check_time = time.monotonic() + self.reload_interval
+            signature = self.stat_file()
+            if signature == self.file_signature:
+                return
+            domains = self.fixed_domains | self.load_file()
+            self.file_signature = signature
+            self.domains = domains
+            self.logger.info("Loaded {} domains from {}".format(
+                    len(domains), self.filename))
+        except OSError as e:
+            self.logger.error("Could not reload domain list {}, keeping "
+                    "the previous one: {}".format(self.filename, e))
+        finally:
+            self.reload_lock.release()
+
+    def __contains__(self, domain: str) -> bool:
+        """
+        Whether domain, which may be a URL's netloc, or any domain it's
+        under is in the list
+        """
+        if self.filename is not None and \
+                time.monotonic() >= self.next_check_time:
+            self.reload_if_changed()
+        domains = self.domains
+        if not domains:
+            return False
+        host = host_of(domain)
+        if host in domains:
+            return True
+        dot = host.find(".")
+        while dot >= 0:
+            if host[dot + 1:] in domains:
+                return True
+            dot = host.find(".", dot + 1)
+        return False
+
+    def __len__(self) -> int:
+        return len(self.domains)
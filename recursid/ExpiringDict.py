@@ -0,0 +1,84 @@
+from collections import OrderedDict
+import time
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+class ExpiringDict:
+    """
+    A mapping whose entries expire ttl seconds after they were last set or
+    touched, and that holds at most max_size entries, dropping the ones
+    closest to expiring to make room.
+
+    Entries are kept in the order they expire, which, with one ttl for all,
+    is the order they were last set.  Lookups are O(1), and expiry only
+    ever looks at the front, so it's amortized O(1) too.
+
+    ttl:
+        Seconds entries live, or None for entries that don't expire
+    max_size:
+        Most entries to hold, or None for no limit
+    clock:
+        Returns the current time in seconds
+    """
+    def __init__(self, ttl: Optional[float], max_size: Optional[int] = None,
+            clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        # key -> (expiry time, value)
+        self.entries = OrderedDict()
+
+    def expire(self) -> None:
+        """
+        Drop the entries that have expired
+        """
+        if self.ttl is None:
+            return
+        now = self.clock()
+        entries = self.entries
+        while entries:
+            key, (expires, _) = next(iter(entries.items()))
+            if expires > now:
+                break
+            del entries[key]
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self.expire()
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        self.entries[key] = (expires, value)
+        self.entries.move_to_end(key)
+        if self.max_size is not None:
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.entries.get(key)
+        if entry is None or (entry[0] is not None and
+                entry[0] <= self.clock()):
+            return default
+        return entry[1]
+
+    def touch(self, key: Hashable) -> bool:
+        """
+        Restart key's ttl, without changing its value.  Return False if
+        it's not present.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            return False
+        self[key] = value
+        return True
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __len__(self) -> int:
+        self.expire()
+        return len(self.entries)
@@ -0,0 +1,147 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+from typing import Iterator, Optional
+
+GZIP_MAGIC = b"\x1f\x8b"
+# How much of the start of a file identifies it, with its inode
+FINGERPRINT_SIZE = 256
+
+class FileLineReader:
+    """
+    Reads a file's complete lines as they become available, holding no more
+    than a buffer and a line in memory however big the file is.  Gzip
+    files are decompressed as they're read.
+
+    Lines are returned as bytes, with their line ending.  A last line
+    without one is held back by lines, in case the rest of it is still being
+    written, and returned by remainder.
+
+    With an offset_file, the position after the last line returned can be
+    saved there, and reading starts from that position if the file is the
+    same one.  Files are told apart by their inode, and a hash of their
+    first bytes, as inodes get reused.  For gzip files the position is in
+    the decompressed data.
+    """
+    def __init__(self, filename: str, offset_file: Optional[str] = None):
+        self.filename = filename
+        self.offset_file = offset_file
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.raw_file = None
+        self.file = None
+        self.open(self.load_offset())
+
+    def open(self, offset: int = 0) -> None:
+        """
+        Open filename, and start reading from offset
+        """
+        raw_file = self.raw_file = open(self.filename, "rb")
+        stat = os.fstat(raw_file.fileno())
+        self.inode = stat.st_ino
+        self.compressed = raw_file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+        raw_file.seek(0)
+        if self.compressed:
+            self.file = gzip.GzipFile(fileobj=raw_file)
+        else:
+            self.file = raw_file
+            if offset > stat.st_size:
+                # Truncated since the offset was saved
+                offset = 0
+        self.file.seek(offset)
+        self.offset = offset
+        self.partial = b""
+
+    def close(self) -> None:
+        if self.file is not None:
+            # GzipFile leaves the file it reads from open
+            self.file.close()
+            self.raw_file.close()
+            self.file = self.raw_file = None
+
+    def lines(self) -> Iterator[bytes]:
+        """
+        Yield the complete lines written so far
+        """
+        for line in self.file:
+            if not line.endswith(b"\n"):
+                self.partial += line
+                break
+            if self.partial:
+                line = self.partial + line
+                self.partial = b""
+            self.offset += len(line)
+            yield line
+
+    def remainder(self) -> bytes:
+        """
+        Return, and count as read, the last line if it had no line ending
+        """
+        line = self.partial
+        self.offset += len(line)
+        self.partial = b""
+        return line
+
+    def replaced(self) -> bool:
+        """
+        Return True if filename was rotated away, and a new file took its
+        place, or if the file was truncated
+        """
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            # Not replaced yet
+            return False
+        return stat.st_ino != self.inode or (not self.compressed and
+                stat.st_size < self.offset + len(self.partial))
+
+    def load_offset(self) -> int:
+        if self.offset_file is None:
+            return 0
+        try:
+            with open(self.offset_file, "r") as offset_file:
+                saved = json.load(offset_file)
+            if saved["inode"] == os.stat(self.filename).st_ino and \
+                    saved["fingerprint"] == self.fingerprint_named(
+                        saved["fingerprint_size"]):
+                self.logger.info("Resuming {} from offset {}".format(
+                        self.filename, saved["offset"]))
+                return saved["offset"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            self.logger.warning("Ignoring unreadable offset file {}: {}"
+                    "".format(self.offset_file, e))
+        return 0
+
+    def fingerprint_named(self, size: int) -> str:
+        """
+        Return a hash of the first size bytes of the file at filename
+        """
+        with open(self.filename, "rb") as f:
+            return hashlib.sha256(f.read(size)).hexdigest()
+
+    def fingerprint_open(self, size: int) -> str:
+        """
+        Return a hash of the first size bytes of the file being read, which
+        may no longer be the one at filename
+        """
+        return hashlib.sha256(os.pread(self.raw_file.fileno(), size, 0)
+                ).hexdigest()
+
+    def save_offset(self) -> None:
+        if self.offset_file is None:
+            return
+        # Only bytes already read are sure not to change
+        size = FINGERPRINT_SIZE if self.compressed else \
+                min(FINGERPRINT_SIZE, self.offset)
+        temp_name = "{}.tmp".format(self.offset_file)
+        with open(temp_name, "w") as offset_file:
+            json.dump({
+                    "inode": self.inode,
+                    "fingerprint": self.fingerprint_open(size),
+                    "fingerprint_size": size,
+                    "offset": self.offset,
+                    }, offset_file)
+        os.replace(temp_name, self.offset_file)
@@ -0,0 +1,124 @@
+import struct
+import threading as thr
+from typing import Optional, Union
+
+import magic
+
+from .ExpiringDict import ExpiringDict
+
+# Bytes of content looked at to tell its type
+DEFAULT_SNIFF_HEAD = 64 * 1024
+FILETYPE_CACHE_SIZE = 10000
+# Scripts with longer lines are described by libmagic
+MAX_SCRIPT_LINE = 300
+
+ELF_TYPES = {1: "relocatable", 2: "executable", 3: "shared object",
+        4: "core file"}
+# Only machines libmagic describes without looking at the flags, and ARM
+ELF_MACHINES = {2: "SPARC", 3: "Intel 80386", 20: "PowerPC or cisco 4500",
+        40: "ARM", 42: "Renesas SH", 62: "x86-64", 183: "ARM aarch64"}
+ELF_MACHINE_ARM = 40
+ELF_OSABIS = {0: "SYSV", 3: "GNU/Linux", 9: "FreeBSD"}
+XZ_CHECKS = {0: "NONE", 1: "CRC32", 4: "CRC64", 10: "SHA-256"}
+SCRIPT_BYTES = frozenset(range(0x20, 0x7f)) | {ord("\t"), ord("\n")}
+
+def sniff_elf(head: bytes) -> Optional[str]:
+    if len(head) < 52 or head[6] != 1:
+        return None
+    bits = {1: "32", 2: "64"}.get(head[4])
+    endian = {1: ("LSB", "<"), 2: ("MSB", ">")}.get(head[5])
+    if bits is None or endian is None or \
+            (bits == "64" and len(head) < 64):
+        return None
+    order, fmt = endian
+    e_type, machine, version = struct.unpack_from(fmt + "HHI", head, 16)
+    if version != 1 or e_type not in ELF_TYPES or \
+            machine not in ELF_MACHINES or head[7] not in ELF_OSABIS:
+        return None
+    machine_name = ELF_MACHINES[machine] + ","
+    if machine == ELF_MACHINE_ARM:
+        flags, = struct.unpack_from(fmt + "I",
+                head, 48 if bits == "64" else 36)
+        if flags >> 24:
+            machine_name = "ARM, EABI{}".format(flags >> 24)
+    return "ELF {}-bit {} {}, {} version 1 ({})".format(bits, order,
+            ELF_TYPES[e_type], machine_name, ELF_OSABIS[head[7]])
+
+def script_interpreter(shebang: bytes) -> Optional[str]:
+    words = shebang[2:].split()
+    if not words:
+        return None
+    path = words[0]
+    if path.endswith(b"/env") and len(words) > 1:
+        name = words[1]
+        if name == b"sh":
+            return None
+    elif path in (b"/bin/sh", b"/usr/bin/sh"):
+        return "POSIX shell script, ASCII text executable"
+    else:
+        name = path.rpartition(b"/")[2]
+    if name == b"bash":
+        return "Bourne-Again shell script, ASCII text executable"
+    if name.startswith(b"python") and \
+            all(c in b"0123456789." for c in name[6:]):
+        return "Python script, ASCII text executable"
+    if name == b"perl":
+        return "Perl script text executable"
+    return None
+
+def sniff_script(head: bytes, size: int) -> Optional[str]:
+    # Only short, plain ASCII scripts, as libmagic's description of the
+    # rest depends on all of their text
+    if size > len(head) or b"\n" not in head or \
+            not SCRIPT_BYTES.issuperset(head):
+        return None
+    if max(map(len, head.split(b"\n"))) > MAX_SCRIPT_LINE:
+        return None
+    return script_interpreter(head[:head.index(b"\n")])
+
+def sniff(head: bytes, size: int) -> Optional[str]:
+    """
+    Describe content as libmagic would from its first bytes, head, for
+    common types that are quick to recognize.  size is the length of the
+    whole content.  Return None for anything else.
+    """
+    if head.startswith(b"\x7fELF"):
+        return sniff_elf(head)
+    if head.startswith(b"#!"):
+        return sniff_script(head, size)
+    if head.startswith(b"BZh") and head[4:10] == b"1AY&SY" and \
+            head[3:4].isdigit() and head[3:4] != b"0":
+        return "bzip2 compressed data, block size = {}00k".format(
+                head[3] - ord("0"))
+    if head.startswith(b"\xfd7zXZ\x00") and len(head) >= 8 and \
+            head[6] == 0 and head[7] in XZ_CHECKS:
+        return "XZ compressed data, checksum {}".format(XZ_CHECKS[head[7]])
+    if head.startswith(b"7z\xbc\xaf\x27\x1c") and len(head) >= 8:
+        return "7-zip archive data, version {}.{}".format(head[6], head[7])
+    return None
+
+def describe(content: Union[bytes, memoryview],
+        head_size: int = DEFAULT_SNIFF_HEAD) -> str:
+    """
+    Describe content's type, as libmagic would, from its first head_size
+    bytes
+    """
+    head = bytes(content[:head_size])
+    return sniff(head, len(content)) or magic.from_buffer(head)
+
+filetype_cache = ExpiringDict(None, FILETYPE_CACHE_SIZE)
+filetype_cache_lock = thr.Lock()
+
+def filetype_of(content: Union[bytes, memoryview], hashdig: str) -> str:
+    """
+    The lower case description of content, whose SHA-256 hex digest is
+    hashdig.  Descriptions are cached by hash, so content seen again in
+    this process isn't looked at again.
+    """
+    with filetype_cache_lock:
+        filetype = filetype_cache.get(hashdig)
+    if filetype is None:
+        filetype = describe(content).lower()
+        with filetype_cache_lock:
+            filetype_cache[hashdig] = filetype
+    return filetype
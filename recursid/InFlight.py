@@ -0,0 +1,83 @@
+import multiprocessing as mp
+from typing import Any, List, Optional, Tuple
+
+SENT = 0
+HANDLED = 1
+EMITTED = 2
+COUNTS_PER_MODULE = 3
+
+class InFlightCounts:
+    """
+    Counts, in shared memory, the objects sent to each module, the objects
+    its workers have finished handling, and the objects they've sent the
+    framework.  Every module's counts are kept under one lock, so the
+    framework can read them all as of one instant, and know exactly
+    whether any object is still in flight anywhere in the pipeline.
+
+    Objects are counted sent or emitted before they're put on a queue, and
+    handled only once everything made from them has been sent, so a module
+    that's handled everything it was sent has nothing more to send.
+
+    modules:
+        How many modules to count for, each given a slot by number
+    waker:
+        If given, its set method is called whenever a module finishes
+        handling everything it was sent, while the framework is watching
+    """
+    def __init__(self, modules: int, waker: Optional[Any] = None):
+        # Each module's sent, handled and emitted counts, then whether the
+        # framework is watching for modules to finish
+        self.watch_index = modules * COUNTS_PER_MODULE
+        self.counts = mp.Array("q", self.watch_index + 1)
+        # Indexing the synchronized array takes its lock every time, so
+        # the counts are read and written raw, under the lock taken once
+        self.lock = self.counts.get_lock()
+        self.raw = self.counts.get_obj()
+        self.waker = waker
+
+    def module(self, slot: int) -> "ModuleCounts":
+        return ModuleCounts(self, slot)
+
+    def add(self, slot: int, kind: int, objs: int) -> None:
+        base = slot * COUNTS_PER_MODULE
+        raw = self.raw
+        with self.lock:
+            raw[base + kind] += objs
+            wake = kind == HANDLED and raw[self.watch_index] and \
+                    raw[base + SENT] == raw[base + HANDLED]
+        if wake and self.waker is not None:
+            self.waker.set()
+
+    def watch(self, watching: bool = True) -> None:
+        """
+        Start, or stop, waking the framework as modules finish
+        """
+        with self.lock:
+            self.raw[self.watch_index] = int(watching)
+
+    def snapshot(self) -> List[Tuple[int, int, int]]:
+        """
+        The sent, handled and emitted counts of every module, by slot
+        """
+        with self.lock:
+            counts = self.raw[:self.watch_index]
+        return [tuple(counts[base:base + COUNTS_PER_MODULE])
+                for base in range(0, len(counts), COUNTS_PER_MODULE)]
+
+class ModuleCounts:
+    """
+    One module's slot in InFlightCounts, for its workers, and anything
+    else sending it objects, to count with
+    """
+    def __init__(self, counts: InFlightCounts, slot: int):
+        self.counts = counts
+        self.slot = slot
+
+    def sent(self, objs: int) -> None:
+        self.counts.add(self.slot, SENT, objs)
+
+    def handled(self, objs: int) -> None:
+        self.counts.add(self.slot, HANDLED, objs)
+
+    def emitted(self, objs: int) -> None:
+        self.counts.add(self.slot, EMITTED, objs)
@@ -0,0 +1,292 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import resource
+import threading as thr
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_METRICS_PERIOD = 15 # seconds
+DEFAULT_METRICS_HOST = "127.0.0.1"
+# Upper bounds, in seconds, of the handle_object latency histogram buckets
+LATENCY_BUCKETS = (.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 10, 60)
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+class Histogram:
+    """
+    Counts of observed values falling in each of a fixed set of buckets,
+    with their sum, as a Prometheus histogram has.  Observing is a bisect
+    and two additions.
+
+    bounds:
+        The upper bound of each bucket, in increasing order.  Values above
+        the last go in one more bucket.
+    """
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"bounds": self.bounds, "counts": list(self.counts),
+                "sum": self.sum}
+
+def resident_memory() -> Optional[int]:
+    """
+    Bytes of memory this process has resident, or None if unknown
+    """
+    try:
+        with open("/proc/self/statm", "rb") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+def peak_resident_memory() -> int:
+    # ru_maxrss is in kilobytes on Linux, but bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+class ModuleMetrics:
+    """
+    Counters and a latency histogram kept by one module worker.  Only the
+    worker's own thread updates them, except errors, which the threads it
+    starts may count too.  Pickled, to start a module process by spawning,
+    they get a fresh lock.
+    """
+    def __init__(self):
+        self.objects_in = 0
+        self.objects_out = 0
+        self.bytes_in = 0
+        self.errors = 0
+        self.error_lock = thr.Lock()
+        self.latency = Histogram()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["error_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.error_lock = thr.Lock()
+
+    def count_error(self) -> None:
+        with self.error_lock:
+            self.errors += 1
+
+    def snapshot(self, module: str, instance: str, worker_id: int) \
+            -> Dict[str, Any]:
+        """
+        The current values, with the CPU time and memory of the worker.
+        module is the worker's class name, and instance its module's name
+        among those configured.
+        Must be called from the worker's own thread.  A worker running as
+        the main thread has its process to itself, so reports the whole
+        process's CPU time and memory, while one running as a thread
+        reports its thread's CPU time, and leaves memory to the framework.
+        """
+        owns_process = thr.current_thread() is thr.main_thread()
+        return {
+                "module": module,
+                "instance": instance,
+                "worker": worker_id,
+                "objects_in": self.objects_in,
+                "objects_out": self.objects_out,
+                "bytes_in": self.bytes_in,
+                "errors": self.errors,
+                "latency": self.latency.snapshot(),
+                "cpu_seconds": time.process_time() if owns_process else
+                        time.thread_time(),
+                "resident_memory": resident_memory() if owns_process else
+                        None,
+                "peak_resident_memory": peak_resident_memory()
+                        if owns_process else None,
+                }
+
+def process_snapshot(module: str, instance: str) -> Dict[str, Any]:
+    """
+    A snapshot of just the CPU time and memory of this whole process
+    """
+    return {
+            "module": module,
+            "instance": instance,
+            "worker": 0,
+            "cpu_seconds": time.process_time(),
+            "resident_memory": resident_memory(),
+            "peak_resident_memory": peak_resident_memory(),
+            }
+
+# name, type, help, snapshot key
+COUNTERS = [
+        ("recursid_objects_in_total", "counter",
+            "Objects received by the module", "objects_in"),
+        ("recursid_objects_out_total", "counter",
+            "Objects sent or reemitted by the module", "objects_out"),
+        ("recursid_bytes_in_total", "counter",
+            "Payload bytes of the binary objects received by the module",
+            "bytes_in"),
+        ("recursid_errors_total", "counter",
+            "Errors the module hit", "errors"),
+        ("recursid_cpu_seconds_total", "counter",
+            "CPU time used by the module's process, or its thread when "
+            "modules share a process", "cpu_seconds"),
+        ("recursid_resident_memory_bytes", "gauge",
+            "Resident memory of the module's process", "resident_memory"),
+        ("recursid_peak_resident_memory_bytes", "gauge",
+            "Peak resident memory of the module's process",
+            "peak_resident_memory"),
+        ]
+LATENCY_NAME = "recursid_handle_seconds"
+QUEUE_DEPTH_NAME = "recursid_queue_depth"
+DROPPED_NAME = "recursid_objects_dropped_total"
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def format_labels(labels: Iterable[Tuple[str, Any]]) -> str:
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace(
+            "\\", "\\\\").replace('"', '\\"')) for key, value in labels) + "}"
+
+def snapshot_labels(snap: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    return [("module", snap["module"]), ("instance", snap["instance"]),
+            ("worker", snap["worker"])]
+
+def render_prometheus(snapshots: Iterable[Dict[str, Any]],
+        queue_depths: Iterable[Tuple[str, str, str, int]] = (),
+        drops: Iterable[Tuple[str, str, int]] = ()) -> str:
+    """
+    Render module snapshots, (module, instance, queue, depth) tuples, and
+    (module, instance, objects dropped from its full queue) tuples, in the
+    Prometheus text exposition format.  Modules configured more than once
+    are told apart by instance.
+    """
+    snapshots = sorted(snapshots, key=lambda snap: (snap["module"],
+            snap["instance"], snap["worker"]))
+    lines = []
+    for name, metric_type, help_text, key in COUNTERS:
+        samples = [(snap, snap[key]) for snap in snapshots
+                if snap.get(key) is not None]
+        if not samples:
+            continue
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} {}".format(name, metric_type))
+        lines.extend("{}{} {}".format(name, format_labels(
+                    snapshot_labels(snap)), format_value(value))
+                for snap, value in samples)
+
+    # Modules that never time anything, like InputEndpointModules, have
+    # empty histograms not worth exposing
+    latencies = [snap for snap in snapshots
+            if "latency" in snap and any(snap["latency"]["counts"])]
+    if latencies:
+        lines.append("# HELP {} Time taken to handle each object".format(
+                LATENCY_NAME))
+        lines.append("# TYPE {} histogram".format(LATENCY_NAME))
+    for snap in latencies:
+        labels = snapshot_labels(snap)
+        latency = snap["latency"]
+        cumulative = 0
+        for bound, count in zip(list(latency["bounds"]) + ["+Inf"],
+                latency["counts"]):
+            cumulative += count
+            lines.append("{}_bucket{} {}".format(LATENCY_NAME,
+                    format_labels(labels + [("le", bound)]), cumulative))
+        lines.append("{}_sum{} {}".format(LATENCY_NAME,
+                format_labels(labels), format_value(latency["sum"])))
+        lines.append("{}_count{} {}".format(LATENCY_NAME,
+                format_labels(labels), cumulative))
+
+    queue_depths = list(queue_depths)
+    if queue_depths:
+        lines.append("# HELP {} Objects waiting in a module's queue".format(
+                QUEUE_DEPTH_NAME))
+        lines.append("# TYPE {} gauge".format(QUEUE_DEPTH_NAME))
+        lines.extend("{}{} {}".format(QUEUE_DEPTH_NAME, format_labels([
+                    ("module", module), ("instance", instance),
+                    ("queue", queue)]), depth)
+                for module, instance, queue, depth in queue_depths)
+
+    drops = list(drops)
+    if drops:
+        lines.append("# HELP {} Objects dropped from a module's full "
+                "queue".format(DROPPED_NAME))
+        lines.append("# TYPE {} counter".format(DROPPED_NAME))
+        lines.extend("{}{} {}".format(DROPPED_NAME, format_labels([
+                    ("module", module), ("instance", instance)]), count)
+                for module, instance, count in drops)
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.metrics_text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class MetricsExporter:
+    """
+    Publishes the latest rendered metrics, served over HTTP at /metrics,
+    written to a file, or both
+
+    port:
+        The port to serve metrics on, or None not to serve them.  0 picks
+        a free port, found in server_port.
+    host:
+        The address to serve metrics on - only this machine, by default
+    file:
+        A file to rewrite with the metrics each time they're updated, or
+        None
+    period:
+        Seconds between the framework asking modules for their metrics
+    """
+    def __init__(self, port: Optional[int] = None,
+            host: str = DEFAULT_METRICS_HOST,
+            file: Optional[str] = None,
+            period: float = DEFAULT_METRICS_PERIOD):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.file = file
+        self.period = period
+        self.server = None
+        self.server_port = None
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+            self.server.daemon_threads = True
+            self.server.metrics_text = ""
+            self.server_port = self.server.server_address[1]
+            thr.Thread(target=self.server.serve_forever,
+                    name="Thread-MetricsExporter", daemon=True).start()
+            self.logger.info("Serving metrics on http://{}:{}/metrics"
+                    "".format(host, self.server_port))
+
+    def publish(self, text: str) -> None:
+        if self.server is not None:
+            self.server.metrics_text = text
+        if self.file is not None:
+            # Replace the file whole, so readers never see part of it
+            tmp_name = "{}.tmp".format(self.file)
+            try:
+                with open(tmp_name, "w") as tmp:
+                    tmp.write(text)
+                os.replace(tmp_name, self.file)
+            except OSError as e:
+                self.logger.error("Could not write metrics file {}: {}"
+                        "".format(self.file, e))
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
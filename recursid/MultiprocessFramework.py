@@ -1,30 +1,130 @@
+import itertools as it
 import multiprocessing as mp
+import multiprocessing.connection
+import multiprocessing.queues
+import multiprocessing.reduction
+import os
 from typing import List, Tuple, Dict, Any, Optional
 
 from .modules.BaseModules import BaseModule
 from .BaseFramework import BaseFramework
+from .ObjectCodec import encode, decode
+
+def queue_readers(queues: List[mp.Queue]) -> list:
+    # mp.Queue doesn't expose a waitable handle, but its reader end is a
+    # Connection, which mp.connection.wait can select on
+    return [queue._reader for queue in queues]
+
+class ObjectQueue(mp.queues.Queue):
+    """
+    An mp.Queue for objects and batches of them, which it passes through
+    the ObjectCodec instead of pickling them generically.  Items are
+    encoded as they're put, rather than later in the queue's feeder thread.
+    """
+    def __init__(self, maxsize: int = 0):
+        super().__init__(maxsize, ctx=mp.get_context())
+
+    def put(self, obj, block: bool = True,
+            timeout: Optional[float] = None) -> None:
+        super().put(encode(obj), block, timeout)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None):
+        return decode(super().get(block, timeout))
+
+class QueueWaiter:
+    """
+    Blocks until any of a set of mp.Queues has data ready to read
+    """
+    def __init__(self, queues: List[mp.Queue]):
+        self.queues = queues
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        mp.connection.wait(queue_readers(self.queues), timeout)
+
+class PipeWaker:
+    """
+    Wakes a process waiting on its pipe with mp.connection.wait, from any
+    process it's passed to as they start.  Setting it never blocks, and
+    wakeups set while the pipe is full are merged with those in it.
+    Processes started by spawning are passed just the end to set it with.
+    """
+    def __init__(self):
+        self.reader, self.writer = os.pipe()
+        os.set_blocking(self.reader, False)
+        os.set_blocking(self.writer, False)
+
+    def __getstate__(self):
+        return {"writer": mp.reduction.DupFd(self.writer)}
+
+    def __setstate__(self, state):
+        self.reader = None
+        self.writer = state["writer"].detach()
+        os.set_blocking(self.writer, False)
+
+    def set(self) -> None:
+        try:
+            os.write(self.writer, b"\0")
+        except BlockingIOError:
+            pass
+
+    def clear(self) -> None:
+        try:
+            while os.read(self.reader, 4096):
+                pass
+        except BlockingIOError:
+            pass
 
 class MultiprocessFramework(BaseFramework):
     """
     MultiprocessFramework instantiates the framework with a separate process
     for each module and the framework base.
     """
-    def start_module(self, mod: BaseModule, *args, **kwargs):
-        send_obj_queue = mp.Queue()
-        recv_obj_queue = mp.Queue()
-        send_cmd_queue = mp.Queue()
-        processing_lock = mp.Lock()
-        module = mod(self.start_ttl, 
-                send_obj_queue, recv_obj_queue, send_cmd_queue,
-                processing_lock)
-        proc = mp.Process(target=module.main, args=args, kwargs=kwargs,
-                name="Process-{}".format(mod.__name__))
-        proc.start()
+    def __init__(self, *args, **kwargs):
+        self.router_wakers = []
+        super().__init__(*args, **kwargs)
+
+    def make_router_waker(self) -> PipeWaker:
+        waker = PipeWaker()
+        self.router_wakers.append(waker)
+        return waker
+    def create_module(self, mod: BaseModule, module_options: Dict[str, Any],
+            *args, **kwargs):
+        send_obj_queue = ObjectQueue()
+        recv_obj_queue = ObjectQueue()
+        workers = []
+        for worker_id in range(module_options["workers"]):
+            send_cmd_queue = mp.Queue()
+            processing_lock = mp.Lock()
+            module = mod(self.start_ttl, 
+                    send_obj_queue, recv_obj_queue, send_cmd_queue,
+                    processing_lock,
+                    input_waiter=QueueWaiter([send_obj_queue, send_cmd_queue]),
+                    **self.module_init_options(module_options, worker_id))
+            proc = mp.Process(target=module.run, args=args, kwargs=kwargs,
+                    name="Process-{}-{}".format(mod.__name__, worker_id))
+            workers.append({
+                    "instance": module,
+                    "process": proc,
+                    "cmd_queue": send_cmd_queue,
+                    "proc_lock": processing_lock,
+                    })
         return {
                 "module": mod,
-                "process": proc,
+                "workers": workers,
                 "send_queue": send_obj_queue,
                 "recv_queue": recv_obj_queue,
-                "cmd_queue": send_cmd_queue,
-                "proc_lock": processing_lock,
+                "options": module_options,
                 }
+
+    def wait_for_objects(self, timeout: float) -> None:
+        # Wake for the sentinels of live IEM processes too, so IEMs
+        # finishing is noticed right away
+        readers = queue_readers([em["recv_queue"]
+                for em in it.chain(self.iems, self.rems, [self.reemitter])])
+        sentinels = [worker["process"].sentinel
+                for iem in self.iems for worker in iem["workers"]
+                if worker["process"].is_alive()]
+        wakers = [waker.reader for waker in self.router_wakers]
+        mp.connection.wait(readers + sentinels + wakers, timeout)
+        for waker in self.router_wakers:
+            waker.clear()
@@ -5,27 +5,90 @@ from typing import List, Tuple, Dict, Any, Optional
 from .modules.BaseModules import BaseModule
 from .BaseFramework import BaseFramework
 
+class NotifyingQueue(Queue):
+    """
+    A Queue that sets a set of events after every put, so consumers can
+    each wait on many queues at once
+    """
+    def __init__(self, notify_events: List[thr.Event], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.notify_events = notify_events
+
+    def put(self, *args, **kwargs) -> None:
+        super().put(*args, **kwargs)
+        for event in self.notify_events:
+            event.set()
+
+class EventWaiter:
+    """
+    Blocks until an event is set, then clears it for the next wait
+    """
+    def __init__(self, event: thr.Event):
+        self.event = event
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        # Clearing after the wait can't lose a wakeup - anything put that
+        # set the event has already landed in its queue, and the waiter
+        # checks its queues again before waiting again
+        self.event.wait(timeout)
+        self.event.clear()
+
 class MultithreadedFramework(BaseFramework):
     """
     MultithreadedFramework instantiates the framework with a separate thread
     for each module and the framework base.
     """
-    def start_module(self, mod: BaseModule, *args, **kwargs):
-        send_obj_queue = Queue()
-        recv_obj_queue = Queue()
-        send_cmd_queue = Queue()
-        processing_lock = thr.Lock()
-        module = mod(self.start_ttl, 
-                send_obj_queue, recv_obj_queue, send_cmd_queue,
-                processing_lock)
-        proc = thr.Thread(target=module.main, args=args, kwargs=kwargs,
-                name="Thread-{}".format(mod.__name__))
-        proc.start()
+    def __init__(self, *args, **kwargs):
+        # Set whenever a module sends the framework an object, or exits
+        self.objects_ready = thr.Event()
+        self.router_waiter = EventWaiter(self.objects_ready)
+        super().__init__(*args, **kwargs)
+
+    def create_module(self, mod: BaseModule, module_options: Dict[str, Any],
+            *args, **kwargs):
+        worker_events = [thr.Event()
+                for worker_id in range(module_options["workers"])]
+        send_obj_queue = NotifyingQueue(worker_events)
+        recv_obj_queue = NotifyingQueue([self.objects_ready])
+        workers = []
+        for worker_id, worker_event in enumerate(worker_events):
+            send_cmd_queue = NotifyingQueue([worker_event])
+            processing_lock = thr.Lock()
+            module = mod(self.start_ttl, 
+                    send_obj_queue, recv_obj_queue, send_cmd_queue,
+                    processing_lock,
+                    input_waiter=EventWaiter(worker_event),
+                    **self.module_init_options(module_options, worker_id))
+
+            def run_module(module=module):
+                try:
+                    module.run(*args, **kwargs)
+                finally:
+                    self.objects_ready.set()
+
+            proc = thr.Thread(target=run_module,
+                    name="Thread-{}-{}".format(mod.__name__, worker_id))
+            workers.append({
+                    "instance": module,
+                    "process": proc,
+                    "cmd_queue": send_cmd_queue,
+                    "proc_lock": processing_lock,
+                    })
         return {
                 "module": mod,
-                "process": proc,
+                "workers": workers,
                 "send_queue": send_obj_queue,
                 "recv_queue": recv_obj_queue,
-                "cmd_queue": send_cmd_queue,
-                "proc_lock": processing_lock,
+                "options": module_options,
                 }
+
+    def make_queue(self) -> Queue:
+        # An mp.Queue's feeder thread could still hold what the last
+        # workers put when they're joined
+        return Queue()
+
+    def make_router_waker(self) -> thr.Event:
+        return self.objects_ready
+
+    def wait_for_objects(self, timeout: float) -> None:
+        self.router_waiter.wait(timeout)
@@ -0,0 +1,134 @@
+import threading as thr
+import time
+from queue import Queue
+from typing import Callable, Iterable, List, Optional
+
+from .BaseObject import BaseObject
+
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_BATCH_LINGER = .005 # seconds
+
+def unbatch(item) -> List[BaseObject]:
+    """
+    Objects travel between the framework and modules either on their own,
+    or batched up in a list.  Return a list of objects in either case.
+    """
+    if isinstance(item, list):
+        return item
+    return [item]
+
+class ObjectBatcher:
+    """
+    Sends objects on a queue in lists of up to max_size objects, so the
+    per-message cost of the queue is paid once per batch.
+
+    A partially filled batch is sent once its oldest object has waited
+    linger seconds, or when flush is called.  Objects are always sent in the
+    order they were put.  With a max_size of 1, objects are put on the queue
+    directly, unbatched.
+
+    The linger thread is started on first use, so a batcher can be made
+    before the module process forks and still work after.  A batcher can
+    also be pickled, to start a module process by spawning, and is given a
+    fresh lock when unpickled.
+
+    If counter is given, it's called with the number of objects about to
+    be put on the queue, before each put.
+    """
+    def __init__(self, queue: Queue, max_size: int = DEFAULT_BATCH_SIZE,
+            linger: float = DEFAULT_BATCH_LINGER,
+            counter: Optional[Callable[[int], None]] = None):
+        self.queue = queue
+        self.counter = counter
+        self.max_size = max_size
+        self.linger = linger
+        self.pending = []
+        self.oldest_time = None
+        self.lock = thr.Lock()
+        self.has_pending = thr.Condition(self.lock)
+        self.linger_thread = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("lock", "has_pending", "linger_thread"):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = thr.Lock()
+        self.has_pending = thr.Condition(self.lock)
+        self.linger_thread = None
+
+    def put(self, obj: BaseObject) -> None:
+        if self.max_size <= 1:
+            self.count(1)
+            self.queue.put(obj)
+            return
+
+        with self.lock:
+            self.pending.append(obj)
+            if len(self.pending) >= self.max_size:
+                self.__send_pending()
+            elif len(self.pending) == 1:
+                self.oldest_time = time.monotonic()
+                self.__ensure_linger_thread()
+                self.has_pending.notify()
+
+    def put_many(self, objs: Iterable[BaseObject]) -> None:
+        """
+        Put each object, then send anything left over right away.  With a
+        max_size of 1, objects put together are still sent as one list,
+        since batching them costs nothing.
+        """
+        if self.max_size <= 1:
+            objs = list(objs)
+            self.count(len(objs))
+            if len(objs) > 1:
+                self.queue.put(objs)
+            elif objs:
+                self.queue.put(objs[0])
+            return
+        for obj in objs:
+            self.put(obj)
+        self.flush()
+
+    def flush(self) -> None:
+        """
+        Send any partial batch now
+        """
+        if self.max_size <= 1:
+            return
+        with self.lock:
+            self.__send_pending()
+
+    def count(self, objs: int) -> None:
+        if self.counter is not None and objs:
+            self.counter(objs)
+
+    def __send_pending(self) -> None:
+        # Must be called with self.lock held
+        if self.pending:
+            self.count(len(self.pending))
+            self.queue.put(self.pending)
+            self.pending = []
+
+    def __ensure_linger_thread(self) -> None:
+        # Must be called with self.lock held
+        if self.linger_thread is None:
+            self.linger_thread = thr.Thread(target=self.__linger_loop,
+                    name="ObjectBatcher-linger", daemon=True)
+            self.linger_thread.start()
+
+    def __linger_loop(self) -> None:
+        with self.lock:
+            while True:
+                if not self.pending:
+                    self.has_pending.wait()
+                    continue
+                remaining = self.oldest_time + self.linger - time.monotonic()
+                if remaining > 0:
+                    # Recheck after, the batch may have filled and gone out
+                    self.has_pending.wait(remaining)
+                    continue
+                self.__send_pending()
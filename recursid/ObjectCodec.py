@@ -0,0 +1,152 @@
+from operator import attrgetter
+import pickle
+from typing import Any, Callable, Dict, List, Union
+
+import msgpack
+
+from .BaseObject import BaseObject, Lineage, slot_names
+from .BlobStore import BlobHandle
+
+# The first byte of an encoded item says how the rest was encoded
+MSGPACK_FORMAT = b"M"
+PICKLE_FORMAT = b"P"
+
+BLOB_HANDLE_EXT = 1
+
+# Type tag -> class, and class -> (type tag, field names, field getter)
+registered_tags = {}
+registered_classes = {}
+
+HEADER_GETTER = attrgetter(*BaseObject.header_fields)
+
+class UnregisteredObject(TypeError):
+    pass
+
+def register_object(tag: int) -> Callable[[type], type]:
+    """
+    Class decorator giving an object class a type tag, so encode can
+    write it compactly.  The class must declare all of its fields in
+    __slots__.  Classes that aren't registered still work, they're
+    pickled instead.
+    """
+    def register(cls: type) -> type:
+        if tag in registered_tags:
+            raise RuntimeError("Object tag {} already belongs to {}".format(
+                    tag, registered_tags[tag].__name__))
+        if cls.__dictoffset__ != 0:
+            raise RuntimeError("Can't register {}, some of its fields "
+                    "aren't in __slots__".format(cls.__name__))
+        fields = tuple(name for name in slot_names(cls)
+                if name not in BaseObject.header_fields
+                and name != "_lineage_node")
+        # Classes that adjust their state get it through __getstate__, the
+        # rest have their fields read directly, which is a lot quicker
+        if cls.__getstate__ is BaseObject.__getstate__ and fields:
+            getter = attrgetter(*fields, *fields[:1])
+        else:
+            getter = None
+        registered_tags[tag] = cls
+        registered_classes[cls] = (tag, fields, getter)
+        return cls
+    return register
+
+def pack_ext(obj: Any) -> msgpack.ExtType:
+    if isinstance(obj, BlobHandle):
+        return msgpack.ExtType(BLOB_HANDLE_EXT, obj.path.encode())
+    raise UnregisteredObject("Can't encode {}".format(type(obj).__name__))
+
+def unpack_ext(code: int, data: bytes) -> Any:
+    if code == BLOB_HANDLE_EXT:
+        return BlobHandle(data.decode())
+    return msgpack.ExtType(code, data)
+
+def encode_lineage(node: Lineage, nodes: List[list],
+        indexes: Dict[int, int]) -> int:
+    """
+    Add node, and any of its ancestors not yet in nodes, to nodes, parents
+    first.  Return node's index.  Siblings in a batch share their entries.
+    """
+    chain = []
+    while node is not None and id(node) not in indexes:
+        chain.append(node)
+        node = node.parent
+    for node in reversed(chain):
+        parent = node.parent
+        indexes[id(node)] = len(nodes)
+        nodes.append([node.obj_id, node.type_name, node.ttl, node.content,
+                indexes[id(parent)] if parent is not None else None])
+    return indexes[id(node)]
+
+def encode_object(obj: BaseObject, nodes: List[list],
+        indexes: Dict[int, int]) -> list:
+    try:
+        tag, fields, getter = registered_classes[type(obj)]
+        ttl, obj_id, lineage, trace = HEADER_GETTER(obj)
+        if getter is not None:
+            # The getter repeats the first field so it always gives a tuple
+            values = getter(obj)[:-1]
+        else:
+            state = obj.__getstate__()
+            values = [state.get(field) for field in fields]
+    except (KeyError, AttributeError):
+        raise UnregisteredObject("{} isn't registered, or is missing "
+                "fields".format(type(obj).__name__)) from None
+    if lineage is not None:
+        lineage = encode_lineage(lineage, nodes, indexes)
+    if trace is not None:
+        trace = list(trace)
+    return [tag, ttl, obj_id, lineage, trace, *values]
+
+def encode(item: Union[BaseObject, List[BaseObject]]) -> bytes:
+    """
+    Encode an object, or a batch of them, for a queue between processes.
+    Registered objects are written with msgpack, as a type tag and their
+    field values, with lineage written once per batch.  Anything else falls
+    back to pickle, as do values msgpack wouldn't give back as they were -
+    tuples, and subclasses of the types it knows.
+    """
+    is_batch = isinstance(item, list)
+    nodes = []
+    indexes = {}
+    try:
+        objs = [encode_object(obj, nodes, indexes)
+                for obj in (item if is_batch else [item])]
+        return MSGPACK_FORMAT + msgpack.packb([is_batch, nodes, objs],
+                default=pack_ext, use_bin_type=True, strict_types=True)
+    except (TypeError, ValueError, OverflowError):
+        # Unregistered classes, and values msgpack can't hold, or would
+        # change
+        return PICKLE_FORMAT + pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+
+def decode_object(entry: list, lineages: List[Lineage]) -> BaseObject:
+    cls = registered_tags[entry[0]]
+    obj = cls.__new__(cls)
+    obj.ttl = entry[1]
+    obj.obj_id = entry[2]
+    lineage = entry[3]
+    obj.lineage = lineages[lineage] if lineage is not None else None
+    obj.trace = tuple(entry[4]) if entry[4] is not None else None
+    fields = registered_classes[cls][1]
+    if cls.__setstate__ is BaseObject.__setstate__:
+        for name, value in zip(fields, entry[5:]):
+            setattr(obj, name, value)
+    else:
+        obj.__setstate__(dict(zip(fields, entry[5:])))
+    return obj
+
+def decode(data: bytes) -> Union[BaseObject, List[BaseObject]]:
+    """
+    Return the object, or batch of them, that encode made data from
+    """
+    body = memoryview(data)[1:]
+    if data[:1] == PICKLE_FORMAT:
+        return pickle.loads(body)
+    # Fields may be dicts keyed by numbers, not only strings
+    is_batch, nodes, objs = msgpack.unpackb(body, ext_hook=unpack_ext,
+            raw=False, strict_map_key=False)
+    lineages = []
+    for obj_id, type_name, ttl, content, parent in nodes:
+        lineages.append(Lineage(obj_id, type_name, ttl, content,
+                lineages[parent] if parent is not None else None))
+    objs = [decode_object(entry, lineages) for entry in objs]
+    return objs if is_batch else objs[0]
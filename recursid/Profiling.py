@@ -0,0 +1,243 @@
+import cProfile
+from collections import deque
+import logging
+import os
+import os.path
+import signal
+import socketserver
+import sys
+import threading as thr
+import time
+import tracemalloc
+from typing import Callable, List, Optional, Tuple
+
+DEFAULT_PROFILE_DURATION = 30 # seconds
+# Frames of traceback tracemalloc keeps for each allocation
+TRACEMALLOC_FRAMES = 10
+# Allocation sites listed in the text summary of a tracemalloc snapshot
+TRACEMALLOC_TOP = 50
+PROFILE_SIGNAL = signal.SIGUSR1
+
+# tracemalloc traces a whole process, so modules sharing one, as threads,
+# share it, and it's stopped when the last of them is done
+tracemalloc_lock = thr.Lock()
+tracemalloc_users = 0
+# From Python 3.12, cProfile profiles every thread of a process, and only
+# one profile can run in a process at a time, so modules sharing one, as
+# threads, share a profile too, kept the same way
+PROCESS_WIDE_PROFILES = sys.version_info >= (3, 12)
+process_profile_lock = thr.Lock()
+process_profile = None
+process_profile_users = 0
+
+def dump_process_profile(directory: str, filename: str) -> None:
+    """
+    Write the process's shared profile to filename, in directory, for one
+    of its users, then stop it if that was the last, or carry on for the
+    rest if not
+    """
+    global process_profile, process_profile_users
+    with process_profile_lock:
+        process_profile_users -= 1
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Which stops the profile
+            process_profile.dump_stats(filename)
+        finally:
+            if process_profile_users:
+                process_profile.enable()
+            else:
+                process_profile.disable()
+                process_profile = None
+
+class ModuleProfiler:
+    """
+    Profiles the thread it's started in with cProfile, and the allocations
+    of its whole process with tracemalloc, until stopped, then writes the
+    stats to files in directory, named for the module.
+
+    From Python 3.12, cProfile can only profile a whole process, so the
+    profilers running in a process share one profile, and each writes out
+    every thread's calls since the first of them started.
+
+    directory:
+        Where to write stats files
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.name = None
+        self.profile = None
+
+    @property
+    def running(self) -> bool:
+        return self.profile is not None
+
+    def start(self, name: str) -> None:
+        """
+        Start profiling, for files named for name, like the module and its
+        worker
+        """
+        global tracemalloc_users, process_profile, process_profile_users
+        if self.running:
+            return
+        self.name = name
+        if PROCESS_WIDE_PROFILES:
+            with process_profile_lock:
+                if process_profile is None:
+                    profile = cProfile.Profile()
+                    profile.enable()
+                    process_profile = profile
+                process_profile_users += 1
+                self.profile = process_profile
+        else:
+            profile = cProfile.Profile()
+            profile.enable()
+            self.profile = profile
+        with tracemalloc_lock:
+            if tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            tracemalloc_users += 1
+
+    def stop(self) -> List[str]:
+        """
+        Stop profiling, and return the names of the files written
+        """
+        global tracemalloc_users
+        if not self.running:
+            return []
+        if not PROCESS_WIDE_PROFILES:
+            self.profile.disable()
+        try:
+            # Before writing the profile, which allocates plenty itself
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                        tracemalloc.Filter(False, tracemalloc.__file__),
+                        tracemalloc.Filter(False, cProfile.__file__)]) \
+                    if tracemalloc.is_tracing() else None
+        finally:
+            profile = self.profile
+            self.profile = None
+            with tracemalloc_lock:
+                tracemalloc_users -= 1
+                if tracemalloc_users == 0:
+                    tracemalloc.stop()
+        base = os.path.join(self.directory, "{}-{}-{}".format(self.name,
+                os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+        filenames = [base + ".prof", base + ".tracemalloc",
+                base + ".tracemalloc.txt"]
+        if PROCESS_WIDE_PROFILES:
+            dump_process_profile(self.directory, filenames[0])
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(filenames[0])
+        if snapshot is None:
+            return filenames[:1]
+        snapshot.dump(filenames[1])
+        with open(filenames[2], "w") as summary:
+            for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+                summary.write("{}\n".format(stat))
+        return filenames
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline(1024).decode("utf-8", "replace")
+        reply = self.server.control.handle_request(line.split())
+        self.wfile.write((reply + "\n").encode("utf-8"))
+
+class ProfileControl:
+    """
+    Takes requests to profile modules, from a local control socket, or
+    PROFILE_SIGNAL, which profiles every module.  A line sent to the
+    socket reads:
+
+        profile <module>[:<worker>] [seconds]
+
+    where module is a module's class name, or "all".  The framework picks
+    requests up with pop_requests, which gives (module, worker, seconds)
+    tuples, where None for module or worker means all of them.
+
+    directory:
+        Where modules write their stats files
+    socket:
+        The path of a Unix socket to listen for requests on, or None
+    duration:
+        Seconds to profile for, if a request doesn't say
+    describe:
+        If given, called with module and worker, returns a description of
+        the workers they match, for replies, or None if they match none
+    """
+    def __init__(self, directory: str, socket: Optional[str] = None,
+            duration: float = DEFAULT_PROFILE_DURATION,
+            describe: Optional[Callable[[Optional[str], Optional[int]],
+                Optional[str]]] = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.directory = directory
+        self.duration = duration
+        self.describe = describe
+        # Appending to a deque is safe in a signal handler, unlike
+        # anything taking a lock
+        self.requests = deque()
+        self.socket = socket
+        self.server = None
+        if socket is not None:
+            if os.path.exists(socket):
+                os.unlink(socket)
+            self.server = socketserver.ThreadingUnixStreamServer(socket,
+                    ControlHandler)
+            os.chmod(socket, 0o600)
+            self.server.daemon_threads = True
+            self.server.control = self
+            thr.Thread(target=self.server.serve_forever,
+                    name="Thread-ProfileControl", daemon=True).start()
+            self.logger.info("Taking profiling requests on {}".format(
+                    socket))
+        # Signal handlers can only be set in the main thread
+        self.previous_handler = None
+        if thr.current_thread() is thr.main_thread():
+            self.previous_handler = signal.signal(PROFILE_SIGNAL,
+                    self.handle_signal)
+
+    def handle_signal(self, signum, frame) -> None:
+        self.requests.append((None, None, self.duration))
+
+    def handle_request(self, words: List[str]) -> str:
+        """
+        Queue up a request from the control socket, and return a reply
+        """
+        if len(words) not in (2, 3) or words[0] != "profile":
+            return "error: expected profile <module>[:<worker>] [seconds]"
+        module, _, worker = words[1].partition(":")
+        try:
+            worker = int(worker) if worker else None
+            seconds = float(words[2]) if len(words) == 3 else self.duration
+        except ValueError:
+            return "error: worker and seconds must be numbers"
+        if seconds <= 0:
+            return "error: seconds must be positive"
+        module = None if module == "all" else module
+        matched = self.describe(module, worker) \
+                if self.describe is not None else "workers"
+        if matched is None:
+            return "error: no such module or worker: {}".format(words[1])
+        self.requests.append((module, worker, seconds))
+        return "profiling {} for {:g} seconds, writing to {}".format(
+                matched, seconds, self.directory)
+
+    def pop_requests(self) -> List[Tuple[Optional[str], Optional[int],
+            float]]:
+        requests = []
+        while self.requests:
+            requests.append(self.requests.popleft())
+        return requests
+
+    def close(self) -> None:
+        if self.previous_handler is not None:
+            signal.signal(PROFILE_SIGNAL, self.previous_handler)
+            self.previous_handler = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            try:
+                os.unlink(self.socket)
+            except OSError:
+                pass
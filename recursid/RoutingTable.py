@@ -0,0 +1,71 @@
+from typing import Any, Dict, List, Type
+
+from .BaseObject import BaseObject
+from .BuiltinObjects import DeathLog
+
+class RoutingTable:
+    """
+    Maps each concrete object class to the modules that can handle it.
+
+    Each class is checked against every module's supported_objects only the
+    first time an object of that class shows up, after that routing an
+    object is one dict lookup.
+
+    targets:
+        A list of dictionaries, each with at least a "module" key holding
+        the module class.  The same dictionaries are returned on lookup.
+    """
+    def __init__(self, targets: List[Dict[str, Any]]):
+        self.targets = targets
+        self.table = dict()
+
+    def lookup(self, obj_cls: Type[BaseObject]) -> List[Dict[str, Any]]:
+        """
+        Return the targets that handle obj_cls, an empty list if none do
+        """
+        try:
+            return self.table[obj_cls]
+        except KeyError:
+            pass
+        handlers = [target for target in self.targets
+                if target["module"].can_handle_class(obj_cls)]
+        self.table[obj_cls] = handlers
+        return handlers
+
+class DirectRouter:
+    """
+    Lets a ReemitterModule send the objects it makes straight to the input
+    queues of the modules that handle them, instead of through the
+    framework and the ReemitInputEndpointModule.  Objects out of TTL, or
+    with no handler, are replaced with a DeathLog, as the framework would.
+
+    targets:
+        A list of dictionaries, each with a "module" key holding the module
+        class, and a "batcher" key holding an ObjectBatcher sending to
+        that module's input queue
+    """
+    def __init__(self, targets: List[Dict[str, Any]]):
+        self.targets = targets
+        self.routing_table = RoutingTable(targets)
+
+    def route(self, obj: BaseObject) -> None:
+        if obj.ttl < 0:
+            obj = DeathLog(obj)
+
+        handlers = self.routing_table.lookup(obj.__class__)
+        if not handlers:
+            # Nothing handles DeathLogs, so there's nowhere for this to go
+            if isinstance(obj, DeathLog):
+                return
+            obj = DeathLog(obj)
+            handlers = self.routing_table.lookup(DeathLog)
+
+        for target in handlers:
+            target["batcher"].put(obj)
+
+    def flush(self) -> None:
+        """
+        Send any objects waiting in partial batches
+        """
+        for target in self.targets:
+            target["batcher"].flush()
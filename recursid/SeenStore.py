@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading as thr
+import time
+from typing import Hashable, Optional
+
+from .ExpiringDict import ExpiringDict
+
+DEFAULT_SEEN_CACHE_SIZE = 100000
+# How long to wait for another process's write to finish
+DEFAULT_SEEN_BUSY_TIMEOUT = 30 # seconds
+# Time between deletions of expired rows
+SEEN_EVICT_PERIOD = 60 * 60 # seconds
+
+_MISSING = object()
+
+class SeenStore:
+    """
+    Records which keys, like URLs or content hashes, have been seen, each
+    for ttl seconds.  They're kept in a SQLite database in WAL mode, so
+    they survive restarts, and every process using the same file shares
+    them.  Keys found seen are also kept in an in-memory cache, so repeat
+    lookups don't touch the database.
+
+    One database file can hold any number of stores, told apart by
+    namespace.  The connection is opened on first use, in the process
+    using it, so a store can be made before module processes fork.
+
+    path:
+        The database file
+    namespace:
+        Which set of keys in the database this store is
+    ttl:
+        Seconds keys are seen for, or None for keys that don't expire
+    cache_size:
+        Most keys to cache
+    """
+    def __init__(self, path: str, namespace: str,
+            ttl: Optional[float] = None,
+            cache_size: int = DEFAULT_SEEN_CACHE_SIZE):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        # key -> when it stops being seen, checked on lookup
+        self.cache = ExpiringDict(None, cache_size)
+        self.lock = thr.Lock()
+        self.db = None
+        self.db_pid = None
+        self.last_evict_time = time.time()
+
+    def connection(self) -> sqlite3.Connection:
+        if self.db is None or self.db_pid != os.getpid():
+            # Statements commit as they run
+            self.db = sqlite3.connect(self.path,
+                    timeout=DEFAULT_SEEN_BUSY_TIMEOUT,
+                    isolation_level=None, check_same_thread=False)
+            self.db_pid = os.getpid()
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS seen "
+                    "(namespace TEXT NOT NULL, key TEXT NOT NULL, expires REAL, "
+                    "PRIMARY KEY (namespace, key)) WITHOUT ROWID")
+        return self.db
+
+    def expiry(self, now: float) -> Optional[float]:
+        return now + self.ttl if self.ttl is not None else None
+
+    def __contains__(self, key: Hashable) -> bool:
+        now = time.time()
+        expires = self.cache.get(key, _MISSING)
+        if expires is not _MISSING and (expires is None or expires > now):
+            return True
+        with self.lock:
+            row = self.connection().execute("SELECT expires FROM seen "
+                    "WHERE namespace=? AND key=? "
+                    "AND (expires IS NULL OR expires > ?)",
+                    (self.namespace, key, now)).fetchone()
+        if row is None:
+            return False
+        self.cache[key] = row[0]
+        return True
+
+    def claim(self, key: Hashable) -> bool:
+        """
+        Record key as seen, unless it already is.  Return True if this
+        call recorded it - of several processes claiming a key at once,
+        only one gets True.
+        """
+        now = time.time()
+        expires = self.expiry(now)
+        with self.lock:
+            cur = self.connection().execute("INSERT INTO seen "
+                    "VALUES (?, ?, ?) ON CONFLICT (namespace, key) "
+                    "DO UPDATE SET expires=excluded.expires "
+                    "WHERE seen.expires IS NOT NULL AND seen.expires <= ?",
+                    (self.namespace, key, expires, now))
+            claimed = cur.rowcount > 0
+            self.evict_expired_periodically(now)
+        if claimed:
+            self.cache[key] = expires
+        return claimed
+
+    def add(self, key: Hashable) -> None:
+        """
+        Record key as seen, from now, whether or not it already was
+        """
+        now = time.time()
+        expires = self.expiry(now)
+        with self.lock:
+            self.connection().execute("INSERT INTO seen VALUES (?, ?, ?) "
+                    "ON CONFLICT (namespace, key) "
+                    "DO UPDATE SET expires=excluded.expires",
+                    (self.namespace, key, expires))
+            self.evict_expired_periodically(now)
+        self.cache[key] = expires
+
+    def evict_expired_periodically(self, now: float) -> None:
+        # Must be called with self.lock held
+        if now - self.last_evict_time > SEEN_EVICT_PERIOD:
+            self.last_evict_time = now
+            self.connection().execute("DELETE FROM seen "
+                    "WHERE namespace=? AND expires <= ?",
+                    (self.namespace, now))
+
+    def close(self) -> None:
+        with self.lock:
+            if self.db is not None and self.db_pid == os.getpid():
+                self.db.close()
+            self.db = None
@@ -0,0 +1,281 @@
+from collections import deque
+import logging
+import os
+import os.path
+import struct
+from typing import Iterable, List, Tuple
+
+from .Backpressure import queued_size, QUEUE_OBJECT_OVERHEAD
+from .BaseObject import BaseObject, new_object_id
+from .ObjectCodec import encode, decode
+
+DEFAULT_SPILL_MEMORY = 16 * 1024 * 1024 # bytes
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024 # bytes
+SEGMENT_SUFFIX = ".log"
+ACK_SUFFIX = ".ack"
+# Each record in a segment is its length, then the encoded object
+RECORD_HEADER = struct.Struct("<I")
+# Each entry in an ack file is the offset of an acknowledged record
+ACK_ENTRY = struct.Struct("<Q")
+
+class SpillLog:
+    """
+    A durable queue of the objects bound for one module, kept by the
+    router.  Every object added is appended to a log on disk, and stays
+    there until the module acknowledges handling it, so objects a crash
+    interrupts are replayed when the log is next opened.  The newest
+    objects waiting to be taken are also held in memory, up to memory
+    bytes of them.  As more arrive, the oldest of them are left only on
+    disk, and read back when taken.  After a burst, the module works
+    through the objects on disk while the latest are kept to hand.
+
+    The log is split into segments, each deleted once every object in it
+    is acknowledged.  Acknowledgements are appended to a file beside each
+    segment, as the offsets of the records acknowledged.
+
+    Objects are identified by ID once taken, and IDs are only unique
+    within a run, so replayed objects are given new IDs as they're taken.
+
+    directory:
+        Where to keep the log's files, which the log has to itself
+    memory:
+        The most bytes, approximately, of waiting objects to hold in
+        memory.  The router also keeps no more than this in flight to the
+        module.
+    segment_size:
+        The size in bytes past which a new segment is started
+    fsync:
+        If True, flush the log to disk on every write, so objects outlast
+        the machine going down, not just the process
+    """
+    def __init__(self, directory: str, memory: int = DEFAULT_SPILL_MEMORY,
+            segment_size: int = DEFAULT_SEGMENT_SIZE, fsync: bool = False):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.directory = directory
+        self.memory = memory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        # Objects waiting to be taken, oldest first, as [segment, record
+        # offset, length, object, queued size], with object None if it's
+        # only on disk
+        self.pending = deque()
+        # The entries of pending holding their object, always its newest,
+        # oldest first, and their total queued size
+        self.in_memory = deque()
+        self.pending_memory = 0
+        # Segment and record offset of each object taken, by its ID
+        self.taken = {}
+        # Objects not yet acknowledged in each segment
+        self.live = {}
+        # Open files, by segment
+        self.readers = {}
+        self.ackers = {}
+
+        self.replay()
+        # Segments before this one are from earlier runs
+        self.first_segment = self.segment = max(self.live, default=-1) + 1
+        self.live[self.segment] = 0
+        self.writer = os.open(self.segment_path(self.segment),
+                os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self.written = 0
+        if self.pending:
+            self.logger.info("Replaying {} objects from {}".format(
+                    len(self.pending), directory))
+
+    def __len__(self) -> int:
+        """
+        The objects waiting to be taken
+        """
+        return len(self.pending)
+
+    def unacknowledged(self) -> int:
+        """
+        The objects waiting, or taken but not yet acknowledged
+        """
+        return sum(self.live.values())
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, "{:08d}{}".format(segment,
+                SEGMENT_SUFFIX))
+
+    def ack_path(self, segment: int) -> str:
+        return os.path.join(self.directory, "{:08d}{}".format(segment,
+                ACK_SUFFIX))
+
+    def replay(self) -> None:
+        """
+        Queue up every object in the segments on disk not yet acknowledged
+        """
+        segments = sorted(int(name[:-len(SEGMENT_SUFFIX)])
+                for name in os.listdir(self.directory)
+                if name.endswith(SEGMENT_SUFFIX) and
+                    name[:-len(SEGMENT_SUFFIX)].isdigit())
+        for segment in segments:
+            acked = set()
+            try:
+                with open(self.ack_path(segment), "rb") as ack_file:
+                    acks = ack_file.read()
+                # Ignoring any partial entry a crash left
+                acked.update(entry[0] for entry in ACK_ENTRY.iter_unpack(
+                        acks[:len(acks) - len(acks) % ACK_ENTRY.size]))
+            except FileNotFoundError:
+                pass
+            with open(self.segment_path(segment), "rb") as segment_file:
+                data = segment_file.read()
+            self.live[segment] = 0
+            offset = 0
+            # Stopping at any partial record a crash left
+            while offset + RECORD_HEADER.size <= len(data):
+                length, = RECORD_HEADER.unpack_from(data, offset)
+                if offset + RECORD_HEADER.size + length > len(data):
+                    break
+                if offset not in acked:
+                    self.pending.append([segment, offset, length, None,
+                            length + QUEUE_OBJECT_OVERHEAD])
+                    self.live[segment] += 1
+                offset += RECORD_HEADER.size + length
+            if self.live[segment] == 0:
+                self.delete_segment(segment)
+
+    def add(self, objs: Iterable[BaseObject]) -> None:
+        """
+        Append objects to the log, to be taken in the order they were added
+        """
+        records = []
+        offset = self.written
+        for obj in objs:
+            data = encode(obj)
+            records.append(RECORD_HEADER.pack(len(data)))
+            records.append(data)
+            size = queued_size(obj)
+            if size > self.memory:
+                obj = None
+            entry = [self.segment, offset, len(data), obj, size]
+            self.pending.append(entry)
+            if obj is not None:
+                self.keep_in_memory(entry)
+            offset += RECORD_HEADER.size + len(data)
+        if not records:
+            return
+        os.write(self.writer, b"".join(records))
+        if self.fsync:
+            os.fsync(self.writer)
+        self.live[self.segment] += len(records) // 2
+        self.written = offset
+        if self.written >= self.segment_size:
+            self.next_segment()
+
+    def keep_in_memory(self, entry: list) -> None:
+        """
+        Hold entry's object in memory, leaving the oldest objects held only
+        on disk to make room
+        """
+        self.pending_memory += entry[4]
+        self.in_memory.append(entry)
+        while self.pending_memory > self.memory:
+            oldest = self.in_memory.popleft()
+            oldest[3] = None
+            self.pending_memory -= oldest[4]
+
+    def take(self, count: int, size_limit: int) -> Tuple[List[BaseObject],
+            int]:
+        """
+        Take up to count of the oldest waiting objects, to be acknowledged
+        once handled, and their total queued size.  Objects past size_limit
+        bytes are left, unless it's the first, so one too big still goes.
+        """
+        objs = []
+        total_size = 0
+        if size_limit <= 0:
+            return objs, total_size
+        while self.pending and len(objs) < count:
+            if objs and total_size + self.pending[0][4] > size_limit:
+                break
+            segment, offset, length, obj, size = self.pending.popleft()
+            if obj is not None:
+                # The oldest waiting, so the oldest held too
+                self.in_memory.popleft()
+                self.pending_memory -= size
+            else:
+                obj = decode(self.read(segment, offset, length))
+                # Replayed objects' sizes were only estimated
+                size = queued_size(obj)
+                # Replayed objects' IDs may have been handed out again
+                if segment < self.first_segment:
+                    obj.obj_id = new_object_id()
+            self.taken[obj.obj_id] = (segment, offset)
+            objs.append(obj)
+            total_size += size
+        return objs, total_size
+
+    def read(self, segment: int, offset: int, length: int) -> bytes:
+        reader = self.readers.get(segment)
+        if reader is None:
+            reader = self.readers[segment] = os.open(
+                    self.segment_path(segment), os.O_RDONLY)
+        return os.pread(reader, length, offset + RECORD_HEADER.size)
+
+    def acknowledge(self, obj_ids: Iterable[str]) -> None:
+        """
+        Record that the objects taken with these IDs have been handled
+        """
+        acks = {}
+        for obj_id in obj_ids:
+            location = self.taken.pop(obj_id, None)
+            if location is None:
+                continue
+            segment, offset = location
+            acks.setdefault(segment, []).append(ACK_ENTRY.pack(offset))
+        for segment, entries in acks.items():
+            self.live[segment] -= len(entries)
+            if self.live[segment] == 0:
+                if segment == self.segment:
+                    self.next_segment()
+                self.delete_segment(segment)
+                continue
+            acker = self.ackers.get(segment)
+            if acker is None:
+                acker = self.ackers[segment] = os.open(
+                        self.ack_path(segment),
+                        os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            os.write(acker, b"".join(entries))
+            if self.fsync:
+                os.fsync(acker)
+
+    def next_segment(self) -> None:
+        """
+        Start appending to a new segment
+        """
+        os.close(self.writer)
+        self.segment += 1
+        self.live[self.segment] = 0
+        self.writer = os.open(self.segment_path(self.segment),
+                os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self.written = 0
+
+    def delete_segment(self, segment: int) -> None:
+        for files in (self.readers, self.ackers):
+            fd = files.pop(segment, None)
+            if fd is not None:
+                os.close(fd)
+        for path in (self.segment_path(segment), self.ack_path(segment)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        del self.live[segment]
+
+    def close(self) -> None:
+        """
+        Close the log's files, deleting them if every object in them has
+        been acknowledged
+        """
+        os.close(self.writer)
+        for files in (self.readers, self.ackers):
+            for fd in files.values():
+                os.close(fd)
+            files.clear()
+        if self.live[self.segment] == 0:
+            self.delete_segment(self.segment)
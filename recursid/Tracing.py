@@ -0,0 +1,67 @@
+import json
+import logging
+from typing import Any, Dict, Iterable, Optional
+
+from .BaseObject import BaseObject
+
+DEFAULT_TRACE_SAMPLE_RATE = .01
+
+def handle_span_id(obj_id: str, instance: str) -> str:
+    """
+    The ID of the span of a module handling an object, by the module's
+    name among those configured, which tells apart modules of the same
+    class.  Only one worker of a module handles each object, so it's
+    unique, and objects reemitted while it's open can name it as their
+    parent before it's recorded.
+    """
+    return "{}/{}".format(obj_id, instance)
+
+def make_span(name: str, obj: BaseObject, span_id: str,
+        parent_id: Optional[str], module: str, worker: int, start: float,
+        end: float) -> Dict[str, Any]:
+    """
+    A span of obj's trace, from start to end, in seconds since the epoch
+    """
+    return {
+            "trace_id": obj.trace[0],
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "name": name,
+            "module": module,
+            "worker": worker,
+            "object_id": obj.obj_id,
+            "object_type": obj.__class__.__name__,
+            "start": start,
+            "end": end,
+            }
+
+class TraceExporter:
+    """
+    Writes spans to a file, one JSON object per line
+
+    file:
+        The file to append spans to
+    sample_rate:
+        The fraction of objects InputEndpointModules emit that are traced,
+        along with everything made from them
+    """
+    def __init__(self, file: str,
+            sample_rate: float = DEFAULT_TRACE_SAMPLE_RATE):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        if not isinstance(sample_rate, (int, float)) or \
+                not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be a number from 0 to 1: {}"
+                    "".format(sample_rate))
+        self.sample_rate = sample_rate
+        self.file = open(file, "a")
+        self.logger.info("Tracing {:g}% of objects to {}".format(
+                sample_rate * 100, file))
+
+    def write(self, spans: Iterable[Dict[str, Any]]) -> None:
+        self.file.writelines(json.dumps(span) + "\n" for span in spans)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
@@ -1,13 +1,27 @@
 import logging
 from multiprocessing import Lock
-from queue import Queue, Empty
+import random
 import time
-from typing import Optional, Iterable
+from queue import Queue, Empty
+from typing import Optional, Iterable, List, Tuple
 
-from ..CommandQueueCommands import CQC_DIE, CQC_RES
-from ..BaseObject import BaseObject
+from ..CommandQueueCommands import CQC_DIE, CQC_RES, CQC_METRICS, \
+        CQC_PROFILE_START, CQC_PROFILE_STOP
+from ..BaseObject import BaseObject, new_object_id
+from ..BuiltinObjects import SpillAck
+from ..Backpressure import QUEUE_OBJECT_OVERHEAD
+from ..Metrics import ModuleMetrics
+from ..Profiling import ModuleProfiler
+from ..Tracing import make_span, handle_span_id
+from ..ObjectBatcher import ObjectBatcher, unbatch, DEFAULT_BATCH_SIZE, \
+        DEFAULT_BATCH_LINGER
 
-HANDLER_LOOP_SLEEP = .1
+# The longest an InputEndpointModule waits on a closed ingest gate before
+# checking its commands
+INGEST_GATE_WAIT = .1 # seconds
+# The most objects a module handles before acknowledging them to its
+# SpillLog, though it acknowledges what it has whenever it runs out of input
+ACK_BATCH_SIZE = 64
 
 def command_queue_user(func):
     """
@@ -27,41 +41,110 @@ class BaseModule:
     # ReemitterModules and OutputEndpointModules must provide a list
     # of supported object classes here
     supported_objects = [BaseObject]
+    # Set by the framework before the module starts, if its input queue is
+    # limited, to count the objects taken from it
+    input_gauge = None
+    # Set by the framework before the module starts, if its input is
+    # spilled, to the name of the SpillLog to acknowledge objects in
+    spill_log = None
+    # Set by the framework before the module starts, to count the objects
+    # it handles and sends with, so the framework knows when none are left
+    # in flight
+    in_flight = None
+    # Whether objects main takes and doesn't count handled are counted for
+    # it.  Modules keeping objects past their next call to next_objects
+    # set this False, and count everything themselves.
+    auto_count_handled = True
 
     def __init__(self, starting_ttl,
             recv_obj_queue: Queue,
             send_obj_queue: Queue,
             recv_cmd_queue: Queue,
-            processing_lock: Lock):
+            processing_lock: Lock,
+            batch_size: int = DEFAULT_BATCH_SIZE,
+            batch_linger: float = DEFAULT_BATCH_LINGER,
+            input_waiter = None,
+            worker_id: int = 0,
+            worker_count: int = 1,
+            metrics_queue: Optional[Queue] = None,
+            trace_queue: Optional[Queue] = None,
+            trace_sample_rate: float = 0,
+            profile_dir: Optional[str] = None):
         """
         recv_obj_queue:
             the queue via which the framework will send this module objects,
-            and this module will receive them
+            and this module will receive them.  When a module runs as
+            several workers, they all share this queue.
         send_obj_queue:
             the queue via which this module will send the framework objects,
             and the framework will receive them
         recv_cmd_queue:
             the queue via which this module will receive commands
         processing_lock:
-            A lock that is held whenever the module is processing data.
-            When the framework needs to shutdown, it can hold this lock,
-            causing modules to complete processing one object then stop before
-            processing the next.  Then, if the input/output queues are empty,
-            the framework can end without leaving things in the pipeline.
-
-            Right now, this is not important for normal InputEndpointModules,
-            because the framework only tries to exit elegantly when those
-            modules have finished already.  This locking is built-in to
-            modules using the handle_object interface.
+            A lock that is held whenever the module is processing data,
+            so holding it waits for the module to finish what it's on.
+            This locking is built-in to modules using the handle_object
+            interface.  The framework itself tells when nothing is left in
+            the pipeline by counting, with in_flight.  Objects from
+            next_objects that main hasn't counted with count_handled are
+            counted handled at main's next call to next_objects, or when
+            main returns, so modules overriding main needn't count, unless
+            they turn off auto_count_handled.
+        batch_size, batch_linger:
+            Objects this module sends are grouped into lists of up to
+            batch_size objects, and a partial batch waits at most
+            batch_linger seconds before being sent.  A batch_size of 1
+            sends every object on its own.
+        input_waiter:
+            Provided by the framework, its wait method blocks until there
+            may be something to read on recv_obj_queue or recv_cmd_queue
+        worker_id, worker_count:
+            This module instance's number among the workers running it, and
+            how many workers there are
+        metrics_queue:
+            The queue via which this module sends the framework a snapshot
+            of its metrics when commanded to, or None if the framework
+            doesn't collect them
+        trace_queue, trace_sample_rate:
+            The queue via which this module sends the framework the spans
+            of traced objects, or None if the framework doesn't trace
+            objects, and the fraction of objects to trace, for
+            InputEndpointModules
+        profile_dir:
+            Where this module writes profiling stats when commanded to
+            profile itself, or None if it can't be profiled
         """
         self.recv_obj_queue = recv_obj_queue
         self.send_obj_queue = send_obj_queue
         self.recv_cmd_queue = recv_cmd_queue
         self.processing_lock = processing_lock
+        self.send_batcher = ObjectBatcher(send_obj_queue, batch_size,
+                batch_linger, self.count_emitted)
+        self.input_waiter = input_waiter
+        self.worker_id = worker_id
+        self.worker_count = worker_count
+        # This module's name among those configured, its class name
+        # numbered in config order, which the framework sets before the
+        # module starts
+        self.instance_name = "{}-0".format(self.__class__.__name__)
+        self.objects_handled = 0
+        # Objects taken by next_objects not yet counted handled
+        self.uncounted = 0
+        self.acked_ids = []
+        self.metrics_queue = metrics_queue
+        self.metrics = ModuleMetrics()
+        self.trace_queue = trace_queue
+        self.trace_sample_rate = trace_sample_rate
+        self.profiler = None
+        if profile_dir is not None:
+            self.profiler = ModuleProfiler(profile_dir)
 
         self.CMD_HANDLERS = {
                 CQC_DIE: self.command_die,
                 CQC_RES: self.command_log_resources,
+                CQC_METRICS: self.command_send_metrics,
+                CQC_PROFILE_START: self.command_start_profile,
+                CQC_PROFILE_STOP: self.command_stop_profile,
                 }
 
         self.starting_ttl = starting_ttl
@@ -72,13 +155,94 @@ class BaseModule:
         """
         Output, via logging, current resource usage, including queue sizes
         """
-        self.logger.info("Queue sizes - recv obj {} send obj {} recv cmd {}"
-                "".format(self.recv_obj_queue.qsize(),
+        worker_text = ""
+        if self.worker_count > 1:
+            worker_text = "Worker {} of {} - ".format(self.worker_id + 1,
+                    self.worker_count)
+        details = "".join(" - {}".format(detail)
+                for detail in self.resource_details())
+        self.logger.info("{}Queue sizes - recv obj {} send obj {} recv cmd {}"
+                " - objects handled {}{}"
+                "".format(worker_text,
+                        self.recv_obj_queue.qsize(),
                         self.send_obj_queue.qsize(),
-                        self.recv_cmd_queue.qsize()
+                        self.recv_cmd_queue.qsize(),
+                        self.objects_handled,
+                        details,
                         )
                 )
 
+    def command_send_metrics(self) -> None:
+        """
+        Send the framework a snapshot of this module's metrics
+        """
+        if self.metrics_queue is not None:
+            self.metrics_queue.put(self.metrics.snapshot(
+                    self.__class__.__name__, self.instance_name,
+                    self.worker_id))
+
+    def command_start_profile(self) -> None:
+        """
+        Start profiling this module's thread with cProfile, and its
+        process's allocations with tracemalloc
+        """
+        if self.profiler is None:
+            self.logger.warning("Can't profile without a profile directory")
+            return
+        try:
+            # Named once the framework has named this module, so modules
+            # of the same class, in one process, don't share files
+            self.profiler.start("{}-{}".format(self.instance_name,
+                    self.worker_id))
+        except ValueError as e:
+            self.logger.error("Could not start profiling: {}".format(e))
+            return
+        self.logger.info("Started profiling")
+
+    def command_stop_profile(self) -> None:
+        """
+        Stop profiling, and write out the stats
+        """
+        if self.profiler is None or not self.profiler.running:
+            return
+        try:
+            filenames = self.profiler.stop()
+        except OSError as e:
+            self.logger.error("Could not write profile: {}".format(e))
+            return
+        self.logger.info("Stopped profiling, wrote {}".format(
+                ", ".join(filenames)))
+
+    def send_spans(self, spans: List[dict]) -> None:
+        """
+        Send the framework spans of traced objects, to be written out
+        """
+        if self.trace_queue is not None:
+            self.trace_queue.put(spans)
+
+    def trace_handled(self, obj: BaseObject, duration: float) -> None:
+        """
+        Record the spans of a traced object waiting for this module, and
+        of this module handling it, which just took duration seconds
+        """
+        end = time.time()
+        start = end - duration
+        module = self.__class__.__name__
+        span_id = handle_span_id(obj.obj_id, self.instance_name)
+        trace_id, parent_id, queued = obj.trace
+        self.send_spans([
+                make_span("queue", obj, span_id + "/queue", parent_id,
+                    module, self.worker_id, queued, start),
+                make_span("handle", obj, span_id, parent_id,
+                    module, self.worker_id, start, end),
+                ])
+
+    def resource_details(self) -> List[str]:
+        """
+        Override this to add module specific details to the resource log
+        """
+        return []
+
     def command_die(self) -> None:
         """
         Command handler for the CQC_DIE command
@@ -98,18 +262,113 @@ class BaseModule:
         """
         while not self.recv_cmd_queue.empty():
             cmd = self.recv_cmd_queue.get(False)
-            if cmd not in self.CMD_HANDLERS:
-                self.logger.warn(
-                        "Received cmd without handler: {}".format(cmd))
-            else:
-                self.CMD_HANDLERS[cmd]()
+            self.handle_command(cmd)
+
+    def handle_command(self, cmd: str) -> None:
+        """
+        Run the handler for a single command
+        """
+        if cmd not in self.CMD_HANDLERS:
+            self.logger.warn(
+                    "Received cmd without handler: {}".format(cmd))
+        else:
+            self.CMD_HANDLERS[cmd]()
+
+    def next_objects(self, gather: int = 0) -> List[BaseObject]:
+        """
+        Block until the framework sends this module objects, and return
+        them as a list.  Commands received while waiting are handled, and
+        an empty list is returned once the die command arrives.
+
+        gather:
+            Also take whatever else is already waiting, until there are at
+            least this many objects
+        """
+        self.count_uncounted()
+        while True:
+            self.handle_command_queue()
+            if self.time_to_die:
+                return []
+            try:
+                objs = unbatch(self.recv_obj_queue.get(False))
+                break
+            except Empty:
+                self.send_acks()
+                self.input_waiter.wait()
+        while len(objs) < gather:
+            try:
+                objs = objs + unbatch(self.recv_obj_queue.get(False))
+            except Empty:
+                break
+        payload_size = sum(obj.payload_size() for obj in objs)
+        self.uncounted += len(objs)
+        self.metrics.objects_in += len(objs)
+        self.metrics.bytes_in += payload_size
+        if self.input_gauge is not None:
+            self.input_gauge.taken(len(objs),
+                    payload_size + len(objs) * QUEUE_OBJECT_OVERHEAD)
+        return objs
+
+    def flush_objects(self) -> None:
+        """
+        Send the framework any objects waiting in a partial batch
+        """
+        self.send_batcher.flush()
+
+    def count_emitted(self, objs: int) -> None:
+        """
+        Count objects about to be sent to the framework
+        """
+        if self.in_flight is not None:
+            self.in_flight.emitted(objs)
+
+    def count_handled(self, objs: int) -> None:
+        """
+        Count objects taken from the framework as handled, once everything
+        made from them has been sent
+        """
+        self.uncounted = max(self.uncounted - objs, 0)
+        if self.in_flight is not None:
+            self.in_flight.handled(objs)
+
+    def count_uncounted(self) -> None:
+        """
+        Count the objects main took but didn't count as handled, once
+        everything made from them has been sent
+        """
+        if self.uncounted and self.auto_count_handled:
+            self.flush_objects()
+            self.count_handled(self.uncounted)
+
+    def acknowledge(self, objs: List[BaseObject]) -> None:
+        """
+        Mark objs handled, if they came from a SpillLog, to tell the
+        framework so it won't replay them
+        """
+        if self.spill_log is None:
+            return
+        self.acked_ids.extend(obj.obj_id for obj in objs)
+        if len(self.acked_ids) >= ACK_BATCH_SIZE:
+            self.send_acks()
+
+    def send_acks(self) -> None:
+        """
+        Tell the framework which objects have been handled since last time.
+        Everything sent before, like objects made from them, is sent first.
+        """
+        if not self.acked_ids:
+            return
+        self.send_batcher.put(SpillAck(self.spill_log, self.acked_ids))
+        self.send_batcher.flush()
+        self.acked_ids = []
 
     @classmethod
     def can_handle_object(cls, obj: BaseObject) -> bool:
-        for supported_cls in cls.supported_objects:
-            if isinstance(obj, supported_cls):
-                return True
-        return False
+        return cls.can_handle_class(obj.__class__)
+
+    @classmethod
+    def can_handle_class(cls, obj_cls: type) -> bool:
+        return issubclass(obj_cls, tuple(cls.supported_objects))
 
     @command_queue_user
     def framework_still_running(self) -> bool:
@@ -127,33 +386,115 @@ class BaseModule:
         """
         raise RuntimeError("Cannot call main on a base class")
 
+    def run(self, *args, **kwargs) -> None:
+        """
+        The framework starts every module here.  Runs main, and makes sure
+        nothing is left in a partial batch when main returns, that the
+        objects it took are counted handled, that the framework gets this
+        module's last acknowledgements and final metrics, and that a
+        profile still running is written out.
+        """
+        try:
+            self.main(*args, **kwargs)
+        finally:
+            self.flush_objects()
+            self.count_uncounted()
+            self.send_acks()
+            self.command_send_metrics()
+            self.command_stop_profile()
+
 class InputEndpointModule(BaseModule):
     """
     Base class for InputEndpointModules
+
+    When a module downstream has a limited queue, with the policy to
+    block, the framework sets ingest_gate before the module starts, and
+    closes it while that queue is full.  emit and emit_many wait for it to
+    open again.
     """
+    ingest_gate = None
+
+    def wait_for_ingest(self) -> None:
+        """
+        Block while the ingest gate is closed, handling commands, until it
+        opens or the die command arrives
+        """
+        if self.ingest_gate is None or self.ingest_gate.is_set():
+            return
+        # What's already batched up isn't held back
+        self.flush_objects()
+        while not self.ingest_gate.wait(INGEST_GATE_WAIT):
+            self.handle_command_queue()
+            if self.time_to_die:
+                return
+
     def add_to_send_queue(self, obj: BaseObject) -> None:
         """
         Really only for the ReemitterInputEndpointModule...
         """
-        self.send_obj_queue.put(obj)
+        self.metrics.objects_out += 1
+        self.send_batcher.put(obj)
 
     def emit(self, obj: BaseObject) -> None:
         """
         InputEndpointModules use emit to send an object to the framework
         """
-        obj.ttl = self.starting_ttl
-        obj.ancestors = ""
+        self.wait_for_ingest()
+        self.prepare_emit(obj)
         self.add_to_send_queue(obj)
+
+    def emit_many(self, objs: Iterable[BaseObject]) -> None:
+        """
+        Emit several objects at once, sending them together right away
+        """
+        objs = list(objs)
+        self.wait_for_ingest()
+        for obj in objs:
+            self.prepare_emit(obj)
+        self.metrics.objects_out += len(objs)
+        self.send_batcher.put_many(objs)
+
+    def prepare_emit(self, obj: BaseObject) -> None:
+        obj.ttl = self.starting_ttl
+        obj.obj_id = new_object_id()
+        obj.lineage = None
+        obj.trace = None
+        if self.trace_sample_rate and \
+                random.random() < self.trace_sample_rate:
+            self.start_trace(obj)
+
+    def start_trace(self, obj: BaseObject) -> None:
+        """
+        Trace obj, and everything made from it, starting with its emission
+        """
+        now = time.time()
+        obj.trace = (obj.obj_id, obj.obj_id, now)
+        self.send_spans([make_span("emit", obj, obj.obj_id, None,
+                self.__class__.__name__, self.worker_id, now, now)])
     
     @classmethod
     def can_handle_object(cls, *args, **kwargs) -> None:
         raise RuntimeError("Cannot call can_handle_object on "
                 "InputEndpointModule")
 
+    @classmethod
+    def can_handle_class(cls, *args, **kwargs) -> None:
+        raise RuntimeError("Cannot call can_handle_class on "
+                "InputEndpointModule")
+
 class ReemitterModule(BaseModule):
     """
     Base class for ReemitterModules
+
+    When the framework runs with direct_reemit, it sets direct_router
+    before the module starts, and reemitted objects go straight to the
+    modules that handle them
     """
+    direct_router = None
+    # How many waiting objects main takes at once, for modules that handle
+    # several at a time in handle_objects
+    gather_objects = 0
+
     def reemit(self, obj: BaseObject, parent: BaseObject) -> None:
         """
         ReemitterModules use reemit to send 
@@ -161,8 +502,25 @@ class ReemitterModule(BaseModule):
         parent: the object obj is based on
         """
         obj.ttl = parent.ttl-1
-        obj.ancestors = str(parent)
-        self.send_obj_queue.put(obj)
+        obj.obj_id = new_object_id()
+        obj.lineage = parent.lineage_node()
+        if parent.trace is not None:
+            # Made while the parent's handle span is open, which is its
+            # parent span
+            obj.trace = (parent.trace[0], handle_span_id(parent.obj_id,
+                    self.instance_name), time.time())
+        else:
+            obj.trace = None
+        self.metrics.objects_out += 1
+        if self.direct_router is not None:
+            self.direct_router.route(obj)
+        else:
+            self.send_batcher.put(obj)
+
+    def flush_objects(self) -> None:
+        super().flush_objects()
+        if self.direct_router is not None:
+            self.direct_router.flush()
 
     def main(self, *args, **kwargs) -> None:
         """
@@ -172,15 +530,38 @@ class ReemitterModule(BaseModule):
         gets reemitted
         """
         while self.framework_still_running():
+            input_objs = self.next_objects(self.gather_objects)
+            if not input_objs:
+                continue
             with self.processing_lock:
-                while not self.recv_obj_queue.empty():
-                    self.handle_command_queue()
-                    input_obj = self.recv_obj_queue.get()
-                    new_objs = self.handle_object(input_obj, *args, **kwargs)
+                # Objects handled lazily do their work as they're
+                # reemitted, so that's timed too
+                start_time = time.perf_counter()
+                for input_obj, new_objs in self.handle_objects(input_objs,
+                        *args, **kwargs):
                     if new_objs:
                         [self.reemit(new_obj, input_obj)
                                 for new_obj in new_objs]
-            time.sleep(HANDLER_LOOP_SLEEP)
+                    end_time = time.perf_counter()
+                    self.metrics.latency.observe(end_time - start_time)
+                    if input_obj.trace is not None:
+                        self.trace_handled(input_obj, end_time - start_time)
+                    start_time = end_time
+                self.flush_objects()
+                self.acknowledge(input_objs)
+                self.count_handled(len(input_objs))
+                self.objects_handled += len(input_objs)
+
+    def handle_objects(self, input_objs: List[BaseObject], *args, **kwargs) \
+            -> Iterable[Tuple[BaseObject, Iterable[BaseObject]]]:
+        """
+        main passes each list of objects it receives here, and reemits
+        what comes back - pairs of an input object and the objects made
+        from it.  By default, handle_object is called on each in turn.
+        Override this to work on several objects at once.
+        """
+        return ((input_obj, self.handle_object(input_obj, *args, **kwargs))
+                for input_obj in input_objs)
 
     def handle_object(self, input_obj: BaseObject, *args, **kwargs) \
             -> Iterable[BaseObject]:
@@ -201,12 +582,20 @@ class OutputEndpointModule(BaseModule):
         handle_object should be None.
         """
         while self.framework_still_running():
+            input_objs = self.next_objects()
+            if not input_objs:
+                continue
             with self.processing_lock:
-                while not self.recv_obj_queue.empty():
-                    self.handle_command_queue()
-                    input_obj = self.recv_obj_queue.get()
-                    new_objs = self.handle_object(input_obj, *args, **kwargs)
-            time.sleep(HANDLER_LOOP_SLEEP)
+                for input_obj in input_objs:
+                    start_time = time.perf_counter()
+                    self.handle_object(input_obj, *args, **kwargs)
+                    duration = time.perf_counter() - start_time
+                    self.metrics.latency.observe(duration)
+                    if input_obj.trace is not None:
+                        self.trace_handled(input_obj, duration)
+                self.acknowledge(input_objs)
+                self.count_handled(len(input_objs))
+                self.objects_handled += len(input_objs)
 
     def handle_object(self, input_obj: BaseObject, *args, **kwargs) \
             -> Iterable[BaseObject]:
@@ -1,12 +1,19 @@
-from queue import Empty
-import json
+import logging
+from typing import Any, Dict, List, Optional, Union
 
 import msgpack
 import zmq
 
 from ..BuiltinObjects import FluentdRecord, JSONObject, LogEntry
+from ..FileLineReader import FileLineReader
+from ..utilities import convert_bytes_to_str
 from .BaseModules import InputEndpointModule
 
+DEFAULT_POLL_INTERVAL = 1 # seconds
+DEFAULT_ZMQ_RCVHWM = 1000 # messages, ZMQ's own default
+DEFAULT_ZMQ_POLL_TIMEOUT = .5 # seconds
+DEFAULT_ZMQ_MAX_DRAIN = 1000 # messages
+
 class ReemitInputEndpointModule(InputEndpointModule):
     refs = 0
     def __init__(self, *args, **kwargs):
@@ -22,27 +29,87 @@ class ReemitInputEndpointModule(InputEndpointModule):
 
     def main(self):
         while self.framework_still_running():
-            try:
-                obj = self.recv_obj_queue.get(True, 1)
-            except Empty as e:
-                continue
-            self.logger.debug("Emitting obj: {}".format(obj))
-            self.add_to_send_queue(obj)
+            objs = self.next_objects()
+            for obj in objs:
+                # Rendering the object is costly, only do it if it'll show
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("Emitting obj: {}".format(obj))
+                self.add_to_send_queue(obj)
+            self.flush_objects()
+            self.count_handled(len(objs))
 
 # Do not register the ReemitInputEndpointModule
 
 class FluentdJSONFileInputEndpointModule(InputEndpointModule):
     """
     Parse each line in a file as json, emitting FluentdRecords for each
+
+    The file is streamed, so records go out as soon as they're read, and
+    memory use doesn't grow with the file.  Gzip files are decompressed
+    as they're read.
     """
-    def main(self, filename):
-        with open(filename, "r") as f:
-            file_dat = f.read()
+    # Lines read between checks for commands and saves of the offset
+    LINES_PER_CHECK = 1024
 
-        for line in file_dat.split("\n"):
-            if line != "":
-                self.logger.debug("Emitting line: {}".format(line))
-                self.emit(FluentdRecord(line))
+    def emit_line(self, line: bytes) -> None:
+        line = convert_bytes_to_str(line.rstrip(b"\r\n"))
+        if line != "":
+            self.logger.debug("Emitting line: {}".format(line))
+            self.emit(FluentdRecord(line))
+
+    def checkpoint(self, reader: FileLineReader) -> None:
+        """
+        Send everything read so far, then save how far that is
+        """
+        self.flush_objects()
+        reader.save_offset()
+
+    def emit_lines(self, reader: FileLineReader) -> None:
+        """
+        Emit every complete line reader has, stopping early if the
+        framework is shutting down
+        """
+        for line_num, line in enumerate(reader.lines(), 1):
+            self.emit_line(line)
+            if line_num % self.LINES_PER_CHECK == 0:
+                self.checkpoint(reader)
+                if not self.framework_still_running():
+                    return
+
+    def main(self, filename: str, follow: bool = False,
+            offset_file: Optional[str] = None,
+            poll_interval: float = DEFAULT_POLL_INTERVAL):
+        """
+        follow:
+            Keep reading lines as they're written to the file, like
+            tail -F, until the framework shuts down.  When the file is
+            rotated away, the rest of it is read, then the new file at
+            filename is read from the start.
+        offset_file:
+            Where to save how far through the file has been read.  A
+            restart resumes from there, rather than reading the file again.
+        poll_interval:
+            How often to check for new lines when following
+        """
+        reader = FileLineReader(filename, offset_file)
+        try:
+            while self.framework_still_running():
+                self.emit_lines(reader)
+                if not follow:
+                    self.emit_line(reader.remainder())
+                    break
+                self.checkpoint(reader)
+                self.input_waiter.wait(poll_interval)
+                if reader.replaced():
+                    self.emit_lines(reader)
+                    self.emit_line(reader.remainder())
+                    self.logger.info("{} was replaced, reopening it"
+                            "".format(filename))
+                    reader.close()
+                    reader.open()
+        finally:
+            self.checkpoint(reader)
+            reader.close()
 
 class EmitLinesInputEndpointModule(InputEndpointModule):
     """
@@ -52,48 +119,96 @@ class EmitLinesInputEndpointModule(InputEndpointModule):
         for line in text_block.split("\n"):
             self.emit(LogEntry(line))
 
+def decode_fluentd_value(item: Any) -> str:
+    """
+    Return item as a string, decoding it if it's bytes
+    """
+    if isinstance(item, str):
+        return item
+    if isinstance(item, (bytes, bytearray)):
+        return item.decode("utf-8", errors="backslashreplace")
+    return str(item)
+
 class FluentdZMQInputEndpointModule(InputEndpointModule):
-    def byte_input_to_string(self, obj_dict):
-        def try_decode(item):
-            if hasattr(item, "decode"):
-                return item.decode("utf-8", errors="backslashreplace")
-            else:
-                return str(item)
-            return item
-
-        return {try_decode(key): try_decode(dat)
+    def byte_input_to_string(self, obj_dict: Dict[Any, Any]) \
+            -> Dict[str, str]:
+        """
+        Return obj_dict with its keys and values made strings, so the
+        record is a plain JSON object
+        """
+        return {decode_fluentd_value(key): decode_fluentd_value(dat)
                 for key, dat in obj_dict.items()}
 
-    def json_friendlify_input(self, obj_dict):
-        strified_dict = self.byte_input_to_string(obj_dict)
+    def records_from_message(self, data_raw: bytes) -> List[FluentdRecord]:
+        """
+        Return a FluentdRecord for each entry in a Fluentd ZMQ message
+        """
+        key, data_recvd = data_raw.split(b" ", maxsplit=1)
+        # Strings come back as bytes, decoded leniently after, as Fluentd
+        # may send any bytes as a string
+        data = msgpack.unpackb(data_recvd, raw=True)
+        records = []
+        for entry in data:
+            tag, time, entry_obj = entry
+            # The strings are all JSON can hold, so the record can take
+            # the dict as is, without a round trip through JSON text
+            record = self.byte_input_to_string(entry_obj)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Emitting record: {}".format(record))
+            records.append(FluentdRecord(record))
+        return records
 
-        result = None
-        try:
-            # Sometimes stringifying still doesn't permit json parsing
-            # This produces error output for those cases
-            result = json.dumps(strified_dict)
-        except BaseException as e:
-            self.logger.error("JSONing failed for strified obj:\n{}"
-                    "".format(strified_dict))
-            self.logger.exception(e)
-        return result
-
-    def main(self, fluent_zmq_key: str,
+    def main(self, fluent_zmq_key: Union[str, List[str]],
             host: str ="127.0.0.1", port: int = 5556,
-            protocol: str ="tcp"):
+            protocol: str ="tcp", endpoints: Optional[List[str]] = None,
+            rcvhwm: int = DEFAULT_ZMQ_RCVHWM,
+            poll_timeout: float = DEFAULT_ZMQ_POLL_TIMEOUT,
+            max_drain: int = DEFAULT_ZMQ_MAX_DRAIN):
+        """
+        fluent_zmq_key:
+            The key, or a list of keys, to subscribe to
+        host, port, protocol:
+            Where to connect, when endpoints isn't given
+        endpoints:
+            A list of ZMQ endpoints, like "tcp://10.0.0.1:5556", to connect
+            to all of
+        rcvhwm:
+            How many messages ZMQ queues for this module before it drops
+            new ones
+        poll_timeout:
+            Longest to wait for messages before checking for commands, in
+            seconds
+        max_drain:
+            Most messages read, and emitted together, per wakeup
+        """
+        keys = [fluent_zmq_key] if isinstance(fluent_zmq_key, str) \
+                else fluent_zmq_key
+        if endpoints is None:
+            endpoints = ["{}://{}:{}".format(protocol, host, port)]
+
         context = zmq.Context()
         subscriber = context.socket(zmq.SUB)
-        subscriber.connect("{}://{}:{}".format(protocol, host, port))
-        subscriber.setsockopt_string(zmq.SUBSCRIBE, fluent_zmq_key)
+        # Must be set before connecting to apply
+        subscriber.setsockopt(zmq.RCVHWM, rcvhwm)
+        for endpoint in endpoints:
+            subscriber.connect(endpoint)
+        for key in keys:
+            subscriber.setsockopt_string(zmq.SUBSCRIBE, key)
+        poller = zmq.Poller()
+        poller.register(subscriber, zmq.POLLIN)
 
-        while self.framework_still_running():
-            data_raw = subscriber.recv()
-            key, data_recvd = data_raw.split(b" ", maxsplit=1)
-            data = msgpack.unpackb(data_recvd)
-            for entry in data:
-                tag, time, entry_obj = entry
-                friendly_ent = self.json_friendlify_input(entry_obj)
-                if friendly_ent is not None:
-                    self.logger.debug("Emitting string: {}"
-                            "".format(friendly_ent))
-                    self.emit(FluentdRecord(friendly_ent))
+        try:
+            while self.framework_still_running():
+                if not poller.poll(poll_timeout * 1000):
+                    continue
+                records = []
+                for _ in range(max_drain):
+                    try:
+                        data_raw = subscriber.recv(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    records.extend(self.records_from_message(data_raw))
+                self.emit_many(records)
+        finally:
+            subscriber.close(linger=0)
+            context.term()
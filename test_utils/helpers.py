@@ -0,0 +1,84 @@
+"""
+Modules and stand-ins shared by the tests
+"""
+
+import threading
+import time
+
+from recursid.BuiltinObjects import BinaryBlobObject, JSONObject, LogEntry
+from recursid.CommandQueueCommands import CQC_DIE
+from recursid.modules import registerIEM, registerREM, registerOEM
+from recursid.modules.BaseModules import InputEndpointModule, \
+        ReemitterModule, OutputEndpointModule
+from recursid.modules.BuiltinInputEndpointModules import \
+        ReemitInputEndpointModule
+
+class DieWhenIdle:
+    """
+    An input_waiter that commands its module to die once it runs out of
+    objects
+    """
+    def __init__(self, cmd_queue):
+        self.cmd_queue = cmd_queue
+
+    def wait(self, timeout=None):
+        self.cmd_queue.put(CQC_DIE)
+
+class Waker:
+    """
+    Counts how many times it's set, standing in for the router's waker
+    """
+    def __init__(self):
+        self.count = 0
+
+    def set(self):
+        self.count += 1
+
+class EchoReemitterModule(ReemitterModule):
+    supported_objects = [BinaryBlobObject, LogEntry]
+
+    def handle_object(self, input_obj):
+        if isinstance(input_obj, LogEntry):
+            return [LogEntry("echo " + input_obj.log_data)]
+        return [LogEntry("echo")]
+
+class FloodInputEndpointModule(InputEndpointModule):
+    def main(self, count):
+        for num in range(count):
+            self.emit(LogEntry(str(num)))
+
+class ChildReemitterModule(ReemitterModule):
+    supported_objects = [LogEntry]
+
+    def handle_object(self, input_obj):
+        return [JSONObject({"child": input_obj.log_data})]
+
+class CollectOutputEndpointModule(OutputEndpointModule):
+    """
+    Collects what it handles in handled, shared by every instance, so only
+    for frameworks running modules as threads
+    """
+    supported_objects = [LogEntry, JSONObject]
+    lock = threading.Lock()
+    handled = []
+
+    def handle_object(self, input_obj, delay=0):
+        time.sleep(delay)
+        if isinstance(input_obj, JSONObject):
+            data = "child " + input_obj.dat["child"]
+        else:
+            data = input_obj.log_data
+        with self.lock:
+            self.handled.append(data)
+
+registerIEM(FloodInputEndpointModule)
+registerREM(ChildReemitterModule)
+registerOEM(CollectOutputEndpointModule)
+
+def reset_framework_modules():
+    """
+    Let another framework be made in this process, with nothing collected
+    """
+    # Only one framework may run a reemitter at a time
+    ReemitInputEndpointModule.refs = 0
+    CollectOutputEndpointModule.handled = []
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+import os.path
+from queue import Queue
+import tempfile
+import threading
+import time
+import unittest
+
+from recursid.Backpressure import Backlog, InputGauge, queued_size, \
+        QUEUE_OBJECT_OVERHEAD
+from recursid.BuiltinObjects import BinaryBlobObject, DeathLog, LogEntry
+from recursid.CommandQueueCommands import CQC_DIE
+from recursid.MultithreadedFramework import MultithreadedFramework
+from recursid.modules import registerOEM
+from recursid.modules.BaseModules import InputEndpointModule, \
+        OutputEndpointModule
+
+from helpers import CollectOutputEndpointModule, Waker, \
+        reset_framework_modules
+
+OBJECT_COUNT = 300
+
+def log_entries(count, ttl=5):
+    objs = [LogEntry(str(num)) for num in range(count)]
+    for obj in objs:
+        obj.ttl = ttl
+    return objs
+
+def messages(objs):
+    return [obj.log_data for obj in objs]
+
+class NullOutputEndpointModule(OutputEndpointModule):
+    supported_objects = [BinaryBlobObject]
+
+class EmitterInputEndpointModule(InputEndpointModule):
+    pass
+
+class DeathLogCollectOutputEndpointModule(CollectOutputEndpointModule):
+    supported_objects = [DeathLog]
+    handled = []
+
+registerOEM(DeathLogCollectOutputEndpointModule)
+
+class Test_Backpressure(unittest.TestCase):
+    def test_block(self):
+        backlog = Backlog("block", 4, None)
+        objs = log_entries(6)
+        self.assertEqual([backlog.add(obj, (0, 0)) for obj in objs],
+                [[]] * 6)
+        self.assertTrue(backlog.full((0, 0)))
+
+        # Half the limit goes in flight, in order
+        sent, size = backlog.take((0, 0))
+        self.assertEqual(messages(sent), ["0", "1"])
+        self.assertEqual(size, 2 * QUEUE_OBJECT_OVERHEAD)
+        self.assertEqual(backlog.take((2, size)), ([], 0))
+        self.assertEqual(messages(backlog.take((0, 0))[0]), ["2", "3"])
+        self.assertFalse(backlog.full((0, 0)))
+        self.assertEqual(len(backlog), 2)
+
+    def test_drop_newest(self):
+        backlog = Backlog("drop_newest", 4, None)
+        objs = log_entries(6)
+        dropped = [backlog.add(obj, (1, 0)) for obj in objs]
+        self.assertEqual([messages(drops) for drops in dropped],
+                [[], [], [], ["3"], ["4"], ["5"]])
+        self.assertEqual(messages(backlog.take((0, 0))[0]), ["0", "1"])
+
+    def test_drop_oldest(self):
+        backlog = Backlog("drop_oldest", 4, None)
+        objs = log_entries(6)
+        dropped = [backlog.add(obj, (1, 0)) for obj in objs]
+        self.assertEqual([messages(drops) for drops in dropped],
+                [[], [], [], ["0"], ["1"], ["2"]])
+        self.assertEqual(messages(backlog.take((0, 0))[0]), ["3", "4"])
+
+    def test_drop_lowest_ttl(self):
+        backlog = Backlog("drop_lowest_ttl", 3, None)
+        objs = log_entries(2, 5) + log_entries(2, 2) + log_entries(1, 4)
+        for num, obj in enumerate(objs):
+            obj.log_data = str(num)
+        dropped = [backlog.add(obj, (0, 0)) for obj in objs]
+        self.assertEqual([messages(drops) for drops in dropped],
+                [[], [], [], ["2"], ["3"]])
+        # Still sent in the order they arrived
+        self.assertEqual(messages(backlog.take((0, 0))[0]), ["0"])
+        self.assertEqual(messages(backlog.take((0, 0))[0]), ["1"])
+        self.assertEqual(messages(backlog.take((0, 0))[0]), ["4"])
+
+    def test_bytes_limit(self):
+        backlog = Backlog("drop_newest", None, 3 * QUEUE_OBJECT_OVERHEAD +
+                250)
+        objs = [BinaryBlobObject(b"x" * 100) for num in range(4)]
+        for obj in objs:
+            obj.ttl = 5
+        self.assertEqual(queued_size(objs[0]), QUEUE_OBJECT_OVERHEAD + 100)
+        self.assertEqual([len(backlog.add(obj, (0, 0))) for obj in objs],
+                [0, 0, 1, 1])
+        # Half the bytes go in flight, but one object always can
+        self.assertEqual(len(backlog.take((0, 0))[0]), 1)
+        self.assertEqual(len(backlog.take((1, 10 ** 6))[0]), 0)
+
+        huge = BinaryBlobObject(b"x" * 10000)
+        huge.ttl = 5
+        backlog = Backlog("block", None, 1000)
+        backlog.add(huge, (0, 0))
+        self.assertEqual(backlog.take((0, 0))[0], [huge])
+
+    def test_gauge(self):
+        waker = Waker()
+        gauge = InputGauge(waker)
+        gauge.sent(4, 400)
+        gauge.wake_at(2)
+        gauge.taken(1, 100)
+        self.assertEqual(gauge.in_flight(), (3, 300))
+        self.assertEqual(waker.count, 0)
+        gauge.taken(1, 100)
+        self.assertEqual(waker.count, 1)
+        gauge.wake_at(-1)
+        gauge.taken(2, 300)
+        self.assertEqual(waker.count, 1)
+        # Drifted bytes don't count once nothing's in flight
+        self.assertEqual(gauge.in_flight(), (0, 0))
+
+    def test_module_counts_taken(self):
+        recv_queue, cmd_queue = Queue(), Queue()
+        mod = NullOutputEndpointModule(5, recv_queue, Queue(), cmd_queue,
+                threading.Lock())
+        mod.input_gauge = InputGauge()
+        objs = [BinaryBlobObject(b"x" * 10) for num in range(3)]
+        mod.input_gauge.sent(3, sum(queued_size(obj) for obj in objs))
+        recv_queue.put(objs)
+        self.assertEqual(len(mod.next_objects()), 3)
+        self.assertEqual(mod.input_gauge.in_flight(), (0, 0))
+        self.assertEqual(list(mod.input_gauge.counts)[:4],
+                [3, 30 + 3 * QUEUE_OBJECT_OVERHEAD] * 2)
+
+    def test_ingest_gate(self):
+        send_queue, cmd_queue = Queue(), Queue()
+        mod = EmitterInputEndpointModule(5, Queue(), send_queue, cmd_queue,
+                threading.Lock())
+        mod.ingest_gate = threading.Event()
+        mod.ingest_gate.set()
+        mod.emit(LogEntry("open"))
+        self.assertEqual(send_queue.get(False).log_data, "open")
+
+        # A closed gate holds emits back until it opens
+        mod.ingest_gate.clear()
+        thread = threading.Thread(target=mod.emit, args=(LogEntry("held"),))
+        thread.start()
+        thread.join(.3)
+        self.assertTrue(thread.is_alive())
+        self.assertTrue(send_queue.empty())
+        mod.ingest_gate.set()
+        thread.join()
+        self.assertEqual(send_queue.get(False).log_data, "held")
+
+        # Or until the module's told to die
+        mod.ingest_gate.clear()
+        cmd_queue.put(CQC_DIE)
+        mod.emit(LogEntry("dying"))
+        self.assertEqual(send_queue.get(False).log_data, "dying")
+
+class Test_BackpressureFramework(unittest.TestCase):
+    def setUp(self):
+        reset_framework_modules()
+        DeathLogCollectOutputEndpointModule.handled = []
+
+    def run_framework(self, rems, oems, **kwargs):
+        framework = MultithreadedFramework(
+                [("FloodInputEndpointModule", {"count": OBJECT_COUNT})],
+                rems, oems, **kwargs)
+        start = time.monotonic()
+        framework.main()
+        self.assertLess(time.monotonic() - start, 30)
+        return framework
+
+    def test_block(self):
+        # Reemitted objects are never held up, so a slow, limited module
+        # downstream of a limited reemitter can't deadlock the router
+        limit = {"queue_limit": 10, "queue_policy": "block"}
+        framework = self.run_framework(
+                [("ChildReemitterModule", dict(limit))],
+                [("CollectOutputEndpointModule", dict(limit, delay=.001))])
+        expected = [str(num) for num in range(OBJECT_COUNT)]
+        expected += ["child " + data for data in expected]
+        self.assertEqual(sorted(CollectOutputEndpointModule.handled),
+                sorted(expected))
+        self.assertIsNotNone(framework.ingest_gate)
+        self.assertEqual([em["dropped"]
+                for em in framework.rems + framework.oems], [0, 0])
+
+    def test_drop_newest(self):
+        with tempfile.TemporaryDirectory() as directory:
+            metrics_file = os.path.join(directory, "metrics.prom")
+            framework = self.run_framework([], [
+                    ("CollectOutputEndpointModule", {"delay": .002,
+                        "queue_limit": 10, "queue_policy": "drop_newest",
+                        "queue_deathlogs": True}),
+                    ("DeathLogCollectOutputEndpointModule", {})],
+                    metrics={"file": metrics_file})
+            with open(metrics_file) as metrics:
+                metrics_text = metrics.read()
+
+        # Input modules aren't held back, and every object dropped is
+        # counted, and has a DeathLog
+        dropped = framework.oems[0]["dropped"]
+        self.assertGreater(dropped, 0)
+        self.assertEqual(len(CollectOutputEndpointModule.handled) + dropped,
+                OBJECT_COUNT)
+        self.assertEqual(len(DeathLogCollectOutputEndpointModule.handled),
+                dropped)
+        self.assertIsNone(framework.ingest_gate)
+        self.assertRegex(metrics_text, r'recursid_objects_dropped_total\{'
+                r'module="CollectOutputEndpointModule"[^}]*\} ' +
+                str(dropped) + "\n")
+
+    def test_no_direct_reemit(self):
+        # Reemitted objects would skip the backlog
+        with self.assertLogs("MultithreadedFramework", "CRITICAL"), \
+                self.assertRaises(SystemExit):
+            MultithreadedFramework([], [("ChildReemitterModule", {})],
+                    [("CollectOutputEndpointModule", {"queue_limit": 10})],
+                    direct_reemit=True)
+
+if __name__ == "__main__":
+    unittest.main()
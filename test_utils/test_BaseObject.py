@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import pickle
+from textwrap import indent
+import unittest
+
+from recursid.BaseObject import new_object_id
+from recursid.BuiltinObjects import DeathLog, LogEntry
+
+def eager_str(obj, ancestors):
+    """
+    The rendering objects had when ancestors was built as a string
+    on every reemit
+    """
+    return """Object Type: {}\nTTL: {}\nContent:\n{}\nAncestors:\n{}""".format(
+            obj.__class__.__name__, obj.ttl, obj.str_content(),
+            indent(ancestors, "  "))
+
+class Test_Lineage(unittest.TestCase):
+    def make_chain(self, depth):
+        """
+        Build a chain of objects the way emit and reemit would, alongside
+        the ancestors strings the eager scheme made
+        """
+        obj = LogEntry("gen 0")
+        obj.ttl = depth
+        obj.obj_id = new_object_id()
+        obj.lineage = None
+        chain = [(obj, "")]
+        for gen in range(1, depth):
+            parent, parent_ancestors = chain[-1]
+            obj = LogEntry("gen {}".format(gen))
+            obj.ttl = parent.ttl - 1
+            obj.obj_id = new_object_id()
+            obj.lineage = parent.lineage_node()
+            chain.append((obj, eager_str(parent, parent_ancestors)))
+        return chain
+
+    def test_matches_eager_rendering(self):
+        for obj, ancestors in self.make_chain(5):
+            self.assertEqual(obj.ancestors, ancestors)
+            self.assertEqual(str(obj), eager_str(obj, ancestors))
+
+    def test_parent_ids(self):
+        chain = self.make_chain(3)
+        self.assertIsNone(chain[0][0].lineage)
+        self.assertEqual(chain[2][0].lineage.obj_id, chain[1][0].obj_id)
+        self.assertEqual(chain[2][0].lineage.parent.obj_id,
+                chain[0][0].obj_id)
+
+    def test_node_shared_by_siblings(self):
+        parent = self.make_chain(1)[0][0]
+        self.assertIs(parent.lineage_node(), parent.lineage_node())
+
+    def test_death_log(self):
+        obj, ancestors = self.make_chain(3)[-1]
+        death = DeathLog(obj)
+        self.assertEqual(death.ancestors, eager_str(obj, ancestors))
+
+    def test_pickle(self):
+        obj, ancestors = self.make_chain(4)[-1]
+        obj.lineage_node()
+        copy = pickle.loads(pickle.dumps(obj))
+        self.assertIsNone(getattr(copy, "_lineage_node", None))
+        self.assertEqual(str(copy), str(obj))
+
+if __name__ == "__main__":
+    unittest.main()
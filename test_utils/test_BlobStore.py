@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import os.path
+import pickle
+import tempfile
+import unittest
+
+from recursid.BlobStore import BlobStore, activate_store
+from recursid.BuiltinObjects import BinaryBlobObject, DownloadedObject
+
+class Test_BlobStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = BlobStore(self.temp_dir.name, threshold=16, ttl=60)
+
+    def tearDown(self):
+        activate_store(None)
+        self.store.remove_all()
+        self.temp_dir.cleanup()
+
+    def test_put_read(self):
+        content = b"some payload " * 100
+        handle = self.store.put(content)
+        self.assertEqual(os.path.basename(handle.path),
+                hashlib.sha256(content).hexdigest())
+        view = handle.read()
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(bytes(view), content)
+
+        # Storing it again gives the same blob
+        self.assertEqual(self.store.put(content).path, handle.path)
+        self.assertEqual(len(os.listdir(self.store.directory)), 1)
+
+    def test_evict(self):
+        handle = self.store.put(b"x" * 100)
+        self.assertEqual(self.store.evict_expired(), 0)
+        os.utime(handle.path, (0, 0))
+        self.assertEqual(self.store.evict_expired(), 1)
+        self.assertFalse(os.path.exists(handle.path))
+
+    def test_pickle_with_store(self):
+        activate_store(self.store)
+        content = b"MZ downloaded content " * 1000
+        obj = DownloadedObject("http://a.com/", "agent", content)
+
+        pickled = pickle.dumps(obj)
+        self.assertLess(len(pickled), len(content))
+
+        unpickled = pickle.loads(pickled)
+        self.assertEqual(unpickled.hashdig, obj.hashdig)
+        self.assertIsInstance(unpickled.content, memoryview)
+        self.assertEqual(bytes(unpickled.content), content)
+
+        # Passing it along again doesn't copy the content either
+        self.assertLess(len(pickle.dumps(unpickled)), len(content))
+
+    def test_pickle_small_or_no_store(self):
+        content = b"payload " * 100
+        obj = BinaryBlobObject(content)
+        self.assertEqual(pickle.loads(pickle.dumps(obj)).content, content)
+
+        activate_store(self.store)
+        small = BinaryBlobObject(b"tiny")
+        self.assertEqual(pickle.loads(pickle.dumps(small)).content, b"tiny")
+        self.assertEqual(os.listdir(self.store.directory), [])
+
+if __name__ == "__main__":
+    unittest.main()
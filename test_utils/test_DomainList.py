@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import os
+import os.path
+import tempfile
+import unittest
+
+from recursid.DomainList import DomainList
+
+class Test_DomainList(unittest.TestCase):
+    def test_suffix_match(self):
+        domains = DomainList(["google.com", ".Example.org.", "*.test"])
+        for domain in ["google.com", "www.google.com", "a.b.GOOGLE.com.",
+                "example.org", "x.example.org", "user@x.test:8080"]:
+            self.assertIn(domain, domains)
+        for domain in ["evilgoogle.com", "google.com.evil", "com",
+                "example.org.uk", "test1", "[::1]:80"]:
+            self.assertNotIn(domain, domains)
+        self.assertNotIn("google.com", DomainList())
+
+    def test_file_reload(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, "domains")
+            with open(filename, "w") as f:
+                f.write("# blocked\nbad.com\n\nworse.net # really\n")
+            domains = DomainList(["fixed.org"], filename, reload_interval=0)
+            self.assertEqual(len(domains), 3)
+            self.assertIn("a.worse.net", domains)
+
+            with open(filename, "w") as f:
+                f.write("new.com\nworse.net\n")
+            # Make sure the change is seen, whatever the mtime resolution
+            os.utime(filename, ns=(0, 0))
+            self.assertIn("new.com", domains)
+            self.assertNotIn("bad.com", domains)
+            self.assertIn("fixed.org", domains)
+
+            # A missing file keeps the previous domains
+            os.remove(filename)
+            with self.assertLogs("DomainList", "ERROR"):
+                self.assertIn("new.com", domains)
+
+if __name__ == "__main__":
+    unittest.main()
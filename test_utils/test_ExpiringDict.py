@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from recursid.ExpiringDict import ExpiringDict
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+class Test_ExpiringDict(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_expiry(self):
+        cache = ExpiringDict(10, clock=self.clock)
+        cache["a"] = 1
+        self.clock.now = 5
+        cache["b"] = 2
+        self.assertEqual(cache["a"], 1)
+        self.clock.now = 10
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.get("a", "gone"), "gone")
+        self.assertIn("b", cache)
+        self.assertEqual(len(cache), 1)
+        self.clock.now = 15
+        self.assertEqual(len(cache), 0)
+        with self.assertRaises(KeyError):
+            cache["b"]
+
+    def test_refresh(self):
+        cache = ExpiringDict(10, clock=self.clock)
+        cache["a"] = 1
+        cache["b"] = 2
+        self.clock.now = 8
+        self.assertTrue(cache.touch("a"))
+        cache["b"] = 3
+        self.assertFalse(cache.touch("c"))
+        self.clock.now = 12
+        self.assertEqual((cache["a"], cache["b"]), (1, 3))
+        # Refreshed entries moved to the back
+        self.assertEqual(list(cache.entries), ["a", "b"])
+
+    def test_max_size(self):
+        cache = ExpiringDict(None, max_size=2, clock=self.clock)
+        cache["a"] = 1
+        cache["b"] = 2
+        cache["a"] = 3
+        cache["c"] = 4
+        self.assertNotIn("b", cache)
+        self.assertEqual((cache["a"], cache["c"]), (3, 4))
+        self.clock.now = 10 ** 9
+        self.assertEqual(len(cache), 2)
+
+if __name__ == "__main__":
+    unittest.main()
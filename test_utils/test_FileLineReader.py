@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import gzip
+import os
+import os.path
+from queue import Queue
+import tempfile
+import threading
+import time
+import unittest
+
+from recursid.CommandQueueCommands import CQC_DIE
+from recursid.FileLineReader import FileLineReader
+from recursid.ObjectBatcher import unbatch
+from recursid.modules.BuiltinInputEndpointModules import \
+        FluentdJSONFileInputEndpointModule
+
+class SleepWaiter:
+    def wait(self, timeout=None):
+        time.sleep(timeout)
+
+class Test_FileLineReader(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "log.json")
+        self.offset_file = os.path.join(self.temp_dir.name, "offset")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, data, mode="ab"):
+        with open(self.filename, mode) as f:
+            f.write(data)
+
+    def test_partial_line(self):
+        self.write(b"one\ntwo\nthr")
+        reader = FileLineReader(self.filename)
+        self.assertEqual(list(reader.lines()), [b"one\n", b"two\n"])
+        self.write(b"ee\nfour")
+        self.assertEqual(list(reader.lines()), [b"three\n"])
+        self.assertEqual(reader.remainder(), b"four")
+        self.assertEqual(reader.offset, 18)
+        reader.close()
+
+    def test_gzip(self):
+        with gzip.open(self.filename, "wb") as f:
+            f.write(b"one\ntwo\n")
+        reader = FileLineReader(self.filename)
+        self.assertEqual(list(reader.lines()), [b"one\n", b"two\n"])
+        reader.close()
+
+    def test_resume(self):
+        self.write(b"one\ntwo\n")
+        reader = FileLineReader(self.filename, self.offset_file)
+        self.assertEqual(next(reader.lines()), b"one\n")
+        reader.save_offset()
+        reader.close()
+
+        reader = FileLineReader(self.filename, self.offset_file)
+        self.assertEqual(list(reader.lines()), [b"two\n"])
+        reader.close()
+
+        # A different file at the same name is read from the start
+        os.remove(self.filename)
+        self.write(b"new\n", "wb")
+        reader = FileLineReader(self.filename, self.offset_file)
+        self.assertEqual(list(reader.lines()), [b"new\n"])
+        reader.close()
+
+    def test_replaced(self):
+        self.write(b"one\n")
+        reader = FileLineReader(self.filename)
+        list(reader.lines())
+        self.assertFalse(reader.replaced())
+        os.rename(self.filename, self.filename + ".1")
+        self.assertFalse(reader.replaced())
+        self.write(b"new\n")
+        self.assertTrue(reader.replaced())
+        reader.close()
+
+        reader = FileLineReader(self.filename)
+        list(reader.lines())
+        self.write(b"", "wb")
+        self.assertTrue(reader.replaced())
+        reader.close()
+
+class Test_FluentdJSONFileInputEndpointModule(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "log.json")
+        self.send_queue = Queue()
+        self.cmd_queue = Queue()
+        self.module = FluentdJSONFileInputEndpointModule(5, Queue(),
+                self.send_queue, self.cmd_queue, threading.Lock(),
+                input_waiter=SleepWaiter())
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, data, mode="ab"):
+        with open(self.filename, mode) as f:
+            f.write(data)
+
+    def emitted(self):
+        objs = []
+        while not self.send_queue.empty():
+            objs.extend(unbatch(self.send_queue.get()))
+        return [obj.dat["n"] for obj in objs]
+
+    def test_read_once(self):
+        self.write(b'{"n": 1}\r\n\n{"n": 2}')
+        self.module.run(self.filename)
+        self.assertEqual(self.emitted(), [1, 2])
+
+    def test_follow(self):
+        self.write(b'{"n": 1}\n')
+        thread = threading.Thread(target=self.module.run,
+                args=(self.filename,),
+                kwargs={"follow": True, "poll_interval": .01})
+        thread.start()
+        try:
+            self.write(b'{"n": 2}\n{"n"')
+            time.sleep(.1)
+            self.write(b': 3}\n')
+            time.sleep(.1)
+            os.rename(self.filename, self.filename + ".1")
+            with open(self.filename + ".1", "ab") as f:
+                f.write(b'{"n": 4}\n')
+            self.write(b'{"n": 5}\n')
+            time.sleep(.1)
+        finally:
+            self.cmd_queue.put(CQC_DIE)
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(self.emitted(), [1, 2, 3, 4, 5])
+
+if __name__ == "__main__":
+    unittest.main()
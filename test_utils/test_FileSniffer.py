@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import bz2
+import lzma
+import struct
+import unittest
+
+import magic
+
+from recursid.BuiltinObjects import DownloadedObject
+from recursid import FileSniffer
+from recursid.FileSniffer import sniff, describe, filetype_of
+
+def elf(bits=64, order="<", e_type=2, machine=62, osabi=0, flags=0):
+    head = bytearray(64 if bits == 64 else 52)
+    head[0:8] = bytes([0x7f, ord("E"), ord("L"), ord("F"), bits // 32,
+            1 if order == "<" else 2, 1, osabi])
+    struct.pack_into(order + "HHI", head, 16, e_type, machine, 1)
+    struct.pack_into(order + "I", head, 48 if bits == 64 else 36, flags)
+    return bytes(head) + bytes(200)
+
+SAMPLES = [
+    elf(), elf(32, machine=3, e_type=3), elf(e_type=1, osabi=3),
+    elf(e_type=4, machine=183, osabi=9), elf(32, machine=40),
+    elf(32, machine=40, flags=0x05000000), elf(32, ">", machine=20),
+    elf(32, ">", machine=2), elf(32, machine=42),
+    b"#!/bin/sh\necho hi\n", b"#! /bin/sh\n\twget x; chmod +x x\n",
+    b"#!/bin/bash -e\necho hi\n", b"#!/usr/bin/env bash\necho hi\n",
+    b"#!/usr/bin/python3\nprint(1)\n", b"#!/usr/bin/env python2.7\n\n",
+    b"#!/usr/bin/perl\nprint 1;\n",
+    bz2.compress(b"data"), bz2.compress(b"data", 1),
+    lzma.compress(b"data"), lzma.compress(b"data", check=lzma.CHECK_CRC32),
+    b"7z\xbc\xaf\x27\x1c\x00\x04" + bytes(40),
+    ]
+
+# Left to libmagic, as the sniffer can't be sure of its description
+UNSNIFFED = [
+    elf(32, ">", machine=8), b"#!/bin/sh\r\necho hi\r\n",
+    b"#!/bin/sh\necho h\xc3\xa9\n", b"#!/bin/sh\n" + b"a" * 301 + b"\n",
+    b"#!/usr/bin/env sh\necho\n", b"#!/bin/sh", b"MZ" + bytes(200),
+    b"\x89PNG\r\n\x1a\n" + bytes(40),
+    ]
+
+class Test_FileSniffer(unittest.TestCase):
+    def test_matches_libmagic(self):
+        for sample in SAMPLES:
+            self.assertEqual(sniff(sample, len(sample)),
+                    magic.from_buffer(sample))
+
+    def test_unsniffed(self):
+        for sample in UNSNIFFED:
+            self.assertIsNone(sniff(sample, len(sample)))
+            self.assertEqual(describe(sample), magic.from_buffer(sample))
+
+    def test_bounded_head(self):
+        script = b"#!/bin/sh\necho hi\n"
+        # Too long to know the script's whole text from the head
+        self.assertIsNone(sniff(script, len(script) + 1))
+        self.assertEqual(describe(script + b"echo\n" * 20000, 64),
+                magic.from_buffer(script + b"echo\n" * 10))
+
+    def test_cache(self):
+        content = elf()
+        self.assertEqual(filetype_of(content, "cachetest"),
+                "elf 64-bit lsb executable, x86-64, version 1 (sysv)")
+        # A hash already seen isn't described again
+        self.assertEqual(filetype_of(b"", "cachetest"),
+                "elf 64-bit lsb executable, x86-64, version 1 (sysv)")
+
+    def test_downloaded_object(self):
+        # Random bytes would now and then match some signature
+        content = bytes(range(255, -1, -1)) * 4
+        obj = DownloadedObject("http://x/", "a", content)
+        self.assertIsNone(obj._hashdig)
+        self.assertIsNone(obj._filetype)
+        self.assertEqual(obj.filetype, "data")
+        self.assertEqual(len(obj.hashdig), 64)
+        self.assertIn(obj.hashdig, FileSniffer.filetype_cache)
+
+if __name__ == "__main__":
+    unittest.main()
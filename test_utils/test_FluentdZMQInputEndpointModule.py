@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+from queue import Queue
+import threading
+import time
+import unittest
+
+import msgpack
+import zmq
+
+from recursid.CommandQueueCommands import CQC_DIE
+from recursid.ObjectBatcher import unbatch
+from recursid.modules.BuiltinInputEndpointModules import \
+        FluentdZMQInputEndpointModule
+
+def fluentd_message(key, *records):
+    return key + b" " + msgpack.packb([["tag", 0, record]
+            for record in records])
+
+class Test_FluentdZMQInputEndpointModule(unittest.TestCase):
+    def setUp(self):
+        self.context = zmq.Context()
+        self.publishers = []
+        self.send_queue = Queue()
+        self.cmd_queue = Queue()
+        self.module = FluentdZMQInputEndpointModule(5, Queue(),
+                self.send_queue, self.cmd_queue, threading.Lock())
+
+    def tearDown(self):
+        for publisher in self.publishers:
+            publisher.close(linger=0)
+        self.context.term()
+
+    def publisher(self):
+        publisher = self.context.socket(zmq.PUB)
+        port = publisher.bind_to_random_port("tcp://127.0.0.1")
+        self.publishers.append(publisher)
+        return publisher, "tcp://127.0.0.1:{}".format(port)
+
+    def start(self, **kwargs):
+        thread = threading.Thread(target=self.module.run, kwargs=kwargs)
+        thread.start()
+        return thread
+
+    def stop(self, thread):
+        self.cmd_queue.put(CQC_DIE)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def received(self, count, timeout=5):
+        records = []
+        end_time = time.monotonic() + timeout
+        while len(records) < count and time.monotonic() < end_time:
+            if not self.send_queue.empty():
+                records.extend(obj.dat
+                        for obj in unbatch(self.send_queue.get()))
+            else:
+                time.sleep(.01)
+        return records
+
+    def wait_subscribed(self, publisher, key):
+        """
+        Publish probes until one arrives, as subscriptions take a moment to
+        reach the publisher
+        """
+        for _ in range(500):
+            publisher.send(fluentd_message(key, {"probe": "yes"}))
+            if self.received(1, .01):
+                break
+        time.sleep(.05)
+        while not self.send_queue.empty():
+            self.send_queue.get()
+
+    def test_batch_from_endpoints(self):
+        pub_a, endpoint_a = self.publisher()
+        pub_b, endpoint_b = self.publisher()
+        thread = self.start(fluent_zmq_key=["a", "b"],
+                endpoints=[endpoint_a, endpoint_b], poll_timeout=.05)
+        try:
+            self.wait_subscribed(pub_a, b"a")
+            self.wait_subscribed(pub_b, b"b")
+            pub_a.send(fluentd_message(b"a", {b"n": b"1"}, {"n": 2}))
+            pub_b.send(fluentd_message(b"b", {"n": "3"}))
+            pub_b.send(fluentd_message(b"other", {"n": "4"}))
+            records = self.received(3)
+        finally:
+            self.stop(thread)
+        self.assertEqual(sorted(record["n"] for record in records),
+                ["1", "2", "3"])
+
+    def test_undecodable_record(self):
+        # Sent as strings, not binary, as Fluentd does
+        message = b"a " + msgpack.packb([[b"tag", 0,
+                {b"n\xff": b"\xfe1", "m": "2"}]], use_bin_type=False)
+        records = self.module.records_from_message(message)
+        self.assertEqual([record.dat for record in records],
+                [{"n\\xff": "\\xfe1", "m": "2"}])
+
+    def test_quiet_feed_shutdown(self):
+        publisher, endpoint = self.publisher()
+        thread = self.start(fluent_zmq_key="a", endpoints=[endpoint],
+                poll_timeout=.05)
+        time.sleep(.1)
+        st_time = time.monotonic()
+        self.stop(thread)
+        self.assertLess(time.monotonic() - st_time, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import time
+import unittest
+
+from recursid.BuiltinObjects import LogEntry, JSONObject
+from recursid.InFlight import InFlightCounts
+from recursid.MultithreadedFramework import MultithreadedFramework
+from recursid.modules import registerOEM
+from recursid.modules.BaseModules import OutputEndpointModule
+
+from helpers import CollectOutputEndpointModule, Waker, \
+        reset_framework_modules
+
+OBJECT_COUNT = 2000
+
+class UncountedOutputEndpointModule(OutputEndpointModule):
+    """
+    Overrides main, and never counts what it handles
+    """
+    supported_objects = [LogEntry, JSONObject]
+    handled = 0
+
+    def main(self):
+        while self.framework_still_running():
+            UncountedOutputEndpointModule.handled += len(self.next_objects())
+
+registerOEM(UncountedOutputEndpointModule)
+
+class Test_InFlight(unittest.TestCase):
+    def setUp(self):
+        reset_framework_modules()
+
+    def framework(self, delay, **kwargs):
+        return MultithreadedFramework(
+                [("FloodInputEndpointModule", {"count": OBJECT_COUNT})],
+                [("ChildReemitterModule", {})],
+                [("CollectOutputEndpointModule", {"delay": delay,
+                    "batch_size": 16})],
+                **kwargs)
+
+    def test_counts(self):
+        waker = Waker()
+        counts = InFlightCounts(2, waker)
+        first, second = counts.module(0), counts.module(1)
+        first.sent(3)
+        first.handled(2)
+        second.emitted(4)
+        self.assertEqual(counts.snapshot(), [(3, 2, 0), (0, 0, 4)])
+        first.handled(1)
+        self.assertEqual(waker.count, 0)
+
+        # Woken as modules finish, only while watching
+        counts.watch()
+        first.sent(1)
+        first.handled(1)
+        self.assertEqual(waker.count, 1)
+        second.sent(2)
+        second.handled(1)
+        self.assertEqual(waker.count, 1)
+
+    def test_loaded_shutdown(self):
+        framework = self.framework(0)
+        start = time.monotonic()
+        framework.main()
+        self.assertLess(time.monotonic() - start, 30)
+
+        # Every object, and everything made from it, was handled, once
+        expected = [str(num) for num in range(OBJECT_COUNT)]
+        expected += ["child " + data for data in expected]
+        self.assertEqual(sorted(CollectOutputEndpointModule.handled),
+                sorted(expected))
+        self.assertEqual([counts[0] - counts[1]
+                for counts in framework.in_flight.snapshot()], [0] * 4)
+
+    def test_uncounted_main(self):
+        UncountedOutputEndpointModule.handled = 0
+        framework = MultithreadedFramework(
+                [("FloodInputEndpointModule", {"count": OBJECT_COUNT})],
+                [("ChildReemitterModule", {})],
+                [("UncountedOutputEndpointModule", {})],
+                shutdown_timeout=30)
+        start = time.monotonic()
+        framework.main()
+        # Shutdown didn't wait out the deadline for objects never counted
+        self.assertLess(time.monotonic() - start, 15)
+        self.assertEqual(UncountedOutputEndpointModule.handled,
+                2 * OBJECT_COUNT)
+        self.assertEqual([counts[0] - counts[1]
+                for counts in framework.in_flight.snapshot()], [0] * 4)
+
+    def test_deadline(self):
+        framework = self.framework(.002, shutdown_timeout=.5)
+        start = time.monotonic()
+        with self.assertLogs(framework.logger, "WARNING") as logs:
+            framework.main()
+        self.assertLess(time.monotonic() - start, 5)
+
+        # What wasn't handled is counted, so nothing's lost unaccounted for
+        handled = len(CollectOutputEndpointModule.handled)
+        self.assertLess(handled, 2 * OBJECT_COUNT)
+        self.assertIn("WARNING:MultithreadedFramework:{} objects sent to "
+                "CollectOutputEndpointModule were never handled".format(
+                    2 * OBJECT_COUNT - handled), logs.output)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from recursid.BuiltinObjects import FluentdRecord, JSONObject
+from recursid.ObjectCodec import encode, decode
+from recursid.modules.BuiltinInputEndpointModules import \
+        FluentdZMQInputEndpointModule
+
+class Test_JSONObject(unittest.TestCase):
+    def test_lazy_text(self):
+        obj = JSONObject('{"a": [1, 2]}')
+        self.assertIsNone(obj._dat)
+        self.assertEqual(obj.dat, {"a": [1, 2]})
+        self.assertIsNone(obj._json_text)
+        self.assertEqual(obj.str_content(),
+                '{\n  "a": [\n    1,\n    2\n  ]\n}')
+
+    def test_invalid_text_raises_on_access(self):
+        obj = FluentdRecord("not json")
+        with self.assertRaises(ValueError):
+            obj.dat
+
+    def test_mapping(self):
+        dat = {"type": "cowrie", "input": "wget http://a/b"}
+        obj = FluentdRecord(dat)
+        self.assertIs(obj.dat, dat)
+        self.assertEqual(obj.str_content(), FluentdRecord(
+                '{"type": "cowrie", "input": "wget http://a/b"}'
+                ).str_content())
+
+    def test_unparsed_through_codec(self):
+        obj = FluentdRecord('{"type": "cowrie"}')
+        obj.ttl = 1
+        copy = decode(encode(obj))
+        self.assertEqual(copy._json_text, '{"type": "cowrie"}')
+        self.assertEqual(copy.dat, {"type": "cowrie"})
+
+    def test_zmq_record_strings(self):
+        record = FluentdZMQInputEndpointModule.byte_input_to_string(None,
+                {b"type": b"cowrie", "port": 2222, "bad": b"\xff"})
+        self.assertEqual(record,
+                {"type": "cowrie", "port": "2222", "bad": "\\xff"})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import os.path
+from queue import Queue
+import tempfile
+import threading
+import unittest
+import urllib.request
+
+from recursid.BuiltinObjects import BinaryBlobObject
+from recursid.CommandQueueCommands import CQC_METRICS
+from recursid.Metrics import Histogram, MetricsExporter, render_prometheus
+from recursid.MultithreadedFramework import MultithreadedFramework
+
+from helpers import DieWhenIdle, EchoReemitterModule, reset_framework_modules
+
+class Test_Metrics(unittest.TestCase):
+    def test_histogram(self):
+        hist = Histogram((1, 2, 4))
+        for value in [0, 1, 1.5, 2, 3, 100]:
+            hist.observe(value)
+        snap = hist.snapshot()
+        self.assertEqual(snap["counts"], [2, 2, 1, 1])
+        self.assertEqual(snap["sum"], 107.5)
+
+    def test_module_snapshot(self):
+        recv_queue, send_queue, cmd_queue, metrics_queue = \
+                Queue(), Queue(), Queue(), Queue()
+        mod = EchoReemitterModule(5, recv_queue, send_queue, cmd_queue,
+                threading.Lock(), input_waiter=DieWhenIdle(cmd_queue),
+                metrics_queue=metrics_queue)
+        objs = [BinaryBlobObject(content) for content in
+                [b"x" * 10, b"x" * 10, b"x" * 10, b"y" * 5]]
+        for obj in objs:
+            obj.ttl = 5
+        recv_queue.put(objs[:3])
+        recv_queue.put(objs[3])
+
+        # Commanded to, and when it exits, the module sends its metrics
+        cmd_queue.put(CQC_METRICS)
+        mod.handle_command_queue()
+        self.assertEqual(metrics_queue.get(False)["objects_in"], 0)
+        mod.run()
+
+        snap = metrics_queue.get(False)
+        self.assertEqual(snap["module"], "EchoReemitterModule")
+        self.assertEqual(snap["instance"], "EchoReemitterModule-0")
+        self.assertEqual(snap["worker"], 0)
+        self.assertEqual(snap["objects_in"], 4)
+        self.assertEqual(snap["objects_out"], 4)
+        self.assertEqual(snap["bytes_in"], 35)
+        self.assertEqual(snap["errors"], 0)
+        self.assertEqual(sum(snap["latency"]["counts"]), 4)
+        self.assertGreaterEqual(snap["cpu_seconds"], 0)
+        # Running in the test's main thread, the module owns its process
+        self.assertGreater(snap["resident_memory"], 0)
+        self.assertTrue(metrics_queue.empty())
+
+    def test_render(self):
+        hist = Histogram((.1, 1))
+        hist.observe(.05)
+        hist.observe(.5)
+        hist.observe(.5)
+        snapshots = [{"module": "Some\"Module", "instance": "Some-1",
+                    "worker": 1, "objects_in": 3, "errors": 0,
+                    "cpu_seconds": 1.5, "resident_memory": None,
+                    "latency": hist.snapshot()},
+                {"module": "Framework", "instance": "Framework-0",
+                    "worker": 0, "cpu_seconds": 2.0}]
+        lines = render_prometheus(snapshots,
+                [("SomeModule", "SomeModule-1", "in", 7)],
+                [("SomeModule", "SomeModule-1", 3)]).splitlines()
+
+        labels = 'module="Some\\"Module",instance="Some-1",worker="1"'
+        self.assertIn("# TYPE recursid_objects_in_total counter", lines)
+        self.assertIn("recursid_objects_in_total{" + labels + "} 3", lines)
+        self.assertIn("recursid_errors_total{" + labels + "} 0", lines)
+        self.assertIn("recursid_cpu_seconds_total{" + labels + "} 1.5",
+                lines)
+        self.assertIn('recursid_cpu_seconds_total{module="Framework",'
+                'instance="Framework-0",worker="0"} 2.0', lines)
+        self.assertFalse(any(line.startswith("recursid_resident")
+                for line in lines))
+        self.assertIn("# TYPE recursid_handle_seconds histogram", lines)
+        self.assertIn("recursid_handle_seconds_bucket{" + labels +
+                ',le="0.1"} 1', lines)
+        self.assertIn("recursid_handle_seconds_bucket{" + labels +
+                ',le="1"} 3', lines)
+        self.assertIn("recursid_handle_seconds_bucket{" + labels +
+                ',le="+Inf"} 3', lines)
+        self.assertIn("recursid_handle_seconds_count{" + labels + "} 3",
+                lines)
+        self.assertIn('recursid_queue_depth{module="SomeModule",'
+                'instance="SomeModule-1",queue="in"} 7', lines)
+        self.assertIn('recursid_objects_dropped_total{module="SomeModule",'
+                'instance="SomeModule-1"} 3', lines)
+
+    def test_instances(self):
+        reset_framework_modules()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "metrics.prom")
+            framework = MultithreadedFramework(
+                    [("FloodInputEndpointModule", {"count": 10})],
+                    [],
+                    [("CollectOutputEndpointModule", {}),
+                        ("CollectOutputEndpointModule", {})],
+                    metrics={"file": filename})
+            framework.main()
+            with open(filename) as metrics_file:
+                lines = metrics_file.read().splitlines()
+
+        # The same class configured twice gets a series for each
+        for instance in range(2):
+            labels = ('module="CollectOutputEndpointModule",'
+                    'instance="CollectOutputEndpointModule-{}"'.format(
+                        instance))
+            self.assertIn("recursid_objects_in_total{" + labels +
+                    ',worker="0"} 10', lines)
+            self.assertIn("recursid_queue_depth{" + labels +
+                    ',queue="in"} 0', lines)
+
+    def test_exporter(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "metrics.prom")
+            exporter = MetricsExporter(port=0, file=filename)
+            try:
+                text = render_prometheus([{"module": "Mod",
+                        "instance": "Mod-0", "worker": 0, "objects_in": 1}])
+                exporter.publish(text)
+
+                with open(filename) as metrics_file:
+                    self.assertEqual(metrics_file.read(), text)
+                url = "http://127.0.0.1:{}/metrics".format(
+                        exporter.server_port)
+                with urllib.request.urlopen(url) as resp:
+                    self.assertEqual(resp.read().decode(), text)
+            finally:
+                exporter.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+from queue import Queue
+import time
+import unittest
+
+from recursid.BuiltinObjects import LogEntry
+from recursid.ObjectBatcher import ObjectBatcher, unbatch
+
+class Test_ObjectBatcher(unittest.TestCase):
+    def drain(self, queue):
+        items = []
+        while not queue.empty():
+            items.append(queue.get())
+        return items
+
+    def test_unbatched(self):
+        queue = Queue()
+        batcher = ObjectBatcher(queue, 1)
+        objs = [LogEntry(str(num)) for num in range(3)]
+        [batcher.put(obj) for obj in objs]
+        self.assertEqual(self.drain(queue), objs)
+
+    def test_full_batches(self):
+        queue = Queue()
+        batcher = ObjectBatcher(queue, 4, 60)
+        objs = [LogEntry(str(num)) for num in range(10)]
+        [batcher.put(obj) for obj in objs]
+        self.assertEqual(self.drain(queue), [objs[0:4], objs[4:8]])
+
+        batcher.flush()
+        self.assertEqual(self.drain(queue), [objs[8:10]])
+
+    def test_put_many(self):
+        queue = Queue()
+        batcher = ObjectBatcher(queue, 4, 60)
+        objs = [LogEntry(str(num)) for num in range(6)]
+        batcher.put_many(objs)
+        self.assertEqual(self.drain(queue), [objs[0:4], objs[4:6]])
+
+        # Objects put together go together even with batching off
+        batcher = ObjectBatcher(queue, 1)
+        batcher.put_many(objs)
+        batcher.put_many(objs[:1])
+        batcher.put_many([])
+        self.assertEqual(self.drain(queue), [objs, objs[0]])
+
+    def test_linger(self):
+        queue = Queue()
+        batcher = ObjectBatcher(queue, 100, .05)
+        objs = [LogEntry(str(num)) for num in range(3)]
+        [batcher.put(obj) for obj in objs]
+        self.assertTrue(queue.empty())
+
+        self.assertEqual(queue.get(True, 1), objs)
+
+        # A later batch lingers on its own schedule
+        batcher.put(objs[0])
+        st_time = time.monotonic()
+        self.assertEqual(queue.get(True, 1), [objs[0]])
+        self.assertGreaterEqual(time.monotonic() - st_time, .04)
+
+    def test_unbatch(self):
+        obj = LogEntry("one")
+        self.assertEqual(unbatch(obj), [obj])
+        self.assertEqual(unbatch([obj, obj]), [obj, obj])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import tempfile
+import unittest
+
+from recursid.BaseObject import new_object_id
+from recursid.BlobStore import BlobStore, activate_store
+from recursid.BuiltinObjects import LogEntry, DeathLog, JSONObject, \
+        FluentdRecord, URLObject, BinaryBlobObject, DownloadedObject
+from recursid.ObjectCodec import encode, decode, MSGPACK_FORMAT, \
+        PICKLE_FORMAT
+
+class UnregisteredEntry(LogEntry):
+    pass
+
+class Test_ObjectCodec(unittest.TestCase):
+    def emit(self, obj, parent=None):
+        obj.obj_id = new_object_id()
+        if parent is None:
+            obj.ttl = 5
+            obj.lineage = None
+        else:
+            obj.ttl = parent.ttl - 1
+            obj.lineage = parent.lineage_node()
+        return obj
+
+    def assertSameObject(self, copy, obj):
+        self.assertIs(type(copy), type(obj))
+        self.assertEqual(copy.obj_id, obj.obj_id)
+        self.assertEqual(str(copy), str(obj))
+
+    def test_round_trip(self):
+        root = self.emit(FluentdRecord('{"input": "wget http://a/b"}'))
+        url = self.emit(URLObject("http://a/b"), root)
+        downloaded = self.emit(DownloadedObject("http://a/b", "agent",
+                b"\x7fELF" + bytes(range(256))), url)
+        objs = [root, url, downloaded,
+                self.emit(LogEntry("a log line"), downloaded),
+                self.emit(JSONObject('{"a": [1, 2.5, null]}')),
+                self.emit(BinaryBlobObject(b"\x00\x01"), root),
+                DeathLog(downloaded)]
+        for obj in objs:
+            data = encode(obj)
+            self.assertEqual(data[:1], MSGPACK_FORMAT)
+            self.assertSameObject(decode(data), obj)
+
+        copy = decode(encode(downloaded))
+        self.assertEqual(bytes(copy.content), bytes(downloaded.content))
+        self.assertEqual(copy.hashdig, downloaded.hashdig)
+
+    def test_trace(self):
+        traced = self.emit(URLObject("http://a/b"))
+        traced.trace = ("1.0", "1.0/Module", 1234.5)
+        untraced = self.emit(URLObject("http://a/c"))
+        for obj in [traced, untraced, self.emit(UnregisteredEntry("x"))]:
+            self.assertEqual(decode(encode(obj)).trace, obj.trace)
+        copies = decode(encode([traced, untraced]))
+        self.assertEqual([copy.trace for copy in copies],
+                [traced.trace, None])
+
+    def test_batch_shares_lineage(self):
+        parent = self.emit(LogEntry("parent"))
+        children = [self.emit(URLObject("http://a/{}".format(num)), parent)
+                for num in range(3)]
+        copies = decode(encode(children))
+        self.assertEqual(len(copies), 3)
+        for copy, child in zip(copies, children):
+            self.assertSameObject(copy, child)
+        self.assertIs(copies[0].lineage, copies[2].lineage)
+
+    def test_pickle_fallback(self):
+        obj = self.emit(UnregisteredEntry("not registered"))
+        data = encode([obj, self.emit(LogEntry("registered"))])
+        self.assertEqual(data[:1], PICKLE_FORMAT)
+        self.assertSameObject(decode(data)[0], obj)
+
+        # Too big for msgpack
+        obj = self.emit(JSONObject({"a": 123456789012345678901234567890}))
+        data = encode(obj)
+        self.assertEqual(data[:1], PICKLE_FORMAT)
+        self.assertEqual(decode(data).dat, obj.dat)
+
+    def test_values_kept(self):
+        # Numeric keys survive msgpack
+        obj = self.emit(JSONObject({1: "a", "b": [2]}))
+        data = encode(obj)
+        self.assertEqual(data[:1], MSGPACK_FORMAT)
+        self.assertEqual(decode(data).dat, obj.dat)
+
+        # Tuples would come back lists, so they're pickled
+        obj = self.emit(JSONObject({"a": (1, 2), (3, 4): "b"}))
+        data = encode(obj)
+        self.assertEqual(data[:1], PICKLE_FORMAT)
+        self.assertEqual(decode(data).dat, obj.dat)
+
+    def test_blob_handle(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = BlobStore(temp_dir, threshold=16)
+            activate_store(store)
+            try:
+                content = b"large payload " * 10
+                obj = self.emit(BinaryBlobObject(content))
+                data = encode(obj)
+                self.assertNotIn(content, data)
+                copy = decode(data)
+                self.assertIsInstance(copy.content, memoryview)
+                self.assertEqual(bytes(copy.content), content)
+            finally:
+                activate_store(None)
+                store.remove_all()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import os
+import os.path
+import pstats
+from queue import Queue
+import signal
+import socket
+import tempfile
+import threading
+import tracemalloc
+import unittest
+
+from recursid.CommandQueueCommands import CQC_PROFILE_START, \
+        CQC_PROFILE_STOP
+from recursid.modules.BaseModules import OutputEndpointModule
+from recursid.MultithreadedFramework import MultithreadedFramework
+from recursid.Profiling import ModuleProfiler, ProfileControl, \
+        PROFILE_SIGNAL, PROCESS_WIDE_PROFILES
+
+from helpers import reset_framework_modules
+
+def busy_function():
+    return [str(num) for num in range(10000)]
+
+class NullOutputModule(OutputEndpointModule):
+    def handle_object(self, input_obj):
+        pass
+
+class Test_Profiling(unittest.TestCase):
+    def test_profiler(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profiler = ModuleProfiler(tmpdir)
+            other = ModuleProfiler(tmpdir)
+            self.assertEqual(profiler.stop(), [])
+            # Each profiles its own thread, as module workers do
+            other_started = threading.Event()
+            other_stop = threading.Event()
+            def run_other():
+                other.start("Other-0-0")
+                other_started.set()
+                other_stop.wait()
+                other.stop()
+            other_thread = threading.Thread(target=run_other)
+            other_thread.start()
+            other_started.wait()
+
+            profiler.start("Module-0-0")
+            # Where cProfile can only profile the whole process, the two
+            # share its profile
+            self.assertEqual(profiler.profile is other.profile,
+                    PROCESS_WIDE_PROFILES)
+            busy_function()
+            filenames = profiler.stop()
+            # Still tracing allocations for the other
+            self.assertTrue(tracemalloc.is_tracing())
+            other_stop.set()
+            other_thread.join()
+            self.assertFalse(tracemalloc.is_tracing())
+            self.assertFalse(profiler.running)
+
+            self.assertEqual(len(filenames), 3)
+            self.assertTrue(all(os.path.basename(name).startswith(
+                    "Module-0-0-{}-".format(os.getpid()))
+                    for name in filenames))
+            stats = pstats.Stats(filenames[0])
+            self.assertIn("busy_function",
+                    [func[2] for func in stats.stats])
+            snapshot = tracemalloc.Snapshot.load(filenames[1])
+            self.assertFalse(any(frame.filename == tracemalloc.__file__
+                    for trace in snapshot.traces for frame in trace.traceback))
+            self.assertTrue(os.path.getsize(filenames[2]) > 0)
+
+    def test_module_commands(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cmd_queue = Queue()
+            mod = NullOutputModule(5, Queue(), Queue(), cmd_queue,
+                    threading.Lock(), profile_dir=tmpdir)
+            # As the second NullOutputModule configured
+            mod.instance_name = "NullOutputModule-1"
+            cmd_queue.put(CQC_PROFILE_START)
+            mod.handle_command_queue()
+            self.assertTrue(mod.profiler.running)
+            cmd_queue.put(CQC_PROFILE_STOP)
+            mod.handle_command_queue()
+            self.assertFalse(mod.profiler.running)
+            self.assertEqual(len(os.listdir(tmpdir)), 3)
+            self.assertTrue(all(name.startswith("NullOutputModule-1-0-")
+                    for name in os.listdir(tmpdir)))
+
+            # Without a directory, the commands do nothing
+            mod = NullOutputModule(5, Queue(), Queue(), cmd_queue,
+                    threading.Lock())
+            cmd_queue.put(CQC_PROFILE_START)
+            cmd_queue.put(CQC_PROFILE_STOP)
+            mod.handle_command_queue()
+            self.assertIsNone(mod.profiler)
+
+    def test_no_directory(self):
+        reset_framework_modules()
+        with self.assertLogs("MultithreadedFramework", "CRITICAL"), \
+                self.assertRaises(SystemExit):
+            MultithreadedFramework(
+                    [("FloodInputEndpointModule", {"count": 1})], [],
+                    [("CollectOutputEndpointModule", {})],
+                    profiling={"duration": 5})
+
+    def request(self, path, line):
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.connect(path)
+            sock.sendall(line.encode() + b"\n")
+            return sock.makefile().readline().strip()
+
+    def test_control(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "control.sock")
+            previous = signal.getsignal(PROFILE_SIGNAL)
+            control = ProfileControl(tmpdir, path, 5,
+                    lambda module, worker: None if module == "Missing"
+                        else "1 worker")
+            try:
+                self.assertEqual(self.request(path, "profile Mod:1 2.5"),
+                        "profiling 1 worker for 2.5 seconds, writing to "
+                        "{}".format(tmpdir))
+                self.assertEqual(self.request(path, "profile all"),
+                        "profiling 1 worker for 5 seconds, writing to "
+                        "{}".format(tmpdir))
+                for line in ["profile Missing", "profile Mod:x",
+                        "profile Mod -1", "status", ""]:
+                    self.assertTrue(self.request(path, line).startswith(
+                            "error: "))
+                os.kill(os.getpid(), PROFILE_SIGNAL)
+                self.assertEqual(control.pop_requests(), [("Mod", 1, 2.5),
+                        (None, None, 5), (None, None, 5)])
+                self.assertEqual(control.pop_requests(), [])
+            finally:
+                control.close()
+            self.assertFalse(os.path.exists(path))
+            self.assertEqual(signal.getsignal(PROFILE_SIGNAL), previous)
+
+if __name__ == "__main__":
+    unittest.main()
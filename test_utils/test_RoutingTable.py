@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+from queue import Queue
+import unittest
+
+from recursid.BuiltinObjects import LogEntry, DeathLog, FluentdRecord, \
+        JSONObject, URLObject
+from recursid.modules.BuiltinOutputEndpointModules import \
+        LogOutputEndpointModule
+from recursid.modules.BuiltinReemitterModules import \
+        URLParserReemitterModule, LineDoubler
+from recursid.ObjectBatcher import ObjectBatcher
+from recursid.RoutingTable import RoutingTable, DirectRouter
+
+class Test_RoutingTable(unittest.TestCase):
+    def setUp(self):
+        self.targets = [{"module": mod} for mod in
+                [URLParserReemitterModule, LineDoubler,
+                    LogOutputEndpointModule]]
+        self.table = RoutingTable(self.targets)
+
+    def test_lookup(self):
+        url_parser, doubler, log_out = self.targets
+        self.assertEqual(self.table.lookup(LogEntry), [doubler, log_out])
+        self.assertEqual(self.table.lookup(DeathLog), [log_out])
+        self.assertEqual(self.table.lookup(FluentdRecord), [url_parser])
+
+    def test_no_handler(self):
+        self.assertEqual(self.table.lookup(JSONObject), [])
+        self.assertEqual(self.table.lookup(URLObject), [])
+
+    def test_lookup_cached(self):
+        first = self.table.lookup(LogEntry)
+        self.assertIs(self.table.lookup(LogEntry), first)
+
+    def test_subclass(self):
+        class SubLogEntry(LogEntry):
+            pass
+        url_parser, doubler, log_out = self.targets
+        self.assertEqual(self.table.lookup(SubLogEntry), [doubler, log_out])
+
+class Test_DirectRouter(unittest.TestCase):
+    def setUp(self):
+        self.queues = [Queue() for num in range(3)]
+        targets = [{"module": mod, "batcher": ObjectBatcher(queue)}
+                for mod, queue in zip([URLParserReemitterModule, LineDoubler,
+                    LogOutputEndpointModule], self.queues)]
+        self.router = DirectRouter(targets)
+
+    def make_obj(self, cls, *args, ttl=1):
+        obj = cls(*args)
+        obj.ttl = ttl
+        return obj
+
+    def drain(self, queue):
+        items = []
+        while not queue.empty():
+            items.append(queue.get())
+        return items
+
+    def test_route(self):
+        url_parser_q, doubler_q, log_out_q = self.queues
+        obj = self.make_obj(LogEntry, "entry")
+        self.router.route(obj)
+        self.assertEqual(self.drain(url_parser_q), [])
+        self.assertEqual(self.drain(doubler_q), [obj])
+        self.assertEqual(self.drain(log_out_q), [obj])
+
+    def test_death(self):
+        url_parser_q, doubler_q, log_out_q = self.queues
+        self.router.route(self.make_obj(LogEntry, "entry", ttl=-1))
+        self.router.route(self.make_obj(URLObject, "http://a.com/"))
+        self.assertEqual(self.drain(doubler_q), [])
+        deaths = self.drain(log_out_q)
+        self.assertEqual([obj.__class__ for obj in deaths],
+                [DeathLog, DeathLog])
+
+    def test_unhandled_death(self):
+        router = DirectRouter([{"module": LineDoubler,
+            "batcher": ObjectBatcher(self.queues[0])}])
+        router.route(self.make_obj(URLObject, "http://a.com/"))
+        self.assertEqual(self.drain(self.queues[0]), [])
+
+if __name__ == "__main__":
+    unittest.main()
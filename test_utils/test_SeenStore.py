@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import multiprocessing as mp
+import os.path
+import tempfile
+import time
+import unittest
+
+from recursid.SeenStore import SeenStore
+
+def claim_keys(path, keys, results):
+    store = SeenStore(path, "urls", 60)
+    results.put([key for key in keys if store.claim(key)])
+    store.close()
+
+class Test_SeenStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "seen.db")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_claim(self):
+        store = SeenStore(self.path, "urls", 60)
+        self.assertNotIn("a", store)
+        self.assertTrue(store.claim("a"))
+        self.assertFalse(store.claim("a"))
+        self.assertIn("a", store)
+        store.close()
+
+    def test_restart_and_namespaces(self):
+        store = SeenStore(self.path, "urls")
+        store.add("a")
+        store.close()
+
+        store = SeenStore(self.path, "urls")
+        self.assertIn("a", store)
+        self.assertFalse(store.claim("a"))
+        other = SeenStore(self.path, "hashes")
+        self.assertNotIn("a", other)
+        store.close()
+        other.close()
+
+    def test_expiry(self):
+        store = SeenStore(self.path, "urls", .05)
+        other = SeenStore(self.path, "urls", .05)
+        self.assertTrue(store.claim("a"))
+        self.assertIn("a", other)
+        time.sleep(.1)
+        self.assertNotIn("a", store)
+        self.assertNotIn("a", other)
+        self.assertTrue(other.claim("a"))
+        self.assertFalse(store.claim("a"))
+        store.close()
+        other.close()
+
+    def test_processes_claim_once(self):
+        keys = ["url{}".format(num) for num in range(200)]
+        results = mp.Queue()
+        procs = [mp.Process(target=claim_keys,
+                args=(self.path, keys, results)) for _ in range(4)]
+        for proc in procs:
+            proc.start()
+        claimed = [key for _ in procs for key in results.get(timeout=30)]
+        for proc in procs:
+            proc.join()
+        self.assertEqual(sorted(claimed), sorted(keys))
+
+if __name__ == "__main__":
+    unittest.main()
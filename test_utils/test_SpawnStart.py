@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import json
+import multiprocessing as mp
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The start method is set once per process, so each run gets its own
+RUN_PIPELINE = """
+import json
+import multiprocessing as mp
+import sys
+
+from recursid.MultiprocessFramework import MultiprocessFramework
+
+if __name__ == "__main__":
+    mp.set_start_method(sys.argv[1])
+    directory = sys.argv[2]
+    framework = MultiprocessFramework(
+            [("EmitLinesInputEndpointModule", {"text_block": "a\\nb\\nc"})],
+            [("LineDoubler", {"batch_size": 4})],
+            [("LogOutputEndpointModule", {"level": "INFO"})],
+            metrics={"file": directory + "/metrics.prom"},
+            tracing={"file": directory + "/trace.jsonl", "sample_rate": 1},
+            profiling={"directory": directory + "/profiles"},
+            spill={"directory": directory + "/spill"})
+    framework.main()
+    print(json.dumps({em["module"].__name__:
+            framework.in_flight.snapshot()[em["in_flight"].slot]
+            for em in framework.all_modules()}))
+"""
+
+class Test_SpawnStart(unittest.TestCase):
+    def run_pipeline(self, start_method):
+        with tempfile.TemporaryDirectory() as directory:
+            result = subprocess.run([sys.executable, "-c", RUN_PIPELINE,
+                    start_method, directory], cwd=REPO_DIR,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    timeout=60, check=True)
+            with open(os.path.join(directory, "metrics.prom")) as metrics:
+                self.assertIn("LogOutputEndpointModule", metrics.read())
+        counts = json.loads(result.stdout.decode().splitlines()[-1])
+        # Sent, handled, emitted - LineDoubler handles what it makes too,
+        # until it runs out of TTL
+        self.assertEqual(counts["EmitLinesInputEndpointModule"], [0, 0, 3])
+        sent, handled, emitted = counts["LineDoubler"]
+        self.assertGreater(handled, 3)
+        self.assertEqual(sent, handled)
+        sent, handled, emitted = counts["LogOutputEndpointModule"]
+        self.assertGreater(handled, 3)
+        self.assertEqual(sent, handled)
+
+    def test_spawn(self):
+        self.run_pipeline("spawn")
+
+    @unittest.skipUnless("forkserver" in mp.get_all_start_methods(),
+            "No forkserver start method here")
+    def test_forkserver(self):
+        self.run_pipeline("forkserver")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import os
+from queue import Queue
+import tempfile
+import threading
+import unittest
+
+from recursid.BuiltinObjects import BinaryBlobObject, LogEntry, SpillAck
+from recursid.ObjectBatcher import unbatch
+from recursid.SpillLog import SpillLog
+
+from helpers import DieWhenIdle, EchoReemitterModule
+
+def log_entries(count):
+    objs = []
+    for num in range(count):
+        obj = LogEntry(str(num))
+        obj.ttl = 5
+        obj.obj_id = "id{}".format(num)
+        objs.append(obj)
+    return objs
+
+def log_data(objs):
+    return [obj.log_data for obj in objs]
+
+class Test_SpillLog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmpdir.name, "Module-0")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_take_and_acknowledge(self):
+        spill_log = SpillLog(self.directory)
+        spill_log.add(log_entries(3))
+        self.assertEqual(len(spill_log), 3)
+
+        objs, size = spill_log.take(2, 10 ** 6)
+        self.assertEqual(log_data(objs), ["0", "1"])
+        self.assertGreater(size, 0)
+        self.assertEqual(len(spill_log), 1)
+        self.assertEqual(spill_log.unacknowledged(), 3)
+
+        spill_log.acknowledge(["id0", "id1", "unknown"])
+        self.assertEqual(spill_log.unacknowledged(), 1)
+        spill_log.acknowledge(["id0"])
+        self.assertEqual(spill_log.unacknowledged(), 1)
+        objs, size = spill_log.take(5, 10 ** 6)
+        spill_log.acknowledge(["id2"])
+        self.assertEqual(spill_log.unacknowledged(), 0)
+
+        # With everything acknowledged, nothing's left on disk
+        spill_log.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_spills_past_memory(self):
+        objs = [BinaryBlobObject(b"x" * 1000) for num in range(5)]
+        for num, obj in enumerate(objs):
+            obj.ttl = 5
+            obj.obj_id = "id{}".format(num)
+        spill_log = SpillLog(self.directory, memory=2500)
+        spill_log.add(objs[:2])
+        spill_log.add(objs[2:])
+        # Only the newest is held in memory
+        self.assertEqual([entry[3] for entry in spill_log.pending],
+                [None] * 4 + [objs[4]])
+
+        # Objects left on disk are read back, in order
+        taken, size = spill_log.take(5, 10 ** 6)
+        self.assertEqual([obj.obj_id for obj in taken],
+                ["id{}".format(num) for num in range(5)])
+        self.assertEqual(taken[0].content, b"x" * 1000)
+        self.assertIsNot(taken[0], objs[0])
+        self.assertIs(taken[4], objs[4])
+        self.assertEqual(spill_log.pending_memory, 0)
+
+        # One object goes, however big, but no more past the limit
+        spill_log.add(objs)
+        self.assertEqual(len(spill_log.take(5, 1)[0]), 1)
+        self.assertEqual(len(spill_log.take(5, 0)[0]), 0)
+        spill_log.close()
+
+    def test_replay(self):
+        spill_log = SpillLog(self.directory, segment_size=30)
+        spill_log.add(log_entries(2))
+        spill_log.add(log_entries(4)[2:])
+        self.assertEqual(len(spill_log.live), 3)
+        spill_log.take(3, 10 ** 6)
+        spill_log.acknowledge(["id0", "id2"])
+        # A crash, part way through writing a record
+        os.write(spill_log.writer, b"\x10\x00")
+        os.close(spill_log.writer)
+
+        spill_log = SpillLog(self.directory)
+        self.assertEqual(len(spill_log), 2)
+        objs, size = spill_log.take(5, 10 ** 6)
+        self.assertEqual(log_data(objs), ["1", "3"])
+        # IDs from the last run may be handed out again
+        self.assertNotIn(objs[0].obj_id, ["id1", "id3"])
+        spill_log.acknowledge([obj.obj_id for obj in objs])
+        self.assertEqual(spill_log.unacknowledged(), 0)
+        spill_log.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_module_acknowledges(self):
+        recv_queue, send_queue, cmd_queue = Queue(), Queue(), Queue()
+        mod = EchoReemitterModule(5, recv_queue, send_queue, cmd_queue,
+                threading.Lock(), input_waiter=DieWhenIdle(cmd_queue))
+        mod.spill_log = "EchoReemitterModule-0"
+        for obj in log_entries(2):
+            recv_queue.put(obj)
+        mod.run()
+
+        sent = []
+        while not send_queue.empty():
+            sent.extend(unbatch(send_queue.get(False)))
+        # Acknowledged once the module runs out of input, after what it
+        # made from them
+        self.assertEqual(log_data(sent[:2]), ["echo 0", "echo 1"])
+        self.assertIsInstance(sent[2], SpillAck)
+        self.assertEqual(sent[2].log, "EchoReemitterModule-0")
+        self.assertEqual(sent[2].obj_ids, ["id0", "id1"])
+        self.assertEqual(len(sent), 3)
+
+if __name__ == "__main__":
+    unittest.main()
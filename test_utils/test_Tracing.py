@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import json
+import os.path
+from queue import Queue
+import tempfile
+import threading
+import unittest
+
+from recursid.BuiltinObjects import LogEntry, URLObject
+from recursid.ObjectBatcher import unbatch
+from recursid.modules.BaseModules import InputEndpointModule, \
+        ReemitterModule
+from recursid.Tracing import TraceExporter
+
+from helpers import DieWhenIdle
+
+class EmitterModule(InputEndpointModule):
+    def main(self, count):
+        self.emit_many(LogEntry(str(num)) for num in range(count))
+
+class SplitterModule(ReemitterModule):
+    supported_objects = [LogEntry]
+
+    def handle_object(self, input_obj):
+        return [URLObject("http://a/" + input_obj.log_data),
+                URLObject("http://b/" + input_obj.log_data)]
+
+class Test_Tracing(unittest.TestCase):
+    def make_module(self, mod, sample_rate):
+        queues = {"recv": Queue(), "send": Queue(), "cmd": Queue(),
+                "trace": Queue()}
+        module = mod(5, queues["recv"], queues["send"], queues["cmd"],
+                threading.Lock(), input_waiter=DieWhenIdle(queues["cmd"]),
+                trace_queue=queues["trace"], trace_sample_rate=sample_rate)
+        return module, queues
+
+    def drain(self, queue):
+        items = []
+        while not queue.empty():
+            items.extend(unbatch(queue.get()))
+        return items
+
+    def test_sampling(self):
+        emitter, queues = self.make_module(EmitterModule, 0)
+        emitter.run(10)
+        self.assertTrue(all(obj.trace is None
+                for obj in self.drain(queues["send"])))
+        self.assertTrue(queues["trace"].empty())
+
+        emitter, queues = self.make_module(EmitterModule, .5)
+        emitter.run(1000)
+        traced = [obj for obj in self.drain(queues["send"])
+                if obj.trace is not None]
+        spans = self.drain(queues["trace"])
+        self.assertTrue(300 < len(traced) < 700)
+        self.assertEqual([span["object_id"] for span in spans],
+                [obj.obj_id for obj in traced])
+
+    def test_reemit_chain(self):
+        emitter, queues = self.make_module(EmitterModule, 1)
+        emitter.run(2)
+        roots = self.drain(queues["send"])
+        emit_spans = self.drain(queues["trace"])
+        self.assertEqual([span["name"] for span in emit_spans],
+                ["emit", "emit"])
+        self.assertEqual(emit_spans[0]["span_id"], roots[0].obj_id)
+        self.assertIsNone(emit_spans[0]["parent_id"])
+
+        roots[1].trace = None
+        splitter, queues = self.make_module(SplitterModule, 0)
+        # As the second SplitterModule configured
+        splitter.instance_name = "SplitterModule-1"
+        queues["recv"].put(roots)
+        splitter.run()
+        children = self.drain(queues["send"])
+        spans = self.drain(queues["trace"])
+
+        root = roots[0]
+        handle_id = root.obj_id + "/SplitterModule-1"
+        self.assertEqual([child.trace[:2] for child in children[:2]],
+                [(root.obj_id, handle_id)] * 2)
+        self.assertEqual([child.trace for child in children[2:]],
+                [None, None])
+        self.assertEqual([(span["name"], span["span_id"], span["parent_id"])
+                    for span in spans],
+                [("queue", handle_id + "/queue", root.obj_id),
+                    ("handle", handle_id, root.obj_id)])
+        queue_span, handle_span = spans
+        self.assertEqual(queue_span["start"], root.trace[2])
+        self.assertEqual(queue_span["end"], handle_span["start"])
+        self.assertLessEqual(handle_span["start"], handle_span["end"])
+        self.assertEqual(handle_span["trace_id"], root.obj_id)
+        self.assertEqual(handle_span["module"], "SplitterModule")
+        self.assertEqual(handle_span["object_type"], "LogEntry")
+
+    def test_exporter(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "trace.jsonl")
+            exporter = TraceExporter(filename, .25)
+            exporter.write([{"span_id": "a"}, {"span_id": "b"}])
+            exporter.close()
+            with open(filename) as trace_file:
+                self.assertEqual([json.loads(line) for line in trace_file],
+                        [{"span_id": "a"}, {"span_id": "b"}])
+
+            with self.assertRaises(ValueError):
+                TraceExporter(filename, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
 import json
+import os.path
+import random
+import re
 import unittest
 
 from recursid.modules.BuiltinReemitterModules import \
@@ -8,6 +11,14 @@ from recursid.modules.BuiltinReemitterModules import \
 
 from recursid.BuiltinObjects import FluentdRecord, DownloadedObject
 
+# The extractor's previous pattern, which its results must match
+REFERENCE_RE = re.compile(rb"(https?(?::|%3A)(?:/|%2F)(?:/|%2F).*?)"
+        rb"(?:\+|\s|%20|;|%3b|\"|%22|\'|%27|$)")
+FUZZ_PIECES = [b"http://", b"https%3A%2F/", b"http", b"https", b":", b"//",
+        b"%3A", b"%2F", b"/", b"%",
+        b"%20", b"%3b", b"%3B", b"%22", b"%27", b"+", b";", b"\"", b"'",
+        b" ", b"\n", b"\r\n", b"\t", b"x.com", b"\x00", b"\xff", b"h"]
+
 class Test_Reemitter(unittest.TestCase):
     url_test = [
             ("https://all.kinds/asdf.lwej?qwer",
@@ -68,6 +79,27 @@ class Test_Reemitter(unittest.TestCase):
             self.assertEqual(mod.find_urls_in_bytes(in_dat.encode()),
                     [od.encode() for od in out_dat])
 
+    def test_matches_reference(self):
+        mod = URLParserReemitterModule(0, None, None, None, None)
+        with open(os.path.join(os.path.dirname(__file__),
+                "test_file_html"), "rb") as f:
+            corpora = [f.read()]
+        corpora.extend(in_dat.encode() for in_dat, _ in self.url_test)
+        rand = random.Random(18)
+        corpora.extend(b"".join(rand.choices(FUZZ_PIECES, k=60))
+                for _ in range(3000))
+        for data in corpora:
+            self.assertEqual(mod.url_bytes_re.findall(data),
+                    REFERENCE_RE.findall(data), data)
+
+    def test_limit(self):
+        mod = URLParserReemitterModule(0, None, None, None, None)
+        data = memoryview(b"http://a/ http://a/ http://b/ http://c/")
+        self.assertEqual(mod.find_urls_in_bytes(data, 2),
+                [b"http://a/", b"http://a/", b"http://b/"])
+        self.assertEqual(len(mod.handle_object(
+                DownloadedObject("", "", data), limit_url_count=2)), 2)
+
     def test_url_in_objs(self):
         # Test out the finder via fluent/downloaded objects
         mod = URLParserReemitterModule(0, None, None, None, None)
@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
 
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os.path
+import tempfile
+import threading
+import time
 import unittest
 
 from recursid.BuiltinObjects import URLObject, DownloadedObject, LogEntry
+from recursid.SeenStore import SeenStore
 from recursid.modules.DownloadReemitterModule import \
-        DownloadURLReemitterModule
+        DownloadURLReemitterModule, DownloadPool
 
 MAX_DL_SIZE = 1024 * 3
 USER_AGENTS = ["Nothing"]
@@ -57,5 +63,159 @@ class Test_Download(unittest.TestCase):
             print(ret_val)
             self.assertEqual(len(ret_val), 0)
 
+class SlowHandler(BaseHTTPRequestHandler):
+    """
+    Answers after a delay, with content depending on the path, and on
+    whether the user agent is "other"
+    """
+    # Keep connections alive
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.running += 1
+            server.max_running = max(server.max_running, server.running)
+        time.sleep(server.delay)
+        with server.lock:
+            server.running -= 1
+        body = "{} for {}".format(self.path,
+                "other" if self.headers["user-agent"] == "other" else "any")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+class Test_ConcurrentDownload(unittest.TestCase):
+    delay = .2
+
+    def setUp(self):
+        self.servers = []
+        for _ in range(2):
+            server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+            server.delay = self.delay
+            server.lock = threading.Lock()
+            server.running = server.max_running = 0
+            threading.Thread(target=server.serve_forever,
+                    daemon=True).start()
+            self.servers.append(server)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def urls(self, count):
+        return ["http://127.0.0.1:{}/{}".format(
+                    self.servers[num % 2].server_port, num)
+                for num in range(count)]
+
+    def test_concurrent(self):
+        user_agents = ["a", "other", "b"]
+        mod = DownloadURLReemitterModule(0, None, None, None, None)
+        mod.start_downloader(max_concurrent=8, max_domain_concurrent=2)
+        url_objs = [URLObject(url) for url in self.urls(4)]
+
+        st_time = time.monotonic()
+        results = list(mod.handle_objects(url_objs + url_objs[:1],
+                MAX_DL_SIZE, user_agents, []))
+        elapsed = time.monotonic() - st_time
+        mod.download_pool.shutdown()
+
+        # 12 downloads, 2 at a time from each of 2 servers
+        self.assertLess(elapsed, self.delay * 5)
+        self.assertEqual([server.max_running for server in self.servers],
+                [2, 2])
+
+        self.assertEqual([input_obj for input_obj, _ in results],
+                url_objs + url_objs[:1])
+        # Already downloaded in this batch
+        self.assertEqual(results[-1][1], [])
+        for url_obj, new_objs in results[:-1]:
+            downloads = sorted((obj.content, obj.user_agent)
+                    for obj in new_objs
+                    if isinstance(obj, DownloadedObject))
+            path = url_obj.url[url_obj.url.rindex("/"):]
+            self.assertEqual(downloads, [
+                    ("{} for any".format(path).encode(), "a, b"),
+                    ("{} for other".format(path).encode(), "other"),
+                    ])
+            self.assertEqual(len([obj for obj in new_objs
+                    if isinstance(obj, LogEntry)]), 2)
+
+    def test_connection_reuse(self):
+        mod = DownloadURLReemitterModule(0, None, None, None, None)
+        mod.start_downloader(max_domain_concurrent=1)
+        urls = self.urls(2)
+        mod.handle_object(URLObject(urls[0]), MAX_DL_SIZE, ["a", "b", "c"],
+                [])
+        self.assertEqual(mod.http_adapter.pool_counts(), (2, 1))
+
+        # An idle host's connections are closed
+        mod.pool_idle_timeout = 0
+        mod.handle_object(URLObject(urls[0] + "?again"), MAX_DL_SIZE, ["a"],
+                [])
+        self.assertEqual(mod.http_adapter.pool_counts(), (2, 2))
+        self.assertEqual(mod.resource_details(),
+                ["connection pool hits 2 misses 2"])
+        mod.download_pool.shutdown()
+        mod.session.close()
+
+    def test_shared_seen_store(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "seen.db")
+            mods = []
+            for _ in range(2):
+                mod = DownloadURLReemitterModule(0, None, None, None, None)
+                mod.seen_urls = SeenStore(path, "download_urls", 60)
+                mods.append(mod)
+            url_obj = URLObject(self.urls(1)[0])
+            self.assertTrue(mods[0].handle_object(url_obj, MAX_DL_SIZE,
+                    ["a"], []))
+            # Another worker, or this one restarted, doesn't download it
+            self.assertEqual(mods[1].handle_object(url_obj, MAX_DL_SIZE,
+                    ["a"], []), [])
+            for mod in mods:
+                mod.download_pool.shutdown()
+                mod.session.close()
+                mod.seen_urls.close()
+
+    def test_domain_lists(self):
+        mod = DownloadURLReemitterModule(0, None, None, None, None)
+        urls = ["http://{}/".format(host) for host in
+                ["localhost", "sub.localhost", "evillocalhost", "127.0.0.1"]]
+        new_objs = [mod.handle_object(URLObject(url), MAX_DL_SIZE, ["a"],
+                ["localhost"], domain_whitelist=["localhost",
+                    "evillocalhost"])
+                for url in urls]
+        # Only evillocalhost is allowed, and it doesn't resolve
+        self.assertEqual(new_objs, [[], [], [], []])
+        self.assertEqual(list(mod.recent_downloads.entries), [urls[2]])
+        mod.download_pool.shutdown()
+        mod.session.close()
+
+    def test_domain_limit(self):
+        pool = DownloadPool(max_concurrent=4, max_per_domain=1)
+        running = []
+        lock = threading.Lock()
+        def work(domain):
+            with lock:
+                running.append(domain)
+                concurrent = running.count(domain)
+            time.sleep(.05)
+            with lock:
+                running.remove(domain)
+            return concurrent
+        futures = [pool.submit(domain, work, domain)
+                for domain in ["a", "a", "a", "b", "b"]]
+        self.assertEqual([future.result() for future in futures],
+                [1] * 5)
+        pool.shutdown()
+        self.assertEqual(pool.active, {})
+        self.assertEqual(pool.waiting, {})
+
 if __name__ == "__main__":
     unittest.main()